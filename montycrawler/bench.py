@@ -0,0 +1,445 @@
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Montycrawler benchmarks.
+
+All benchmarks run against a local HTTP server with synthetic content,
+so they don't need network access.
+
+Usage:
+    python bench.py BENCHMARK [options]
+    Use option --help for details.
+
+Benchmarks:
+    memory: Peak RSS fetching and processing large PDFs with many threads.
+    pdf: CPU time processing PDFs in each processing mode.
+    triage: Bytes transferred scoring PDFs with and without range requests.
+    startup: Time from process start to the first request of mc.py.
+    soak: Resident memory of mc.py crawling a synthetic site for a long time.
+    contention: Throughput of the queue against the number of dispatcher threads.
+
+"""
+
+from optparse import OptionParser
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from threading import Thread
+from functools import partial
+import subprocess
+import resource
+from io import BytesIO
+import tempfile
+import random
+import re
+import time
+import shutil
+import sys
+import os
+
+
+def make_pdf(title, texts, padding=0):
+    """Build a minimal PDF document.
+
+    Args:
+        title: Title in the document info.
+        texts: List of page texts.
+        padding: Size in bytes of an extra unreferenced stream to make the file bigger.
+
+    Returns:
+        The document (bytes).
+    """
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>',
+               ('<< /Type /Pages /Kids [%s] /Count %d >>' %
+                (' '.join('%d 0 R' % (5 + 2 * i) for i in range(len(texts))), len(texts))).encode(),
+               ('<< /Title (%s) >>' % title).encode(),
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    for i, text in enumerate(texts):
+        stream = ('BT /F1 12 Tf 72 720 Td (%s) Tj ET' % text).encode()
+        objects.append(('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                        '/Resources << /Font << /F1 4 0 R >> >> /Contents %d 0 R >>' % (6 + 2 * i)).encode())
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+    if padding:
+        objects.append(b'<< /Length %d >>\nstream\n' % padding + b'0' * padding + b'\nendstream')
+    body = b'%PDF-1.4\n'
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(body))
+        body += b'%d 0 obj\n' % (i + 1) + obj + b'\nendobj\n'
+    xref = len(body)
+    body += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    body += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    body += b'trailer\n<< /Size %d /Root 1 0 R /Info 3 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return body
+
+
+def serve(folder, handler=None):
+    """Start a local HTTP server in background.
+
+    Args:
+        folder: Folder to serve.
+        handler: Request handler class (`QuietHandler` by default).
+
+    Returns:
+        Base URL of the server.
+    """
+    handler = partial(handler or QuietHandler, directory=folder)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%d/' % server.server_address[1]
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Request handler without access logs."""
+    def log_message(self, *args):
+        pass
+
+
+class RangeHandler(QuietHandler):
+    """Request handler supporting single byte ranges."""
+    def send_head(self):
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if not match or not os.path.isfile(path):
+            return QuietHandler.send_head(self)
+        f = open(path, 'rb')
+        fs = os.fstat(f.fileno())
+        modified = self.date_time_string(fs.st_mtime)
+        if self.headers.get('If-Range', modified) != modified:
+            f.close()
+            return QuietHandler.send_head(self)
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else fs.st_size - 1, fs.st_size - 1)
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, fs.st_size))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Last-Modified', modified)
+        self.end_headers()
+        # Only the range is copied to the output
+        return BytesIO(f.read(end - start + 1))
+
+    def end_headers(self):
+        self.send_header('Accept-Ranges', 'bytes')
+        QuietHandler.end_headers(self)
+
+    def copyfile(self, source, outputfile):
+        try:
+            QuietHandler.copyfile(self, source, outputfile)
+        except (ConnectionResetError, BrokenPipeError):
+            # Clients triaging documents close the connection after the head
+            pass
+
+
+def peak_rss():
+    """Peak resident set size of the process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB elsewhere
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def memory(options):
+    """Peak RSS fetching, processing and storing large PDFs with and without spooling."""
+    folder = tempfile.mkdtemp()
+    try:
+        site = os.path.join(folder, 'site')
+        os.makedirs(site)
+        doc = make_pdf('Benchmark', ['python crawler'] * 3, int(options.size * 1024 * 1024))
+        for i in range(options.count):
+            with open(os.path.join(site, '%d.pdf' % i), 'wb') as f:
+                f.write(doc)
+        del doc
+        url = serve(site)
+        print('%d PDFs of %.0f MB, %d threads' % (options.count, options.size, options.threads))
+        for mode in ('memory', 'spool'):
+            # Each mode runs in a fresh process to measure its own peak
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), 'memory-worker',
+                                  '--mode', mode, '--url', url, '--folder', folder,
+                                  '-n', str(options.count), '-t', str(options.threads)],
+                                 stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+            print(out.strip())
+    finally:
+        shutil.rmtree(folder)
+
+
+def memory_worker(options):
+    """Worker process for the `memory` benchmark."""
+    from engine.fetcher import Fetcher
+    from processing import PDFProcessor
+    from queue import Queue, Empty
+    base = peak_rss()
+    dest = os.path.join(options.folder, options.mode)
+    # In memory mode contents are never spooled (the behavior before content buffers)
+    fetcher = Fetcher(spool_dir=os.path.join(dest, '.spool'),
+                      max_memory=sys.maxsize if options.mode == 'memory' else 1024 * 1024)
+    pending = Queue()
+    for i in range(options.count):
+        pending.put(i)
+
+    def work():
+        processor = PDFProcessor(keywords=['python'])
+        while True:
+            try:
+                i = pending.get_nowait()
+            except Empty:
+                return
+            _, _, _, content, _ = fetcher.fetch('%s%d.pdf' % (options.url, i))
+            processor.process(content.view())
+            content.finalize(os.path.join(dest, '%d.pdf' % i))
+
+    threads = [Thread(target=work) for _ in range(options.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print('  %-6s peak RSS %7.1f MB (%.1f MB at start)' % (options.mode, peak_rss(), base))
+
+
+def pdf(options):
+    """CPU time processing PDFs in each processing mode."""
+    from processing import PDFProcessor, MODES
+    # Half of the documents have a relevant title, all of them have many pages of text
+    texts = ['lorem ipsum python crawler dolor sit amet'] * 50
+    docs = [make_pdf('Python crawler' if i % 2 else 'Untitled', texts) for i in range(options.count)]
+    print('%d PDFs of %d pages' % (options.count, len(texts)))
+    for mode in MODES:
+        processor = PDFProcessor(keywords=['python', 'crawler'], mode=mode, min_relevancy=1)
+        start = time.process_time()
+        accepted = sum(1 for doc in docs if processor.process(doc)[0] >= 1)
+        print('  %-8s %6.2f s CPU, %d accepted' % (mode, time.process_time() - start, accepted))
+
+
+def triage(options):
+    """Bytes transferred scoring PDFs with and without range requests."""
+    from engine.fetcher import Fetcher
+    from processing import PDFProcessor
+    folder = tempfile.mkdtemp()
+    try:
+        # Half of the documents are relevant by their title
+        for i in range(options.count):
+            with open(os.path.join(folder, '%d.pdf' % i), 'wb') as f:
+                f.write(make_pdf('Python crawler' if i % 2 else 'Untitled', ['lorem ipsum'] * 3,
+                                 int(options.size * 1024 * 1024)))
+        url = serve(folder, RangeHandler)
+        print('%d PDFs of %.0f MB, half of them relevant' % (options.count, options.size))
+        processor = PDFProcessor(keywords=['python'], mode='tiered', min_relevancy=1)
+        for mode in ('full', 'triage'):
+            fetcher = Fetcher(spool_dir=folder, triage=mode == 'triage')
+            start = time.time()
+            stored = 0
+            for i in range(options.count):
+                _, _, _, content, _ = fetcher.fetch('%s%d.pdf' % (url, i))
+                relevancy, _ = processor.process(content.view())
+                if relevancy >= 1:
+                    if hasattr(content, 'complete'):
+                        content = content.complete()
+                    stored += 1
+                content.release()
+            transferred = sum(s[1] for s in fetcher.stats.values())
+            print('  %-6s %8.1f MB transferred, %d stored, %.2f seconds' %
+                  (mode, transferred / (1024 * 1024), stored, time.time() - start))
+    finally:
+        shutil.rmtree(folder)
+
+
+class FirstRequestHandler(QuietHandler):
+    """Request handler that records the time of the first request."""
+    first = None
+
+    def handle_one_request(self):
+        if FirstRequestHandler.first is None:
+            FirstRequestHandler.first = time.time()
+        QuietHandler.handle_one_request(self)
+
+
+def startup(options):
+    """Time from process start to the first request of mc.py."""
+    folder = tempfile.mkdtemp()
+    try:
+        site = os.path.join(folder, 'site')
+        os.makedirs(site)
+        with open(os.path.join(site, 'index.html'), 'w') as f:
+            f.write('<html><head><title>Start</title></head><body></body></html>')
+        url = serve(site, FirstRequestHandler)
+        mc = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mc.py')
+        runs = min(options.count, 10)
+        print('%d runs of each mode' % runs)
+        for name, extra in (('default', []), ('no-log-db', ['--no-log-db'])):
+            first = []
+            total = []
+            for i in range(runs):
+                # Each run is an incremental crawl on the same databases, like a cron job
+                FirstRequestHandler.first = None
+                start = time.time()
+                subprocess.run([sys.executable, mc, '-t', '1', url] + extra, cwd=folder,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                total.append(time.time() - start)
+                first.append(FirstRequestHandler.first - start)
+            first.sort()
+            total.sort()
+            print('  %-10s first request after %5.0f ms (median), run %5.0f ms' %
+                  (name, 1000 * first[runs // 2], 1000 * total[runs // 2]))
+    finally:
+        shutil.rmtree(folder)
+
+
+class SyntheticHandler(QuietHandler):
+    """Request handler of a synthetic site of interlinked pages and PDFs."""
+    pages = 2000
+    links = 5
+    pdf = make_pdf('Python crawler', ['python crawler'] * 2)
+
+    def do_GET(self):
+        if self.path.endswith('.pdf'):
+            body = self.pdf
+            mimetype = 'application/pdf'
+        elif self.path == '/robots.txt':
+            self.send_error(404)
+            return
+        else:
+            rand = random.Random(self.path)
+            links = ''.join('<a href="/p/%d">Page %d</a> ' % (i, i)
+                            for i in (rand.randrange(self.pages) for _ in range(self.links)))
+            links += '<a href="/d/%d.pdf">Document</a>' % rand.randrange(self.pages)
+            body = ('<html><head><title>Page %s</title></head><body>%s</body></html>' %
+                    (self.path, links)).encode()
+            mimetype = 'text/html; charset=utf-8'
+        self.send_response(200)
+        self.send_header('Content-Type', mimetype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def process_rss(pid):
+    """Resident set size of a process in MB (Linux only)."""
+    with open('/proc/%d/statm' % pid) as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def soak(options):
+    """Resident memory of mc.py crawling a synthetic site for a long time."""
+    folder = tempfile.mkdtemp()
+    try:
+        url = serve(folder, SyntheticHandler)
+        mc = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mc.py')
+        # Pages are crawled again when they're linked again, so the crawl never ends
+        crawler = subprocess.Popen([sys.executable, mc, '-r', '-t', str(options.threads), '-d', '1000000',
+                                    '-k', 'python', url + 'p/0'],
+                                   cwd=folder, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        print('Crawling %d pages with %d threads for %d seconds' %
+              (SyntheticHandler.pages, options.threads, options.duration))
+        print('  %8s %10s' % ('seconds', 'RSS (MB)'))
+        start = time.time()
+        try:
+            while time.time() - start < options.duration and crawler.poll() is None:
+                time.sleep(min(options.sample, max(0, options.duration - (time.time() - start))))
+                print('  %8.0f %10.1f' % (time.time() - start, process_rss(crawler.pid)))
+                sys.stdout.flush()
+        finally:
+            # Graceful drain
+            crawler.terminate()
+            crawler.wait()
+    finally:
+        shutil.rmtree(folder)
+
+
+def contention(options):
+    """Throughput of the queue against the number of dispatcher threads."""
+    from engine.queue import Queue
+    from db.model import Resource
+    import datetime
+    folder = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        total = options.count * 20
+        print('%d items of a synthetic site of %d pages, %d links each, %.0f ms fetches' %
+              (total, SyntheticHandler.pages, SyntheticHandler.links, options.latency))
+        print('  %8s %10s %14s' % ('threads', 'items/s', 'add_list (ms)'))
+        counts = sorted({n for n in (1, 2, 5, 10, 20, 50, 100) if n < options.threads} | {options.threads})
+        for threads in counts:
+            queue = Queue(reset=True, all_domains=True)
+            queue.add(Resource(url='http://bench.invalid/p/0'))
+            processed = []
+            adding = []
+
+            def work():
+                while len(processed) < total:
+                    try:
+                        item = next(queue)
+                    except StopIteration:
+                        queue.wait(0.1)
+                        continue
+                    # Fetch and parse
+                    time.sleep(options.latency / 1000)
+                    item.code = 200
+                    item.fetched = datetime.datetime.utcnow()
+                    rand = random.Random(item.url)
+                    links = [('/p/%d' % rand.randrange(SyntheticHandler.pages), 'Page', None)
+                             for _ in range(SyntheticHandler.links)]
+                    start = time.time()
+                    queue.add_list(item, 'Page', links)
+                    adding.append(time.time() - start)
+                    queue.discard(item)
+                    processed.append(item.id)
+
+            start = time.time()
+            workers = [Thread(target=work) for _ in range(threads)]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            elapsed = time.time() - start
+            queue.close()
+            print('  %8d %10.1f %14.2f' % (threads, len(processed) / elapsed, 1000 * sum(adding) / len(adding)))
+            sys.stdout.flush()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+
+
+BENCHMARKS = {
+    'memory': memory,
+    'memory-worker': memory_worker,
+    'pdf': pdf,
+    'triage': triage,
+    'startup': startup,
+    'soak': soak,
+    'contention': contention,
+}
+
+if __name__ == '__main__':
+    opt_parser = OptionParser('usage: python %prog BENCHMARK [options]')
+    opt_parser.add_option('-t', '--threads', type='int', dest='threads', default=50,
+                          help='number of threads (default 50)')
+    opt_parser.add_option('-n', '--count', type='int', dest='count', default=50,
+                          help='number of documents (default 50)')
+    opt_parser.add_option('-s', '--size', type='float', dest='size', default=20,
+                          help='size of each document in MB (default 20)')
+    opt_parser.add_option('-D', '--duration', type='int', dest='duration', default=24 * 3600,
+                          help='duration of the soak test in seconds (default 24 hours)')
+    opt_parser.add_option('--sample', type='int', dest='sample', default=600,
+                          help='seconds between memory samples of the soak test (default 600)')
+    opt_parser.add_option('-l', '--latency', type='float', dest='latency', default=20,
+                          help='simulated fetch time of the contention test in milliseconds (default 20)')
+    opt_parser.add_option('--mode', dest='mode', help='(internal) mode of the worker process')
+    opt_parser.add_option('--url', dest='url', help='(internal) base URL of the worker process')
+    opt_parser.add_option('--folder', dest='folder', help='(internal) work folder of the worker process')
+    (options, args) = opt_parser.parse_args()
+    if len(args) != 1 or args[0] not in BENCHMARKS:
+        opt_parser.error('choose a benchmark: %s' % ', '.join(b for b in BENCHMARKS if not b.endswith('-worker')))
+    BENCHMARKS[args[0]](options)
@@ -0,0 +1,37 @@
+import datetime
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Integer, Column, String, DateTime, Text, LargeBinary
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Data model for the extracted text cache database.
+
+Based on the declarative base for SQLAlchemy.
+"""
+Base = declarative_base()
+
+
+class CachedText(Base):
+    """Table of metadata and page text of processed documents, by content hash."""
+    __tablename__ = 'cached_texts'
+    sha1 = Column(String(40), primary_key=True)
+    meta_data = Column(Text())
+    pages = Column(Integer)
+    # Normalized text of the first pages, separated by form feeds and compressed with zlib
+    text = Column(LargeBinary())
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
@@ -1,35 +1,131 @@
-from sqlalchemy.engine import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
-
-# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
-
-# This file is part of Montycrawler.
-
-# Montycrawler is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, either version 3 of the License, or
-# (at your option) any later version.
-
-# Montycrawler is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-# GNU General Public License for more details.
-
-# You should have received a copy of the GNU General Public License
-# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
-
-
-def setupdb(file, base, reset=False):
-    """Helper procedure to connect session, create database and setup tables"""
-
-    # Setup DB
-    engine = create_engine('sqlite:///' + file + '.sqlite')
-    if reset:
-        base.metadata.drop_all(engine)
-    base.metadata.create_all(engine)
-
-    # Get DB session
-    # We use scoped sessions for multithreading
-    # see http://docs.sqlalchemy.org/en/latest/orm/contextual.html
-    session_factory = sessionmaker(bind=engine)
-    return scoped_session(session_factory)
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session, Session
+from threading import local
+import weakref
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def setupdb(file, base, reset=False, wal=False):
+    """Helper procedure to connect session, create database and setup tables
+
+    With `wal`, the database uses write-ahead logging, so readers don't block
+    the writer nor wait for it.
+    """
+
+    # Setup DB
+    engine = create_engine('sqlite:///' + file + '.sqlite')
+    if wal:
+        event.listen(engine, 'connect', _enable_wal)
+    if reset:
+        base.metadata.drop_all(engine)
+    base.metadata.create_all(engine)
+    add_columns(engine, base)
+
+    # Get DB session
+    # We use scoped sessions for multithreading
+    # see http://docs.sqlalchemy.org/en/latest/orm/contextual.html
+    session_factory = sessionmaker(bind=engine, class_=TrackedSession)
+    return scoped_session(session_factory)
+
+
+def add_columns(engine, base):
+    """Add the nullable columns missing in existing tables (created by previous versions).
+
+    Args:
+        engine: The engine.
+        base: Declarative base of the tables.
+    """
+    inspector = inspect(engine)
+    for table in base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable and column.default is None:
+                engine.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                               (table.name, column.name, column.type.compile(engine.dialect)))
+
+
+def _enable_wal(connection, record):
+    """Connection hook to set write-ahead logging (see `setupdb`)."""
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+# Open sessions of all threads (to report the size of their identity maps)
+SESSIONS = weakref.WeakSet()
+
+
+class TrackedSession(Session):
+    """Session that registers itself in `SESSIONS`."""
+    def __init__(self, *args, **kwargs):
+        Session.__init__(self, *args, **kwargs)
+        SESSIONS.add(self)
+
+
+def identity_map_size():
+    """Count the objects held by the open sessions.
+
+    Returns:
+        Tuple of number of sessions and number of objects in their identity maps.
+    """
+    sessions = list(SESSIONS)
+    return len(sessions), sum(len(s.identity_map) for s in sessions)
+
+
+class SessionRecycler:
+    """Ends the units of work of the threads using a scoped session.
+
+    Each thread calls `checkpoint` when it holds no objects of the session (for
+    instance, after processing an item). Every `every` checkpoints, or when a
+    recycling was requested (see `request`), the session of the thread is
+    removed, so the objects it loaded don't stay in memory for the whole crawl.
+    """
+    def __init__(self, session, every=100):
+        """Initialize the recycler.
+
+        Args:
+            session: The scoped session.
+            every: Number of checkpoints between recyclings of the session of a thread.
+        """
+        self.session = session
+        self.every = every
+        # Incremented to request recycling all the sessions
+        self.generation = 0
+        self.local = local()
+
+    def checkpoint(self):
+        """Unit of work boundary of the current thread (pending changes are discarded).
+
+        Returns:
+            T/F the session of the thread was recycled.
+        """
+        count = getattr(self.local, 'count', 0) + 1
+        if count >= self.every or getattr(self.local, 'generation', 0) != self.generation:
+            self.session.remove()
+            self.local.count = 0
+            self.local.generation = self.generation
+            return True
+        self.local.count = count
+        return False
+
+    def request(self):
+        """Ask all the threads to recycle their sessions at their next checkpoint."""
+        self.generation += 1
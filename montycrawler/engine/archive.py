@@ -0,0 +1,531 @@
+from urllib import error
+from http.client import HTTPMessage
+from threading import Lock
+from tempfile import SpooledTemporaryFile
+import datetime
+import hashlib
+import struct
+import shutil
+import mmap
+import uuid
+import zlib
+import os
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+# Index file: header with magic and size of the archive covered, and sorted entries
+# of key digest, offset and length of the record
+INDEX_MAGIC = b'MCIDX\x00\x01\x00'
+INDEX_HEADER = struct.Struct('<8sQ')
+INDEX_ENTRY = struct.Struct('>8sQQ')
+
+
+class Archive:
+    """Append-only archive of the HTTP responses of a crawl, to replay it offline.
+
+    Responses are stored as WARC 1.0 `response` records, each one compressed as
+    a separate gzip member (like `.warc.gz` files), with the body as it was
+    transferred (still content-encoded). Requests are identified by method, URL
+    and range, in the extension fields `WARC-Request-Method` and `WARC-Request-Range`.
+    Bodies not read to the end (partially fetched documents, contents too large)
+    are stored as read, with `WARC-Truncated`.
+
+    The index (`<archive>.idx`) is a sorted table of digests of the requests
+    with the position of their records, looked up by binary search on a memory
+    map. It's updated when the archive is closed, and rebuilt from the records
+    when it doesn't cover the whole archive (after an interrupted recording).
+
+    Note:
+        A single instance is shared by all the dispatchers (see `Fetcher.send`).
+
+    """
+    # Bytes read from the archive at once
+    chunk_size = 64 * 1024
+    # Size of bodies kept in memory while they're recorded
+    max_memory = 1024 * 1024
+
+    def __init__(self, path, replay=False):
+        """Open the archive.
+
+        Args:
+            path: Path of the archive (created if it doesn't exist, when recording).
+            replay: T/F replay the archive, otherwise responses are recorded (appended).
+
+        Raises:
+            OSError: The archive can't be opened.
+        """
+        self.path = path
+        self.replay = replay
+        self.lock = Lock()
+        # Recorded responses and requests not found in the archive
+        self.records = 0
+        self.misses = 0
+        if replay:
+            self.file = open(path, 'rb')
+            self.size = os.fstat(self.file.fileno()).st_size
+            self.update_index()
+            self.index = ArchiveIndex(path + '.idx')
+        else:
+            self.file = open(path, 'ab')
+            self.size = self.file.seek(0, os.SEEK_END)
+            # Size of the archive when opened and index entries of the records added since then
+            self.start = self.size
+            self.entries = []
+            if not self.size:
+                self._append(_compress([warc_header('warcinfo', 'application/warc-fields', 0,
+                                                    {'software': 'montycrawler'})]))
+
+    def record(self, url, headers, method, response):
+        """Record a response while it's read.
+
+        Args:
+            url: URL requested.
+            headers: Dictionary of request headers.
+            method: HTTP method.
+            response: The response (with the interface of the responses of `urlopen`).
+
+        Returns:
+            The response wrapped (`RecordingResponse`), recorded when it's closed.
+        """
+        return RecordingResponse(self, url, headers.get('Range'), method, response)
+
+    def record_error(self, url, headers, method, ex):
+        """Record an error response.
+
+        Args:
+            url: URL requested.
+            headers: Dictionary of request headers.
+            method: HTTP method.
+            ex: The `HTTPError`.
+        """
+        self.write(url, headers.get('Range'), method, ex.code, ex.reason, ex.headers or HTTPMessage(), None)
+
+    def write(self, url, request_range, method, code, reason, headers, body, truncated=False):
+        """Append a response record.
+
+        Args:
+            url: URL requested.
+            request_range: Value of the Range header of the request (or `None`).
+            method: HTTP method.
+            code: HTTP status code.
+            reason: HTTP reason phrase.
+            headers: Response headers (`HTTPMessage`).
+            body: File positioned at the end of the body (or `None` for no body).
+            truncated: T/F the body wasn't read to the end.
+        """
+        http = ('HTTP/1.1 %d %s\r\n' % (code, reason or '') +
+                ''.join('%s: %s\r\n' % (name, value) for name, value in headers.items()) +
+                '\r\n').encode('iso-8859-1', errors='replace')
+        length = body.tell() if body else 0
+        fields = {'WARC-Target-URI': url, 'WARC-Request-Method': method}
+        if request_range:
+            fields['WARC-Request-Range'] = request_range
+        if truncated:
+            fields['WARC-Truncated'] = 'unspecified'
+        if body:
+            body.seek(0)
+        blocks = [warc_header('response', 'application/http; msgtype=response', len(http) + length, fields), http]
+        with SpooledTemporaryFile(self.max_memory) as compressed:
+            compressor = zlib.compressobj(wbits=31)
+            for block in blocks:
+                compressed.write(compressor.compress(block))
+            while body:
+                data = body.read(self.chunk_size)
+                if not data:
+                    break
+                compressed.write(compressor.compress(data))
+            compressed.write(compressor.compress(b'\r\n\r\n') + compressor.flush())
+            compressed.seek(0)
+            with self.lock:
+                offset = self.size
+                shutil.copyfileobj(compressed, self.file)
+                self.size = self.file.tell()
+                self.entries.append((request_key(method, url, request_range), offset, self.size - offset))
+                self.records += 1
+
+    def read(self, offset, size):
+        """Read bytes of the archive (shared by the responses being replayed).
+
+        Args:
+            offset: Position to read from.
+            size: Maximum number of bytes.
+
+        Returns:
+            The bytes read.
+        """
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def _append(self, data):
+        """Append bytes to the archive (not indexed)."""
+        with self.lock:
+            self.file.write(data)
+            self.size = self.file.tell()
+
+    def open(self, url, headers, method='GET'):
+        """Replay the response of a request.
+
+        Args:
+            url: URL requested.
+            headers: Dictionary of request headers.
+            method: HTTP method.
+
+        Returns:
+            The response (`ReplayResponse`, with the interface of the responses of `urlopen`).
+
+        Raises:
+            HTTPError: The recorded response is an error.
+            URLError: The request isn't in the archive.
+        """
+        found = self.index.lookup(request_key(method, url, headers.get('Range')))
+        response = ReplayResponse(self, *found) if found else None
+        if response is None or response.url != url or response.method != method:
+            with self.lock:
+                self.misses += 1
+            raise error.URLError('Not in the archive: %s %s' % (method, url))
+        if response.getcode() >= 400:
+            response.close()
+            raise error.HTTPError(url, response.getcode(), response.reason, response.info(), None)
+        return response
+
+    def update_index(self):
+        """Add the records appended to the archive since the index was written."""
+        path = self.path + '.idx'
+        covered = 0
+        entries = []
+        if os.path.exists(path):
+            with ArchiveIndex(path) as index:
+                covered = index.covered
+                entries = list(index.entries())
+        if not self.replay and covered == self.start:
+            entries += self.entries
+        elif covered < self.size:
+            # Records since the last index are scanned
+            with open(self.path, 'rb') as f:
+                entries += [entry for entry in scan(f, covered) if entry[0] is not None]
+        elif covered == self.size:
+            return
+        else:
+            # The archive was replaced
+            with open(self.path, 'rb') as f:
+                entries = [entry for entry in scan(f, 0) if entry[0] is not None]
+        entries.sort()
+        with open(path + '.tmp', 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.size))
+            for entry in entries:
+                f.write(INDEX_ENTRY.pack(*entry))
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        """Close the archive (the index is updated after a recording)."""
+        if self.replay:
+            self.index.close()
+            self.file.close()
+        else:
+            with self.lock:
+                self.file.close()
+            self.update_index()
+
+
+class ArchiveIndex:
+    """Index of an archive, memory mapped (see `Archive`)."""
+    def __init__(self, path):
+        """Map the index.
+
+        Args:
+            path: Path of the index.
+
+        Raises:
+            ValueError: The file isn't an index.
+        """
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.covered = INDEX_HEADER.unpack_from(self.map, 0)
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise ValueError('%s is not an archive index' % path)
+        self.count = (len(self.map) - INDEX_HEADER.size) // INDEX_ENTRY.size
+
+    def lookup(self, key):
+        """Find the last record of a request.
+
+        Args:
+            key: Digest of the request (see `request_key`).
+
+        Returns:
+            Tuple of offset and length of the record, or `None` if it isn't in the index.
+        """
+        # First entry after the ones of the key (entries with the same key are sorted by offset)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            position = INDEX_HEADER.size + middle * INDEX_ENTRY.size
+            if self.map[position:position + 8] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if not low:
+            return None
+        found, offset, length = INDEX_ENTRY.unpack_from(self.map, INDEX_HEADER.size + (low - 1) * INDEX_ENTRY.size)
+        return (offset, length) if found == key else None
+
+    def entries(self):
+        """Iterate the entries (tuples of key digest, offset and length)."""
+        return INDEX_ENTRY.iter_unpack(self.map[INDEX_HEADER.size:INDEX_HEADER.size + self.count * INDEX_ENTRY.size])
+
+    def close(self):
+        """Unmap the index."""
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RecordingResponse:
+    """Response that keeps a copy of the body read, recorded in the archive when it's closed."""
+    def __init__(self, archive, url, request_range, method, response):
+        """Wrap a response.
+
+        Args:
+            archive: The `Archive`.
+            url: URL requested.
+            request_range: Value of the Range header of the request (or `None`).
+            method: HTTP method.
+            response: The response.
+        """
+        self.archive = archive
+        self.url = url
+        self.request_range = request_range
+        self.method = method
+        self.response = response
+        self.reason = response.reason
+        self.body = SpooledTemporaryFile(archive.max_memory)
+        # HEAD responses have no body
+        self.complete = method == 'HEAD'
+
+    def getcode(self):
+        """HTTP status code."""
+        return self.response.getcode()
+
+    def info(self):
+        """Response headers (`HTTPMessage`)."""
+        return self.response.info()
+
+    def read(self, amt=None):
+        """Read the body (see the responses of `urlopen`)."""
+        data = self.response.read() if amt is None else self.response.read(amt)
+        self.body.write(data)
+        if amt is None or not data:
+            self.complete = True
+        return data
+
+    def close(self):
+        """Close the response and record it."""
+        if self.body is None:
+            return
+        self.response.close()
+        try:
+            self.archive.write(self.url, self.request_range, self.method, self.getcode(), self.reason,
+                               self.info(), self.body, not self.complete)
+        finally:
+            self.body.close()
+            self.body = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReplayResponse:
+    """Response read from a record of the archive, with the interface of the responses of `urlopen`."""
+    def __init__(self, archive, offset, length):
+        """Open a record.
+
+        Args:
+            archive: The `Archive` (opened to replay).
+            offset: Offset of the record.
+            length: Length of the compressed record.
+
+        Raises:
+            URLError: The record is damaged.
+        """
+        self.archive = archive
+        self.position = offset
+        self.end = offset + length
+        self.decompressor = zlib.decompressobj(wbits=31)
+        self.buffer = b''
+        try:
+            _, fields = self._head()
+            fields = dict(fields)
+            self.url = fields.get('WARC-Target-URI')
+            self.method = fields.get('WARC-Request-Method', 'GET')
+            status, http_headers = self._head()
+        except (ValueError, zlib.error) as ex:
+            raise error.URLError('Damaged archive record at %d: %s' % (offset, ex))
+        version, code, self.reason = (status.split(' ', 2) + [''])[:3]
+        self.code = int(code)
+        self.headers = HTTPMessage()
+        for name, value in http_headers:
+            self.headers[name] = value
+        # Block length minus the HTTP head
+        self.remaining = int(fields['Content-Length']) - self.http_length
+
+    def _fill(self, size):
+        """Decompress until the buffer has `size` bytes or the record is over."""
+        while len(self.buffer) < size and self.position < self.end:
+            data = self.archive.read(self.position, min(Archive.chunk_size, self.end - self.position))
+            if not data:
+                break
+            self.position += len(data)
+            self.buffer += self.decompressor.decompress(data)
+
+    def _head(self):
+        """Parse the next head (start line and header fields).
+
+        Returns:
+            Tuple of start line and list of tuples of field name and value.
+        """
+        while b'\r\n\r\n' not in self.buffer:
+            before = len(self.buffer)
+            self._fill(before + Archive.chunk_size)
+            if len(self.buffer) == before:
+                raise ValueError('Incomplete record')
+        head, self.buffer = self.buffer.split(b'\r\n\r\n', 1)
+        self.http_length = len(head) + 4
+        lines = head.decode('iso-8859-1').split('\r\n')
+        return lines[0], [tuple(x.strip() for x in line.split(':', 1)) for line in lines[1:] if ':' in line]
+
+    def getcode(self):
+        """HTTP status code."""
+        return self.code
+
+    def info(self):
+        """Response headers (`HTTPMessage`)."""
+        return self.headers
+
+    def read(self, amt=None):
+        """Read the body.
+
+        Args:
+            amt: Maximum number of bytes (`None` to read to the end).
+
+        Returns:
+            The data (bytes, empty at the end).
+        """
+        amt = self.remaining if amt is None else min(amt, self.remaining)
+        self._fill(amt)
+        data, self.buffer = self.buffer[:amt], self.buffer[amt:]
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        """Close the response."""
+        self.buffer = b''
+        self.remaining = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def request_key(method, url, request_range=None):
+    """Digest of a request, the key of the index.
+
+    Args:
+        method: HTTP method.
+        url: URL requested.
+        request_range: Value of the Range header (or `None`).
+
+    Returns:
+        The digest (8 bytes).
+    """
+    key = '%s %s %s' % (method, url, request_range or '')
+    return hashlib.blake2b(key.encode('utf-8', errors='surrogateescape'), digest_size=8).digest()
+
+
+def warc_header(kind, content_type, length, fields):
+    """Build the head of a WARC record.
+
+    Args:
+        kind: Record type (`response`, `warcinfo`...).
+        content_type: Type of the block.
+        length: Length of the block in bytes.
+        fields: Dictionary of other fields.
+
+    Returns:
+        The head (bytes, ending with an empty line).
+    """
+    head = {'WARC-Type': kind,
+            'WARC-Record-ID': '<urn:uuid:%s>' % uuid.uuid4(),
+            'WARC-Date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}
+    head.update(fields)
+    head.update({'Content-Type': content_type, 'Content-Length': str(length)})
+    return ('WARC/1.0\r\n' + ''.join('%s: %s\r\n' % item for item in head.items()) + '\r\n').encode('utf-8')
+
+
+def _compress(blocks):
+    """Compress blocks as one gzip member (a record)."""
+    compressor = zlib.compressobj(wbits=31)
+    return b''.join(compressor.compress(block) for block in blocks + [b'\r\n\r\n']) + compressor.flush()
+
+
+def scan(f, offset=0):
+    """Read the records of an archive to index them.
+
+    Args:
+        f: The archive (binary file).
+        offset: Offset of the first record.
+
+    Yields:
+        Tuples of key digest (`None` for records other than responses), offset and length.
+
+    Raises:
+        zlib.error: The archive is damaged.
+    """
+    while True:
+        f.seek(offset)
+        decompressor = zlib.decompressobj(wbits=31)
+        head = b''
+        consumed = 0
+        while not decompressor.eof:
+            data = f.read(Archive.chunk_size)
+            if not data:
+                # Incomplete record at the end (interrupted recording)
+                return
+            consumed += len(data)
+            data = decompressor.decompress(data)
+            if b'\r\n\r\n' not in head:
+                head += data
+        length = consumed - len(decompressor.unused_data)
+        fields = dict(tuple(x.strip() for x in line.split(':', 1))
+                      for line in head.split(b'\r\n\r\n', 1)[0].decode('utf-8').split('\r\n')[1:] if ':' in line)
+        key = None
+        if fields.get('WARC-Type') == 'response':
+            key = request_key(fields.get('WARC-Request-Method', 'GET'), fields.get('WARC-Target-URI'),
+                              fields.get('WARC-Request-Range'))
+        yield key, offset, length
+        offset += length
@@ -0,0 +1,160 @@
+from io import BytesIO
+import errno
+import mmap
+import os
+import shutil
+import tempfile
+from engine.storage import write_atomic, FILE_MODE
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class ContentBuffer:
+    """Downloaded content, kept in memory while small and spooled to a file when it grows.
+
+    Spooled content is read through a memory map (so pages are loaded by the OS on
+    demand and don't stay in the Python heap) and it's stored by renaming the spool
+    file, without copying it again.
+
+    Note:
+        The buffer owns a temporary file; call `release` (or `finalize`) when done.
+
+    """
+    def __init__(self, spool_dir=None, max_memory=1024 * 1024):
+        """Initialize an empty buffer.
+
+        Args:
+            spool_dir: Folder for the spool files (system temp folder by default). It should
+                be in the same filesystem as the download folders to store files by renaming.
+            max_memory: Maximum size in bytes kept in memory.
+        """
+        self.spool_dir = spool_dir
+        self.max_memory = max_memory
+        self.memory = BytesIO()
+        self.file = None
+        self.path = None
+        self.map = None
+        self.size = 0
+
+    def __len__(self):
+        """Magic method for len()
+        Returns:
+            Size of the content in bytes.
+        """
+        return self.size
+
+    def write(self, data):
+        """Append data to the buffer.
+
+        Args:
+            data: Bytes to append.
+        """
+        if self.file is None and self.size + len(data) > self.max_memory:
+            # Roll over to a spool file
+            if self.spool_dir:
+                os.makedirs(self.spool_dir, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(dir=self.spool_dir, prefix='.spool_')
+            self.file = os.fdopen(fd, 'w+b')
+            self.file.write(self.memory.getbuffer())
+            self.memory = None
+        if self.file is None:
+            self.memory.write(data)
+        else:
+            self.file.write(data)
+        self.size += len(data)
+
+    def tell(self):
+        """Size of the content written so far (like `file.tell`)."""
+        return self.size
+
+    @property
+    def spooled(self):
+        """T/F the content was spooled to a file."""
+        return self.path is not None
+
+    def getvalue(self):
+        """Obtain the content as bytes (copies spooled content into memory).
+
+        Returns:
+            The content (bytes).
+        """
+        if self.file is None:
+            return self.memory.getvalue()
+        self.file.flush()
+        self.file.seek(0)
+        return self.file.read()
+
+    def view(self):
+        """Obtain a read-only, seekable stream over the content without copying it.
+
+        Returns:
+            A memory map of the spool file or a `BytesIO` sharing the memory buffer.
+        """
+        if self.file is None:
+            return BytesIO(self.memory.getvalue())
+        if self.map is None:
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.map.seek(0)
+        return self.map
+
+    def finalize(self, path):
+        """Store the content in its final path and release the buffer.
+
+        Spooled content is renamed (or moved, if the destination is on another
+        filesystem). Content in memory is written atomically.
+
+        Args:
+            path: Destination path (missing folders are created).
+        """
+        if self.file is None:
+            write_atomic(path, self.memory.getbuffer())
+        else:
+            self._close()
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            os.chmod(self.path, FILE_MODE)
+            try:
+                os.replace(self.path, path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(self.path, path)
+            self.path = None
+        self.release()
+
+    def release(self):
+        """Free memory and remove the spool file (if not finalized)."""
+        self._close()
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        self.memory = None
+
+    def _close(self):
+        """Close the memory map and the spool file."""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,172 @@
+from urllib.parse import urljoin, urlsplit, urlunsplit, unquote_plus
+from collections import OrderedDict
+from threading import Lock
+import re
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+# Query parameters removed by default (names ending with `*` are prefixes)
+TRACKING_PARAMS = ('utm_*', 'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid',
+                   'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi',
+                   'jsessionid', 'phpsessid', 'aspsessionid*', 'cfid', 'cftoken')
+
+# Session ids embedded in the path, removed for every host
+SESSION_PATTERNS = (r';jsessionid=[^/?]*', r';phpsessid=[^/?]*')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class Canonicalizer:
+    """Reduces the different spellings of an URL to a single canonical form.
+
+    Canonical URLs have no fragment, lowercase scheme and host, no default port,
+    no dot segments, uppercase percent-encodings, no tracking or session parameters
+    and the query parameters sorted.
+
+    Note:
+        Rules are compiled once. Results are memoized by absolute URL, so links
+        repeated in the pages of a site are canonicalized only once.
+
+    """
+    def __init__(self, tracking_params=TRACKING_PARAMS, session_patterns=None,
+                 trailing_slash='keep', sort_query=True, cache_size=100000):
+        """Initialize the canonicalizer.
+
+        Args:
+            tracking_params: Names of query parameters to remove (case insensitive,
+                names ending with `*` match as prefixes).
+            session_patterns: Dictionary of host to list of regular expressions to
+                remove from path and query (besides the default session patterns).
+            trailing_slash: Policy for the trailing slash of paths: `keep`, `add`
+                (to paths whose last segment isn't a file name) or `strip`.
+            sort_query: T/F sort query parameters.
+            cache_size: Number of memoized results (the least recently used are forgotten).
+        """
+        if trailing_slash not in ('keep', 'add', 'strip'):
+            raise ValueError('Invalid trailing slash policy "%s"' % trailing_slash)
+        names = [re.escape(p[:-1]) + '.*' if p.endswith('*') else re.escape(p) for p in tracking_params]
+        self.tracking = re.compile('^(?:%s)$' % '|'.join(names), re.IGNORECASE) if names else None
+        self.default_session = [re.compile(p, re.IGNORECASE) for p in SESSION_PATTERNS]
+        self.session = {host.lower(): [re.compile(p) for p in patterns]
+                        for host, patterns in (session_patterns or {}).items()}
+        self.trailing_slash = trailing_slash
+        self.sort_query = sort_query
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = Lock()
+
+    def canonicalize(self, url, base=None):
+        """Obtain the canonical form of an URL.
+
+        Args:
+            url: The URL (absolute or relative to `base`).
+            base: Base URL to resolve relative URLs.
+
+        Returns:
+            The canonical URL (str).
+        """
+        return self.canonicalize_all([url], base)[0]
+
+    def canonicalize_all(self, urls, base=None):
+        """Obtain the canonical forms of a batch of URLs found in the same page.
+
+        Args:
+            urls: List of URLs (absolute or relative to `base`).
+            base: Base URL to resolve relative URLs.
+
+        Returns:
+            List of canonical URLs (str), in the same order.
+        """
+        absolute = [urljoin(base, url.strip()) if base else url.strip() for url in urls]
+        with self.lock:
+            result = [self.cache.get(url) for url in absolute]
+            for url, canonical in zip(absolute, result):
+                if canonical is not None:
+                    self.cache.move_to_end(url)
+        missing = {url: None for url, canonical in zip(absolute, result) if canonical is None}
+        if missing:
+            for url in missing:
+                missing[url] = self._canonicalize(url)
+            with self.lock:
+                self.cache.update(missing)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            result = [missing[url] if canonical is None else canonical for url, canonical in zip(absolute, result)]
+        return result
+
+    def _canonicalize(self, url):
+        """Apply the rules to a single absolute URL (not memoized)."""
+        scheme, netloc, path, query, _ = urlsplit(url)
+        scheme = scheme.lower()
+        # Lowercase host and remove default port
+        userinfo, _, hostport = netloc.rpartition('@')
+        host, _, port = hostport.lower().partition(':')
+        host = host.rstrip('.')
+        if port and port.isdigit() and DEFAULT_PORTS.get(scheme) == int(port):
+            port = ''
+        netloc = (userinfo + '@' if userinfo else '') + host + (':' + port if port else '')
+        # Remove session ids
+        patterns = self.default_session + self.session.get(host, [])
+        if patterns:
+            joined = path + ('?' + query if query else '')
+            for pattern in patterns:
+                joined = pattern.sub('', joined)
+            path, _, query = joined.partition('?')
+        path = _remove_dot_segments(path) or '/'
+        path = _PERCENT.sub(lambda m: m.group(0).upper(), path)
+        if self.trailing_slash == 'strip' and len(path) > 1:
+            path = path.rstrip('/') or '/'
+        elif self.trailing_slash == 'add' and not path.endswith('/') and '.' not in path.rpartition('/')[2]:
+            path += '/'
+        # Filter and sort query parameters, keeping their original encoding
+        if query:
+            params = [p for p in query.split('&') if p]
+            if self.tracking:
+                params = [p for p in params if not self.tracking.match(unquote_plus(p.partition('=')[0]))]
+            if self.sort_query:
+                params.sort()
+            query = '&'.join(params)
+        return urlunsplit((scheme, netloc, path, query, ''))
+
+
+_PERCENT = re.compile('%[0-9a-f]{2}', re.IGNORECASE)
+
+
+def _remove_dot_segments(path):
+    """Resolve `.` and `..` segments of a path (RFC 3986, section 5.2.4).
+
+    Args:
+        path: The path.
+
+    Returns:
+        The path without dot segments.
+    """
+    if '.' not in path:
+        return path
+    output = []
+    segments = path.split('/')
+    for segment in segments:
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+    # Keep trailing slash when the path ended in a dot segment
+    if segments[-1] in ('.', '..'):
+        output.append('')
+    return '/'.join(output)
@@ -0,0 +1,116 @@
+from threading import Condition
+import time
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Controller:
+    """Adaptive limit on the number of dispatchers fetching at the same time.
+
+    The limit follows an AIMD policy (additive increase, multiplicative decrease):
+    at the end of each observation window it grows by one if latency, error rate
+    and CPU usage stayed under their targets, and it's halved if any of them was
+    exceeded. It always stays between `min_active` and `max_active`.
+
+    Note:
+        CPU usage is measured as process time over wall time, so it's the fraction
+        of one core used by the interpreter (the GIL bounds it to about 1).
+
+    """
+    def __init__(self, min_active, max_active, logger=None,
+                 target_latency=5.0, max_error_rate=0.2, max_cpu=0.9, window=5):
+        """Initialize the controller.
+
+        Args:
+            min_active: Lower bound for the number of active fetchers.
+            max_active: Upper bound for the number of active fetchers.
+            logger: Logger instance to report limit changes (optional).
+            target_latency: Maximum average time to the response headers (seconds) to keep growing.
+            max_error_rate: Maximum ratio of failed downloads to keep growing.
+            max_cpu: Maximum CPU usage (fraction of a core) to keep growing.
+            window: Length of the observation window in seconds.
+        """
+        self.min_active = max(1, min_active)
+        self.max_active = max(self.min_active, max_active)
+        self.logger = logger
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.max_cpu = max_cpu
+        self.window = window
+        self.limit = self.min_active
+        self.active = 0
+        self.cond = Condition()
+        self._reset_window()
+
+    def _reset_window(self):
+        """Start a new observation window."""
+        self.samples = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.window_start = time.time()
+        self.cpu_start = time.process_time()
+
+    def acquire(self, timeout=None):
+        """Wait for a free fetch slot.
+
+        Args:
+            timeout: Maximum time to wait in seconds (`None` waits forever).
+
+        Returns:
+            T/F a slot was acquired.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.active < self.limit, timeout):
+                return False
+            self.active += 1
+            return True
+
+    def release(self, latency=None, failed=False):
+        """Free a fetch slot and record the outcome of the fetch.
+
+        Args:
+            latency: Time to the response headers in seconds (`None` if nothing was fetched).
+            failed: T/F the download failed (unreachable, server error or throttled).
+        """
+        with self.cond:
+            self.active -= 1
+            if latency is not None:
+                self.samples += 1
+                self.total_latency += latency
+                if failed:
+                    self.errors += 1
+            if time.time() - self.window_start >= self.window:
+                self._adjust()
+            self.cond.notify_all()
+
+    def _adjust(self):
+        """Apply the AIMD policy with the stats of the current window."""
+        elapsed = time.time() - self.window_start
+        cpu = (time.process_time() - self.cpu_start) / elapsed if elapsed > 0 else 0
+        if self.samples:
+            latency = self.total_latency / self.samples
+            error_rate = self.errors / self.samples
+            old = self.limit
+            if latency > self.target_latency or error_rate > self.max_error_rate or cpu > self.max_cpu:
+                self.limit = max(self.min_active, self.limit // 2)
+            else:
+                self.limit = min(self.max_active, self.limit + 1)
+            if self.logger and self.limit != old:
+                self.logger.debug('Active fetchers limit %d -> %d (latency=%.2fs errors=%.0f%% cpu=%.0f%%)' %
+                                  (old, self.limit, latency, error_rate * 100, cpu * 100))
+        self._reset_window()
@@ -1,261 +1,428 @@
-from threading import Thread
-import time
-from urllib import request, error, robotparser, parse
-import posixpath
-import datetime
-import sys
-from random import randint
-
-# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
-
-# This file is part of Montycrawler.
-
-# Montycrawler is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, either version 3 of the License, or
-# (at your option) any later version.
-
-# Montycrawler is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-# GNU General Public License for more details.
-
-# You should have received a copy of the GNU General Public License
-# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
-
-
-class Dispatcher(Thread):
-    """Thread based queue processor
-
-    Each thread, gets next pending resource, downloads content and send it
-    to the parser (HTML content) or the processor (PDF content).
-    """
-
-    next_id = 0
-
-    def __init__(self, queue, parser, processor,
-                 logger, max_depth,
-                 download_folder, rejected_folder,
-                 min_relevancy):
-        """Initialize dispatcher instance.
-
-        Args:
-            queue: The `Queue` object.
-            parser: Parser instance to find links.
-            processor: Processor instance to analyze PDF content.
-            logger: Logger instance.
-            max_depth: Maximum number of recursive link levels.
-            download_folder: Path to the folder to store accepted documents.
-            rejected_folder: Path to the folder to store rejected documents (if empty, they're discarded).
-            min_relevancy: Minimum relevancy tof PDF documents to be stored or rejected.
-        """
-        Thread.__init__(self, name=str(Dispatcher.next_id))
-        Dispatcher.next_id += 1
-        self.queue = queue
-        self.parser = parser
-        self.processor = processor
-        self.logger = logger
-        self.max_depth = max_depth
-        self.download_folder = download_folder
-        self.rejected_folder = rejected_folder
-        self.min_relevancy = min_relevancy
-        self.parsed = 0
-        self.downloaded = 0
-        self.added = 0
-        self.start_time = None
-        self.robots_cache = {}
-
-    def run(self):
-        """Dispatcher's main program"""
-        self.start_time = time.time()
-        self.logger.info('THREAD_STARTED')
-        self.write_status('WAITING')
-        # Random time between 3 and 7 seconds waiting to fill queue
-        time.sleep(randint(3, 7))
-        try:
-            # Iterate until there're no other threads running
-            waits = 0
-            self.write_status('RUNNING')
-            while self.logger.some_running():
-                try:
-                    item = next(self.queue)
-                    self.write_status('RUNNING')
-                    self.logger.info('PROCESS_URL', item.resource.url)
-                    code, mimetype, filename, content, encoding = self.download(item.resource.url)
-                    # Manage response
-                    process_ok = False
-                    if code:
-                        item.resource.last_code = code
-                        item.resource.fetched = datetime.datetime.utcnow()
-                        if code == 200:
-                            # Processing based on mime type
-                            if mimetype == 'text/html':
-                                # Limit depth in link search
-                                if self.max_depth is None or item.depth < self.max_depth:
-                                    # Decode content
-                                    decoded = None
-                                    if encoding:
-                                        try:
-                                            decoded = content.decode(encoding)
-                                        except UnicodeDecodeError:
-                                            self.logger.error('Decoding error: ' + item.resource.url)
-                                    else:
-                                        # Encoding not provided. Guess it.
-                                        guess = ['iso-8859-1', 'utf-8', 'windows-1251',
-                                                 'windows-1252', 'iso-8859-15', 'iso-8859-9', 'ascii']
-                                        for enc in guess:
-                                            try:
-                                                decoded = content.decode(enc)
-                                                break
-                                            except UnicodeDecodeError:
-                                                pass
-                                    if decoded:
-                                        # Parse and add found resources
-                                        (title, item_list) = self.parser.parse(decoded)
-                                        for link, text, priority in item_list:
-                                            self.logger.debug('Found "%s" (p=%s) (%s)' %
-                                                              (link,
-                                                               'N' if priority is None else str(priority),
-                                                               text[:40] if text is not None else ''))
-                                        (a, r) = self.queue.add_list(item, title, item_list)
-                                        self.added += a
-                                        self.write_status('RUNNING')
-                                        self.logger.debug('%d resources in queue. %d added and %d rejected from %s' %
-                                                          (len(self.queue), a, r, item.resource.url))
-                                        self.logger.console('Queue: %d resources. %d added from "%s".' %
-                                                            (len(self.queue), a, item.resource.url))
-                                        process_ok = True
-                                    else:
-                                        self.logger.error("Can't decode: " + item.resource.url)
-                                else:
-                                    self.logger.info('MAX_DEPTH_REACHED', item.resource.url)
-                                    process_ok = True
-                            elif mimetype == 'application/pdf':
-                                # Process
-                                try:
-                                    (relevancy, metadata) = self.processor.process(content, mimetype)
-                                    # Store PDF
-                                    name = self.queue.store(relevancy >= self.min_relevancy,
-                                                            item.resource, mimetype,
-                                                            self.download_folder,
-                                                            self.rejected_folder,
-                                                            filename, metadata, content)
-                                    self.downloaded += 1
-                                    self.write_status('RUNNING')
-                                    self.logger.debug('Got document "%s" (relevancy=%d) from %s' %
-                                                      (name, relevancy, item.resource.url))
-                                    self.logger.console('Document found (relevancy %.1f): %s' % (relevancy, name))
-                                    self.logger.info('DOWNLOADED', name)
-                                except Exception as ex:
-                                    # Error processing
-                                    self.logger.error('Exception processing document: %s' % (str(type(ex)) + ' ' + str(ex)))
-                                process_ok = True
-                            else:
-                                self.logger.debug('Discarded type "%s" from %s' %
-                                                  (mimetype, item.resource.url))
-                        elif code == -1:
-                            # The URL was disallowed by robots.txt
-                            self.logger.info('DISALLOWED', item.resource.url)
-                            self.queue.discard(item)
-                        else:
-                            self.logger.error('Got code %d retrieving %s' % (code, item.resource.url))
-                    else:
-                        self.logger.error('Unreachable: ' + item.resource.url)
-                    # Remove processed item from queue or retry
-                    if process_ok:
-                        self.logger.info('PROCESSED_OK', item.resource.url)
-                        self.queue.discard(item)
-                        self.parsed += 1
-                        self.write_status('RUNNING')
-                    else:
-                        # Code -1 (disallowed) yet logged
-                        if code != -1:
-                            self.logger.error("Can't retrieve: " + item.resource.url)
-                            if self.queue.discard_or_retry(item):
-                                self.logger.error('Reached maximum retries, discarded: ' + item.resource.url)
-                except StopIteration:
-                    self.write_status('WAITING')
-                    waits += 1
-                    self.logger.debug('Reached end of queue. %d waits.' % waits)
-                    time.sleep(randint(3, 7))
-        except (KeyboardInterrupt, SystemExit):
-            self.write_status('INTERRUPTED')
-            self.logger.debug('Thread interrupted.')
-            raise
-        except Exception as e:
-            self.logger.error('Thread %s aborted by unexpected error: %s' % (self.name, e))
-            self.logger.info('THREAD_ABORTED', self.name)
-            self.write_status('ABORTED')
-            raise
-
-        self.write_status('FINISHED')
-        self.logger.info('THREAD_FINISHED')
-
-    def write_status(self, status):
-        self.logger.status(status, self.parsed, self.added, self.downloaded, self.start_time)
-
-    def download(self, url):
-        """Helper function to download URL content and obtain mime type.
-            Args:
-                url: URL to download.
-            Returns:
-                Tuple:
-                    HTTP status code (or -1 if disallowed by robots.txt).
-                    MIME type taken from protocol headers.
-                    File name from headers (or guessed from URL).
-                    Binary content.
-                    Content encoding taken from headers.
-            Raises:
-                HTTPError: Protocol error.
-                URLError: URL incorrect.
-        """
-        # robots.txt management
-        parsed_url = parse.urlparse(url)
-        path_robots = parse.ParseResult(scheme=parsed_url.scheme,
-                                          netloc=parsed_url.netloc,
-                                          path='robots.txt',
-                                          params='',
-                                          query='',
-                                          fragment='')
-        url_robots = parse.urlunparse(path_robots)
-        # Is cached?
-        robots_parser = self.robots_cache.get(url_robots)
-        if robots_parser is None:
-            # Create parser and retrieve
-            robots_parser = robotparser.RobotFileParser(url=url_robots)
-            try:
-                robots_parser.read()
-            except error.URLError as ex:
-                print('Error getting robots: %s' % url_robots, file=sys.stderr)
-                # Assign an empty parser to avoid repeated requests
-                self.robots_cache[url_robots] = robotparser.RobotFileParser()
-            # Store in cache
-            self.robots_cache[url_robots] = robots_parser
-        # Query robots policy
-        if robots_parser.can_fetch('*', url):
-            # Proceed
-            response = None
-            try:
-                response = request.urlopen(url)
-                code = response.getcode()
-                mimetype = response.info().get_content_type()
-                filename = response.info().get_filename()
-                if not filename:
-                    # Guess filename from URL
-                    filename = posixpath.basename(parse.urlparse(url).path)
-                encoding = response.info().get_content_charset()
-                content = response.read()
-                return code, mimetype, filename, content, encoding
-            except error.HTTPError as ex:
-                print('Code %d retrieving %s' % (ex.code, url), file=sys.stderr)
-                return ex.code, None, None, None, None
-            except error.URLError as ex:
-                print('Error retrieving "%s"' % url, file=sys.stderr)
-                print(ex.reason, file=sys.stderr)
-                return None, None, None, None, None
-            finally:
-                if response:
-                    response.close()
-        else:
-            # Robots.txt disallowed
-            return -1, None, None, None, None
+from threading import Thread
+import time
+from urllib import error, robotparser, parse
+import http.client
+import datetime
+import sys
+from engine.fetcher import Fetcher, ContentTooLargeError, RangeNotSatisfiedError
+from engine.hosts import DEPRIORITIZED_STATE, STOPPED
+from engine.prefilter import Prefilter
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Dispatcher(Thread):
+    """Thread based queue processor
+
+    Each thread, gets next pending resource, downloads content and send it
+    to the parser (HTML content) or the processor (PDF content).
+    """
+
+    next_id = 0
+    # Maximum time (seconds) to block waiting for new items or fetch slots
+    wait_timeout = 1
+
+    def __init__(self, queue, parser, processor,
+                 logger, max_depth, storage,
+                 min_relevancy, controller=None, fetcher=None, scorer=None, sitemaps=None, depth_probe='head',
+                 prefilter=None):
+        """Initialize dispatcher instance.
+
+        Args:
+            queue: The `Queue` object.
+            parser: Parser instance to find links.
+            processor: Processor instance to analyze PDF content. Contents are passed as bytes,
+                or as seekable binary streams if the processor has a true `streams` attribute.
+            logger: Logger instance.
+            max_depth: Maximum number of recursive link levels.
+            storage: `Storage` instance to store accepted and rejected documents.
+            min_relevancy: Minimum relevancy tof PDF documents to be stored or rejected.
+            controller: `Controller` instance limiting concurrent fetches (optional).
+            fetcher: `Fetcher` instance to download resources (a new one by default).
+            scorer: Scorer instance to prioritize links (optional, by default parser priorities are used).
+            sitemaps: `SitemapReader` instance to add the sitemap entries of new hosts (optional).
+            depth_probe: How resources at the maximum depth are fetched: `head` (a HEAD request
+                checks they're documents before a GET), `skip` (only URLs of PDF files) or `get`.
+            prefilter: `Prefilter` instance to avoid fetching resources of other types (by default
+                only resources at the maximum depth are checked).
+        """
+        Thread.__init__(self, name=str(Dispatcher.next_id))
+        Dispatcher.next_id += 1
+        self.queue = queue
+        self.parser = parser
+        self.processor = processor
+        self.logger = logger
+        self.max_depth = max_depth
+        self.storage = storage
+        self.min_relevancy = min_relevancy
+        self.controller = controller
+        self.fetcher = fetcher or Fetcher()
+        self.scorer = scorer
+        self.sitemaps = sitemaps
+        self.depth_probe = depth_probe
+        self.prefilter = prefilter or Prefilter(deny=(), learn=False)
+        self.parsed = 0
+        self.downloaded = 0
+        self.added = 0
+        # Resources not fetched at the maximum depth
+        self.skipped = 0
+        self.start_time = None
+        self.robots_cache = {}
+
+    def run(self):
+        """Dispatcher's main program"""
+        self.start_time = time.time()
+        self.logger.info('THREAD_STARTED')
+        item = None
+        try:
+            # Iterate until the queue is empty and no other thread is processing items
+            waits = 0
+            self.write_status('RUNNING')
+            while not self.queue.finished():
+                # Wait for a free fetch slot
+                if self.controller and not self.controller.acquire(self.wait_timeout):
+                    continue
+                latency = None
+                failed = False
+                idle = False
+                item = None
+                content = None
+                try:
+                    item = next(self.queue)
+                    self.write_status('RUNNING')
+                    self.logger.info('PROCESS_URL', item.url)
+                    started = time.time()
+                    code, mimetype, filename, content, encoding = self.download(
+                        item.url, self.max_depth is not None and item.depth >= self.max_depth)
+                    # Time to the response headers, as the body transfer depends on its size
+                    responded = self.fetcher.responded()
+                    latency = (responded if responded and responded >= started else time.time()) - started
+                    if code == 200:
+                        self.prefilter.record(item.url, mimetype, len(content))
+                    # Unreachable, throttled or server errors slow down the crawl
+                    failed = code is None or code == 429 or code >= 500
+                    # Manage response
+                    process_ok = False
+                    if code:
+                        item.code = code
+                        item.fetched = datetime.datetime.utcnow()
+                        if code == 200:
+                            # Per host budgets
+                            host_state = self.queue.account(item, mimetype, len(content))
+                            if host_state in (DEPRIORITIZED_STATE, STOPPED):
+                                host = parse.urlparse(item.url).netloc
+                                self.logger.info('HOST_' + host_state, host)
+                                self.logger.console('Host %s %s for lack of yield or budget.' %
+                                                    (host, host_state.lower()))
+                            # Processing based on mime type
+                            if mimetype == 'text/html':
+                                # Limit depth in link search
+                                if self.max_depth is None or item.depth < self.max_depth:
+                                    # Decode content
+                                    decoded = None
+                                    raw = content.getvalue()
+                                    if encoding:
+                                        try:
+                                            decoded = raw.decode(encoding)
+                                        except UnicodeDecodeError:
+                                            self.logger.error('Decoding error: ' + item.url)
+                                    else:
+                                        # Encoding not provided. Guess it.
+                                        guess = ['iso-8859-1', 'utf-8', 'windows-1251',
+                                                 'windows-1252', 'iso-8859-15', 'iso-8859-9', 'ascii']
+                                        for enc in guess:
+                                            try:
+                                                decoded = raw.decode(enc)
+                                                break
+                                            except UnicodeDecodeError:
+                                                pass
+                                    if decoded:
+                                        # Parse and add found resources
+                                        (title, item_list) = self.parser.parse(decoded)
+                                        if self.scorer and item_list:
+                                            # Score all the links of the page at once
+                                            priorities = self.scorer.score(
+                                                item.url, self.queue.referrer_relevancy(item.resource_id),
+                                                item_list, self.queue.history)
+                                            item_list = [(link, text, p) for (link, text, _), p
+                                                         in zip(item_list, priorities)]
+                                        for link, text, priority in item_list:
+                                            self.logger.info('LINK_FOUND', '"%s" (p=%s) (%s)' %
+                                                             (link,
+                                                              'N' if priority is None else str(priority),
+                                                              text[:40] if text is not None else ''), 'DEBUG')
+                                        (a, r) = self.queue.add_list(item, title, item_list)
+                                        self.added += a
+                                        self.write_status('RUNNING')
+                                        self.logger.debug('%d resources in queue. %d added and %d rejected from %s' %
+                                                          (len(self.queue), a, r, item.url))
+                                        self.logger.console('Queue: %d resources. %d added from "%s".' %
+                                                            (len(self.queue), a, item.url))
+                                        process_ok = True
+                                    else:
+                                        self.logger.error("Can't decode: " + item.url)
+                                else:
+                                    self.logger.info('MAX_DEPTH_REACHED', item.url)
+                                    process_ok = True
+                            elif mimetype == 'application/pdf':
+                                # Network errors reading partially fetched documents are transient
+                                transient = (OSError, http.client.HTTPException, RangeNotSatisfiedError) \
+                                    if hasattr(content, 'complete') else ()
+                                # Process
+                                try:
+                                    if getattr(self.processor, 'streams', False):
+                                        # The processor reads the content without copying it
+                                        data = content.view()
+                                    else:
+                                        # Partially fetched documents can't be triaged
+                                        if hasattr(content, 'complete'):
+                                            content = content.complete()
+                                        data = content.getvalue()
+                                    (relevancy, metadata) = self.processor.process(data, mimetype)
+                                    accepted = relevancy >= self.min_relevancy
+                                    if hasattr(content, 'complete'):
+                                        # Partially fetched documents are completed only to be stored
+                                        self.logger.debug('Triaged %s reading %d of %d bytes' %
+                                                          (item.url, content.transferred, len(content)))
+                                        if accepted or self.storage.rejected_folder:
+                                            content = content.complete()
+                                        else:
+                                            content.release()
+                                            content = None
+                                    # Store PDF in background (the storage takes the content buffer)
+                                    name, _ = self.storage.submit(accepted,
+                                                                  item, mimetype,
+                                                                  filename, metadata, content)
+                                    content = None
+                                    self.downloaded += 1
+                                    self.write_status('RUNNING')
+                                    self.logger.debug('Got document "%s" (relevancy=%d) from %s' %
+                                                      (name, relevancy, item.url))
+                                    self.logger.console('Document found (relevancy %.1f): %s' % (relevancy, name))
+                                    self.logger.info('DOWNLOADED', name)
+                                    process_ok = True
+                                except transient as ex:
+                                    # Range requests failed, the document will be fetched again
+                                    self.logger.error('Error fetching ranges of %s: %s' % (item.url, ex))
+                                    failed = True
+                                except Exception as ex:
+                                    # Error processing
+                                    self.logger.error('Exception processing document: %s' % (str(type(ex)) + ' ' + str(ex)))
+                                    process_ok = True
+                            else:
+                                self.logger.debug('Discarded type "%s" from %s' %
+                                                  (mimetype, item.url))
+                        elif code == -1:
+                            # The URL was disallowed by robots.txt
+                            self.logger.info('DISALLOWED', item.url)
+                            self.queue.discard(item)
+                        elif code == -2:
+                            # Retrying won't make it smaller
+                            self.logger.info('TOO_LARGE', item.url)
+                            self.queue.discard(item)
+                        elif code == -3:
+                            # Not of a processed type, or its links would be thrown away and it isn't a document
+                            item.code = item.fetched = None
+                            if self.max_depth is not None and item.depth >= self.max_depth:
+                                self.logger.info('MAX_DEPTH_REACHED', item.url)
+                                self.skipped += 1
+                            else:
+                                self.logger.info('PREFILTERED', item.url)
+                            self.queue.discard(item)
+                        else:
+                            self.logger.error('Got code %d retrieving %s' % (code, item.url))
+                    else:
+                        self.logger.error('Unreachable: ' + item.url)
+                    # The sitemaps of a new host are read once its robots.txt is known (while the
+                    # item is in flight, so the crawl isn't over until their entries are added)
+                    if self.sitemaps and code is not None and code != -1 and \
+                            (self.max_depth is None or item.depth < self.max_depth):
+                        self.discover_sitemaps(item)
+                    # Remove processed item from queue or retry
+                    if process_ok:
+                        self.logger.info('PROCESSED_OK', item.url)
+                        self.queue.discard(item)
+                        self.parsed += 1
+                        self.write_status('RUNNING')
+                    else:
+                        # Codes -1 (disallowed), -2 (too large) and -3 (not fetched) yet logged
+                        if code not in (-1, -2, -3):
+                            self.logger.error("Can't retrieve: " + item.url)
+                            if self.queue.discard_or_retry(item):
+                                self.logger.error('Reached maximum retries, discarded: ' + item.url)
+                    item = None
+                except StopIteration:
+                    idle = True
+                finally:
+                    if content is not None:
+                        content.release()
+                    if self.controller:
+                        self.controller.release(latency, failed)
+                if not idle:
+                    # Nothing loaded while processing the item is needed any longer
+                    self.queue.checkpoint()
+                    self.logger.checkpoint()
+                if idle:
+                    self.write_status('WAITING')
+                    waits += 1
+                    self.logger.debug('Reached end of queue. %d waits.' % waits)
+                    # Sleep until new items are inserted
+                    self.queue.wait(self.wait_timeout)
+        except (KeyboardInterrupt, SystemExit):
+            if item is not None:
+                self.queue.abandon(item)
+            self.write_status('INTERRUPTED')
+            self.logger.debug('Thread interrupted.')
+            raise
+        except Exception as e:
+            self.logger.error('Thread %s aborted by unexpected error: %s' % (self.name, e))
+            self.logger.info('THREAD_ABORTED', self.name)
+            # Don't keep the other threads waiting for this item
+            if item is not None:
+                self.queue.abandon(item)
+            self.write_status('ABORTED')
+            raise
+
+        self.write_status('FINISHED')
+        self.logger.info('THREAD_FINISHED')
+
+    def discover_sitemaps(self, item):
+        """Read the sitemaps of the host of an item, if it's new. Errors are only logged.
+
+        Args:
+            item: The queue item.
+        """
+        try:
+            self.sitemaps.discover(item, self.robots_cache.get(robots_url(item.url)))
+        except Exception as ex:
+            self.logger.error('Error reading sitemaps of %s: %s' % (item.url, ex))
+
+    def write_status(self, status):
+        self.logger.status(status, self.parsed, self.added, self.downloaded, self.start_time)
+
+    def download(self, url, document_only=False):
+        """Helper function to download URL content and obtain mime type.
+            Args:
+                url: URL to download.
+                document_only: T/F only documents are worth fetching (see `worth_fetching`).
+            Returns:
+                Tuple:
+                    HTTP status code (-1 if disallowed by robots.txt, -2 if too large,
+                        -3 if not fetched because of its type, see `worth_fetching`).
+                    MIME type taken from protocol headers.
+                    File name from headers (or guessed from URL).
+                    Binary content (`ContentBuffer`).
+                    Content encoding taken from headers.
+            Raises:
+                HTTPError: Protocol error.
+                URLError: URL incorrect.
+        """
+        # robots.txt management
+        url_robots = robots_url(url)
+        # Is cached?
+        robots_parser = self.robots_cache.get(url_robots)
+        if robots_parser is None:
+            # Create parser and retrieve
+            robots_parser = robotparser.RobotFileParser(url=url_robots)
+            try:
+                self.read_robots(robots_parser)
+            except (error.URLError, ContentTooLargeError) as ex:
+                print('Error getting robots: %s' % url_robots, file=sys.stderr)
+                # Assign an empty parser to avoid repeated requests
+                self.robots_cache[url_robots] = robotparser.RobotFileParser()
+            # Store in cache
+            self.robots_cache[url_robots] = robots_parser
+        # Query robots policy
+        if robots_parser.can_fetch('*', url):
+            # Proceed
+            try:
+                if not self.worth_fetching(url, document_only):
+                    return -3, None, None, None, None
+                return self.fetcher.fetch(url)
+            except error.HTTPError as ex:
+                print('Code %d retrieving %s' % (ex.code, url), file=sys.stderr)
+                return ex.code, None, None, None, None
+            except error.URLError as ex:
+                print('Error retrieving "%s"' % url, file=sys.stderr)
+                print(ex.reason, file=sys.stderr)
+                return None, None, None, None, None
+            except ContentTooLargeError as ex:
+                print('Error retrieving "%s": %s' % (url, ex), file=sys.stderr)
+                return -2, None, None, None, None
+        else:
+            # Robots.txt disallowed
+            return -1, None, None, None, None
+
+    def worth_fetching(self, url, document_only=False):
+        """Check with the prefilter if a resource may be of a processed type, before fetching it.
+
+        Args:
+            url: URL of the resource.
+            document_only: T/F its links won't be followed, so it's only worth fetching if
+                it's a document (ambiguous URLs are checked as set by `depth_probe`).
+
+        Returns:
+            T/F the resource is worth a GET request.
+
+        Raises:
+            HTTPError: Protocol error of the HEAD request.
+            URLError: URL incorrect.
+        """
+        if document_only and self.depth_probe != 'get':
+            return self.prefilter.check(url, self.fetcher, ('application/pdf',), self.depth_probe == 'head', False)
+        return self.prefilter.check(url, self.fetcher)
+
+    def read_robots(self, robots_parser):
+        """Fetch and parse robots.txt like `RobotFileParser.read` does, but through the fetcher.
+
+        Args:
+            robots_parser: `RobotFileParser` instance with the URL set.
+
+        Raises:
+            URLError: URL incorrect.
+            ContentTooLargeError: The content exceeds the maximum size.
+        """
+        try:
+            _, _, _, content, encoding = self.fetcher.fetch(robots_parser.url)
+            text = content.getvalue().decode(encoding or 'utf-8', errors='replace')
+            content.release()
+            robots_parser.parse(text.splitlines())
+        except error.HTTPError as ex:
+            if ex.code in (401, 403):
+                robots_parser.disallow_all = True
+            elif 400 <= ex.code < 500:
+                robots_parser.allow_all = True
+
+
+def robots_url(url):
+    """Obtain the URL of the robots.txt of the host of an URL.
+
+    Args:
+        url: The URL.
+
+    Returns:
+        URL of the robots.txt.
+    """
+    parsed_url = parse.urlparse(url)
+    path_robots = parse.ParseResult(scheme=parsed_url.scheme,
+                                    netloc=parsed_url.netloc,
+                                    path='robots.txt',
+                                    params='',
+                                    query='',
+                                    fragment='')
+    return parse.urlunparse(path_robots)
@@ -0,0 +1,623 @@
+from urllib import request, parse, error
+from threading import Lock, local
+from engine.buffer import ContentBuffer
+from io import RawIOBase
+import posixpath
+import re
+import time
+import zlib
+
+try:
+    import brotli
+    # Only bindings that can limit the output of each call (Brotli 1.2+), see `Decoder`
+    brotli.Decompressor().process(b'', output_buffer_limit=1)
+except (ImportError, TypeError, AttributeError):
+    brotli = None
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Fetcher:
+    """Downloads resources negotiating compressed transfers.
+
+    Responses are requested with `gzip`, `deflate` and (if the `brotli` module is
+    installed, version 1.2 or later) `br` content encodings, and decompressed while they're read. The size
+    of the decoded content is limited to protect against decompression bombs.
+
+    In triage mode, PDF documents served with `Accept-Ranges` aren't downloaded
+    completely: only their head is read and the rest is fetched on demand with
+    range requests (see `PartialContent`).
+
+    With an archive (see `Archive`), responses are recorded, or replayed
+    without network requests.
+
+    Note:
+        A single instance is shared by all the dispatchers.
+
+    """
+    # Bytes read from the network (and produced by the decoders) at once
+    chunk_size = 64 * 1024
+    # MIME types fetched partially in triage mode
+    triage_types = ('application/pdf',)
+
+    def __init__(self, max_size=None, spool_dir=None, max_memory=1024 * 1024, triage=False,
+                 triage_head=64 * 1024, triage_tail=64 * 1024, archive=None):
+        """Initialize the fetcher.
+
+        Args:
+            max_size: Maximum size in bytes of the decoded content (`None` for no limit).
+            spool_dir: Folder to spool large contents (system temp folder by default).
+            max_memory: Maximum size in bytes of a content kept in memory.
+            triage: T/F fetch documents partially when the server supports ranges.
+            triage_head: Bytes read from the start of partially fetched documents.
+            triage_tail: Bytes read from the end of partially fetched documents
+                (where PDF documents have the cross-reference table and trailer).
+            archive: `Archive` instance to record or replay the responses (optional).
+        """
+        self.max_size = max_size
+        self.spool_dir = spool_dir
+        self.max_memory = max_memory
+        self.triage = triage
+        self.triage_head = triage_head
+        self.triage_tail = triage_tail
+        self.archive = archive
+        self.accept_encoding = 'gzip, deflate, br' if brotli else 'gzip, deflate'
+        self.opener = request.build_opener(HeadRedirectHandler)
+        self.lock = Lock()
+        # Per host list of responses, bytes transferred and decoded bytes
+        self.stats = {}
+        # Per thread time of the last response headers (see `responded`)
+        self.local = local()
+
+    def fetch(self, url):
+        """Download URL content and obtain mime type.
+
+        Args:
+            url: URL to download.
+
+        Returns:
+            Tuple:
+                HTTP status code.
+                MIME type taken from protocol headers.
+                File name from headers (or guessed from URL).
+                Binary content, decoded (`ContentBuffer` or, in triage mode, `PartialContent`;
+                    to be released by the caller).
+                Content encoding taken from headers.
+
+        Raises:
+            HTTPError: Protocol error.
+            URLError: URL incorrect.
+            ContentTooLargeError: The content exceeds the maximum size.
+        """
+        with self.send(url, {'Accept-Encoding': self.accept_encoding}) as response:
+            code = response.getcode()
+            mimetype = response.info().get_content_type()
+            filename = response.info().get_filename()
+            if not filename:
+                # Guess filename from URL
+                filename = posixpath.basename(parse.urlparse(url).path)
+            encoding = response.info().get_content_charset()
+            if self.triage and code == 200 and mimetype in self.triage_types:
+                content = self.read_partial(url, response)
+                if content is not None:
+                    return code, mimetype, filename, content, encoding
+            content = self.read(response, parse.urlparse(url).netloc)
+            return code, mimetype, filename, content, encoding
+
+    def open(self, url, headers, method='GET'):
+        """Send a request (redirections are followed).
+
+        Args:
+            url: URL to request.
+            headers: Dictionary of request headers.
+            method: HTTP method (`GET` or `HEAD`).
+
+        Returns:
+            The response (as returned by `urlopen`), to be closed by the caller.
+
+        Raises:
+            HTTPError: Protocol error.
+            URLError: URL incorrect.
+        """
+        return self.opener.open(request.Request(url, headers=headers, method=method))
+
+    def send(self, url, headers, method='GET'):
+        """Send a request through the archive, if any: the response is recorded or replayed.
+
+        Args:
+            url: URL to request.
+            headers: Dictionary of request headers.
+            method: HTTP method (`GET` or `HEAD`).
+
+        Returns:
+            The response, to be closed by the caller.
+
+        Raises:
+            HTTPError: Protocol error.
+            URLError: URL incorrect (or not in the archive, when replaying).
+        """
+        try:
+            if self.archive is None:
+                return self.open(url, headers, method)
+            if self.archive.replay:
+                return self.archive.open(url, headers, method)
+            try:
+                response = self.open(url, headers, method)
+            except error.HTTPError as ex:
+                self.archive.record_error(url, headers, method, ex)
+                raise
+            return self.archive.record(url, headers, method, response)
+        finally:
+            self.local.responded = time.time()
+
+    def responded(self):
+        """Time at which the calling thread last got the headers of a response (or an error).
+
+        The body isn't read yet at that time, so it measures the server latency
+        independently of the size of the content.
+
+        Returns:
+            Time in seconds since the epoch (`None` if no request was sent by the thread).
+        """
+        return getattr(self.local, 'responded', None)
+
+    def head(self, url):
+        """Obtain the MIME type and size of a resource without downloading it (HEAD request).
+
+        Args:
+            url: URL of the resource.
+
+        Returns:
+            Tuple of HTTP status code, MIME type and content length (`None` if not provided).
+
+        Raises:
+            HTTPError: Protocol error.
+            URLError: URL incorrect.
+        """
+        with self.send(url, {'Accept-Encoding': self.accept_encoding}, 'HEAD') as response:
+            length = response.info().get('Content-Length', '')
+            self.account(parse.urlparse(url).netloc, 0, 0)
+            return response.getcode(), response.info().get_content_type(), int(length) if length.isdigit() else None
+
+    def close(self):
+        """Release the connections (`urlopen` doesn't keep them open)."""
+        pass
+
+    def stream(self, url):
+        """Download URL content as a stream of decoded chunks, without buffering it.
+
+        Args:
+            url: URL to download.
+
+        Yields:
+            Chunks of the decoded content (bytes).
+
+        Raises:
+            HTTPError: Protocol error.
+            URLError: URL incorrect.
+        """
+        with self.send(url, {'Accept-Encoding': self.accept_encoding}) as response:
+            decoder = Decoder(response.info().get('Content-Encoding'), self.chunk_size)
+            transferred = decoded = 0
+            try:
+                while True:
+                    data = response.read(self.chunk_size)
+                    transferred += len(data)
+                    for piece in decoder.decompress(data) if data else decoder.flush():
+                        decoded += len(piece)
+                        yield piece
+                    if not data:
+                        break
+            finally:
+                self.account(parse.urlparse(url).netloc, transferred, decoded)
+
+    def read_partial(self, url, response):
+        """Read the head of a response and leave the rest to be fetched by ranges.
+
+        Args:
+            url: URL of the response.
+            response: Response object returned by `urlopen`.
+
+        Returns:
+            The content (`PartialContent`), or `None` if the server doesn't support
+            ranges or the content is too small to be worth it (the response is untouched).
+
+        Raises:
+            ContentTooLargeError: The content exceeds the maximum size.
+        """
+        headers = response.info()
+        length = headers.get('Content-Length', '')
+        if headers.get('Accept-Ranges', '').strip().lower() != 'bytes' or not length.isdigit() or \
+                not Decoder(headers.get('Content-Encoding'), self.chunk_size).identity or \
+                int(length) <= 2 * (self.triage_head + self.triage_tail):
+            return None
+        length = int(length)
+        if self.max_size and length > self.max_size:
+            raise ContentTooLargeError('Content length %d exceeds the limit of %d bytes' % (length, self.max_size))
+        # Only strong validators can be used to check the ranges come from the same content
+        validator = headers.get('ETag')
+        if not validator or validator.startswith('W/'):
+            validator = headers.get('Last-Modified')
+        content = PartialContent(self, url, length, validator)
+        # The rest of the body is abandoned when the response is closed
+        head = response.read(self.triage_head)
+        self.account(parse.urlparse(url).netloc, len(head), len(head))
+        content.add(0, head)
+        content.prefetch(length - self.triage_tail, length)
+        return content
+
+    def read(self, response, host):
+        """Read and decode the body of a response.
+
+        Args:
+            response: Response object returned by `urlopen`.
+            host: Host name to account the transfer.
+
+        Returns:
+            Decoded content (`ContentBuffer`).
+
+        Raises:
+            ContentTooLargeError: The content exceeds the maximum size.
+        """
+        decoder = Decoder(response.info().get('Content-Encoding'), self.chunk_size)
+        length = response.info().get('Content-Length')
+        if self.max_size and decoder.identity and length and length.isdigit() and int(length) > self.max_size:
+            raise ContentTooLargeError('Content length %s exceeds the limit of %d bytes' % (length, self.max_size))
+        content = ContentBuffer(self.spool_dir, self.max_memory)
+        transferred = 0
+        try:
+            while True:
+                data = response.read(self.chunk_size)
+                for piece in decoder.decompress(data) if data else decoder.flush():
+                    content.write(piece)
+                    if self.max_size and content.tell() > self.max_size:
+                        raise ContentTooLargeError('Decoded content exceeds the limit of %d bytes' % self.max_size)
+                if not data:
+                    break
+                transferred += len(data)
+        except BaseException:
+            content.release()
+            raise
+        self.account(host, transferred, content.tell())
+        return content
+
+    def account(self, host, transferred, decoded):
+        """Add a response to the transfer stats.
+
+        Args:
+            host: Host name.
+            transferred: Bytes transferred over the network.
+            decoded: Size of the content after decoding.
+        """
+        with self.lock:
+            stats = self.stats.setdefault(host, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += transferred
+            stats[2] += decoded
+
+    def compression_ratio(self, host=None):
+        """Ratio between decoded and transferred bytes.
+
+        Args:
+            host: Host name (all hosts if `None`).
+
+        Returns:
+            The ratio (1 if nothing was transferred).
+        """
+        with self.lock:
+            if host is None:
+                transferred = sum(s[1] for s in self.stats.values())
+                decoded = sum(s[2] for s in self.stats.values())
+            else:
+                _, transferred, decoded = self.stats.get(host, (0, 0, 0))
+        return decoded / transferred if transferred else 1
+
+
+class PartialContent(RawIOBase):
+    """Read-only, seekable stream over a remote content, fetched by blocks on demand.
+
+    Blocks not yet read are fetched with HTTP range requests, so a processor can
+    score a document reading only its head, its tail and the objects it needs.
+    Documents to be stored are then completed with `complete`.
+
+    Note:
+        Use `release` (or `complete`) when done, like with `ContentBuffer`.
+
+    """
+    def __init__(self, fetcher, url, length, validator=None):
+        """Initialize the stream.
+
+        Args:
+            fetcher: `Fetcher` instance (for settings and accounting).
+            url: URL of the content.
+            length: Size of the content in bytes.
+            validator: ETag or Last-Modified value to check that ranges come from the same content.
+        """
+        RawIOBase.__init__(self)
+        self.fetcher = fetcher
+        self.url = url
+        self.length = length
+        self.validator = validator
+        self.block_size = fetcher.chunk_size
+        self.host = parse.urlparse(url).netloc
+        # Cached blocks by index
+        self.blocks = {}
+        self.position = 0
+        # Bytes transferred so far
+        self.transferred = 0
+
+    def __len__(self):
+        """Magic method for len()
+        Returns:
+            Size of the content in bytes.
+        """
+        return self.length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.length
+        if offset < 0:
+            raise ValueError('Negative seek position %d' % offset)
+        self.position = offset
+        return offset
+
+    def readinto(self, b):
+        """Read bytes into a buffer, fetching the missing blocks."""
+        end = min(self.position + len(b), self.length)
+        if end <= self.position:
+            return 0
+        self.prefetch(self.position, end)
+        n = 0
+        while self.position < end:
+            index, offset = divmod(self.position, self.block_size)
+            block = self.blocks[index]
+            piece = block[offset:offset + end - self.position]
+            b[n:n + len(piece)] = piece
+            n += len(piece)
+            self.position += len(piece)
+        return n
+
+    def view(self):
+        """Obtain a read-only, seekable stream over the content (the instance itself)."""
+        self.seek(0)
+        return self
+
+    def add(self, start, data):
+        """Cache the complete blocks of a piece of content.
+
+        Args:
+            start: Offset of the piece (at a block boundary).
+            data: Bytes of the piece.
+        """
+        index = start // self.block_size
+        for i in range(0, len(data), self.block_size):
+            block = data[i:i + self.block_size]
+            # Partial blocks are only kept at the end of the content
+            if len(block) == self.block_size or start + i + len(block) == self.length:
+                self.blocks[index + i // self.block_size] = block
+
+    def missing(self, start=0, end=None):
+        """Find the byte ranges not yet fetched.
+
+        Args:
+            start: First offset.
+            end: Last offset (excluded, end of content by default).
+
+        Returns:
+            List of tuples of start and end offsets, aligned to blocks and coalesced.
+        """
+        end = self.length if end is None else end
+        ranges = []
+        for index in range(start // self.block_size, (end - 1) // self.block_size + 1):
+            if index not in self.blocks:
+                first = index * self.block_size
+                last = min(first + self.block_size, self.length)
+                if ranges and ranges[-1][1] == first:
+                    ranges[-1] = (ranges[-1][0], last)
+                else:
+                    ranges.append((first, last))
+        return ranges
+
+    def prefetch(self, start, end):
+        """Fetch and cache the missing blocks of a byte range.
+
+        Args:
+            start: First offset.
+            end: Last offset (excluded).
+        """
+        for first, last in self.missing(max(0, start), min(end, self.length)):
+            with self.request(first, last) as response:
+                self.add(first, response.read())
+
+    def request(self, start, end):
+        """Open a range request.
+
+        Args:
+            start: First offset.
+            end: Last offset (excluded).
+
+        Returns:
+            The response, positioned at the start of the range.
+
+        Raises:
+            HTTPError: Protocol error.
+            URLError: URL incorrect.
+            RangeNotSatisfiedError: The server didn't return the range or the content changed.
+        """
+        headers = {'Range': 'bytes=%d-%d' % (start, end - 1), 'Accept-Encoding': 'identity'}
+        if self.validator:
+            # If the content changed the whole new content is sent instead of the range
+            headers['If-Range'] = self.validator
+        response = self.fetcher.send(self.url, headers)
+        match = _CONTENT_RANGE.match(response.info().get('Content-Range', ''))
+        if response.getcode() != 206 or not match or \
+                (int(match.group(1)), int(match.group(2)) + 1, match.group(3)) != (start, end, str(self.length)):
+            response.close()
+            raise RangeNotSatisfiedError('Range %d-%d of %s not returned' % (start, end - 1, self.url))
+        self.transferred += end - start
+        self.fetcher.account(self.host, end - start, end - start)
+        return response
+
+    def complete(self):
+        """Fetch the missing parts of the content and release the stream.
+
+        Returns:
+            The whole content (`ContentBuffer`).
+
+        Raises:
+            HTTPError: Protocol error.
+            URLError: URL incorrect.
+            RangeNotSatisfiedError: The server didn't return a range or the content changed.
+        """
+        content = ContentBuffer(self.fetcher.spool_dir, self.fetcher.max_memory)
+        try:
+            missing = dict(self.missing())
+            index = 0
+            while index * self.block_size < self.length:
+                start = index * self.block_size
+                if start in missing:
+                    # Missing ranges are streamed to the buffer, not cached
+                    with self.request(start, missing[start]) as response:
+                        while True:
+                            data = response.read(self.block_size)
+                            if not data:
+                                break
+                            content.write(data)
+                    index = -(-missing[start] // self.block_size)
+                else:
+                    content.write(self.blocks[index])
+                    index += 1
+            if content.tell() != self.length:
+                raise RangeNotSatisfiedError('Incomplete content of %s' % self.url)
+        except BaseException:
+            content.release()
+            raise
+        finally:
+            self.release()
+        return content
+
+    def release(self):
+        """Free the cached blocks."""
+        self.blocks = {}
+        self.close()
+
+
+_CONTENT_RANGE = re.compile(r'\s*bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class Decoder:
+    """Incremental decoder for HTTP content encodings.
+
+    Output is produced in pieces of bounded size, so the caller can stop
+    before a highly compressed content is fully expanded in memory.
+    """
+    def __init__(self, encoding, chunk_size):
+        """Initialize the decoder.
+
+        Args:
+            encoding: Value of the `Content-Encoding` header (`None` for identity).
+            chunk_size: Maximum size of each decoded piece.
+        """
+        self.encoding = (encoding or 'identity').strip().lower()
+        self.chunk_size = chunk_size
+        self.identity = False
+        self.zlib = None
+        self.brotli = None
+        if self.encoding in ('gzip', 'x-gzip'):
+            self.zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            # Most servers send zlib wrapped data, but some send raw deflate streams
+            self.zlib = zlib.decompressobj()
+            self.started = False
+        elif self.encoding == 'br' and brotli:
+            self.brotli = brotli.Decompressor()
+        else:
+            # Identity or unknown encodings are passed through
+            self.identity = True
+
+    def decompress(self, data):
+        """Decode a chunk of data.
+
+        Args:
+            data: Encoded bytes.
+
+        Yields:
+            Decoded pieces of about `chunk_size` bytes at most.
+        """
+        if self.identity:
+            yield data
+        elif self.brotli:
+            # Output left in the decompressor is taken without more input, until there's none
+            piece = self.brotli.process(data, output_buffer_limit=self.chunk_size)
+            while piece:
+                yield piece
+                if self.brotli.is_finished():
+                    break
+                piece = self.brotli.process(b'', output_buffer_limit=self.chunk_size)
+        else:
+            if self.encoding == 'deflate' and not self.started:
+                self.started = True
+                try:
+                    piece = self.zlib.decompress(data, self.chunk_size)
+                except zlib.error:
+                    self.zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+                    piece = self.zlib.decompress(data, self.chunk_size)
+                yield piece
+                data = self.zlib.unconsumed_tail
+            while data:
+                yield self.zlib.decompress(data, self.chunk_size)
+                data = self.zlib.unconsumed_tail
+
+    def flush(self):
+        """Decode the remaining data at the end of the stream.
+
+        Yields:
+            Decoded pieces.
+        """
+        if self.zlib:
+            yield self.zlib.flush()
+
+
+class HeadRedirectHandler(request.HTTPRedirectHandler):
+    """Redirection handler that keeps HEAD requests as such (`urlopen` follows them with GET)."""
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new = request.HTTPRedirectHandler.redirect_request(self, req, fp, code, msg, headers, newurl)
+        if new is not None and req.get_method() == 'HEAD':
+            new.method = 'HEAD'
+        return new
+
+
+class ContentTooLargeError(Exception):
+    """The content of a response exceeds the maximum size."""
+    pass
+
+
+class RangeNotSatisfiedError(Exception):
+    """A range request of a partially fetched content failed."""
+    pass
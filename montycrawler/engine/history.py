@@ -0,0 +1,116 @@
+from urllib.parse import urlsplit
+from threading import Lock
+import math
+import re
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+_TOKEN = re.compile('[a-z0-9]+')
+
+
+def url_tokens(url):
+    """Split path and query of an URL in lowercase alphanumeric tokens.
+
+    Args:
+        url: The URL.
+
+    Returns:
+        Set of tokens (str).
+    """
+    parts = urlsplit(url.lower())
+    return set(_TOKEN.findall(parts.path + ' ' + parts.query))
+
+
+class YieldHistory:
+    """Counts of fetched resources and accepted documents, by host and by URL token.
+
+    It's the training data for link scorers: the yield of a host or a token is
+    the ratio of fetched URLs that turned out to be accepted documents.
+    """
+    def __init__(self, min_samples=5):
+        """Initialize empty counts.
+
+        Args:
+            min_samples: Minimum number of fetches of a token to estimate its weight.
+        """
+        self.min_samples = min_samples
+        self.lock = Lock()
+        # Lists of fetched and accepted counts by key
+        self.hosts = {}
+        self.tokens = {}
+        self.fetched = 0
+        self.accepted = 0
+
+    def record_fetch(self, url):
+        """Account a fetched resource.
+
+        Args:
+            url: URL of the resource.
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            self.fetched += 1
+            self.hosts.setdefault(host, [0, 0])[0] += 1
+            for token in url_tokens(url):
+                self.tokens.setdefault(token, [0, 0])[0] += 1
+
+    def record_accepted(self, url):
+        """Account an accepted document.
+
+        Args:
+            url: URL of the resource where the document was retrieved from.
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            self.accepted += 1
+            self.hosts.setdefault(host, [0, 0])[1] += 1
+            for token in url_tokens(url):
+                self.tokens.setdefault(token, [0, 0])[1] += 1
+
+    @property
+    def rate(self):
+        """Global ratio of accepted documents per fetch (smoothed)."""
+        return (self.accepted + 1) / (self.fetched + 2)
+
+    def host_yield(self, host):
+        """Ratio of accepted documents per fetch of a host, smoothed towards the global ratio.
+
+        Args:
+            host: Host name (and port, if any).
+
+        Returns:
+            The ratio (float between 0 and 1).
+        """
+        fetched, accepted = self.hosts.get(host, (0, 0))
+        return (accepted + self.rate) / (fetched + 1)
+
+    def token_weight(self, token):
+        """Log-odds of an URL token yielding accepted documents, relative to the global ratio.
+
+        Args:
+            token: The token.
+
+        Returns:
+            The weight (positive if the token predicts documents, 0 if unknown).
+        """
+        fetched, accepted = self.tokens.get(token, (0, 0))
+        if fetched < self.min_samples:
+            return 0
+        rate = self.rate
+        p = (accepted + rate) / (fetched + 1)
+        return math.log(p / (1 - p)) - math.log(rate / (1 - rate)) if 0 < p < 1 else 0
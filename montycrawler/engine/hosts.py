@@ -0,0 +1,161 @@
+from threading import Lock
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+# Offset of the priorities of the pending items of deprioritized hosts: they go after the items
+# of the other hosts (ranked ones included, see `LinkRanker`) keeping their order among them.
+# Their items without priority go last in the band, before the items without priority of the rest
+DEPRIORITIZED = -1000
+UNRANKED_DEPRIORITIZED = 2 * DEPRIORITIZED
+
+# Host states
+ACTIVE = 'ACTIVE'
+DEPRIORITIZED_STATE = 'DEPRIORITIZED'
+STOPPED = 'STOPPED'
+
+
+class HostTracker:
+    """Per host accounting of the crawl and enforcement of crawl budgets.
+
+    Counts pages fetched, PDFs found, accepted documents and bytes downloaded
+    for each host. Hosts that don't yield accepted documents are deprioritized
+    and then stopped, so the crawl capacity goes to productive sites.
+    """
+    def __init__(self, max_pages=0, deprioritize_after=0, stop_after=0):
+        """Initialize the tracker.
+
+        Args:
+            max_pages: Maximum number of pages fetched from a host (0 for no limit).
+            deprioritize_after: Fetches without accepted documents to deprioritize a host (0 to disable).
+            stop_after: Fetches without accepted documents to stop crawling a host (0 to disable).
+        """
+        self.max_pages = max_pages
+        self.deprioritize_after = deprioritize_after
+        self.stop_after = stop_after
+        self.lock = Lock()
+        # Lists of fetched, PDFs, accepted and bytes by host
+        self.stats = {}
+        self.states = {}
+
+    def state(self, host):
+        """Obtain the state of a host.
+
+        Args:
+            host: Host name (and port, if any).
+
+        Returns:
+            `ACTIVE`, `DEPRIORITIZED_STATE` or `STOPPED`.
+        """
+        return self.states.get(host, ACTIVE)
+
+    def record_fetch(self, host, size=0, pdf=False):
+        """Account a fetched resource and update the state of the host.
+
+        Args:
+            host: Host name (and port, if any).
+            size: Bytes downloaded.
+            pdf: T/F the resource is a PDF document.
+
+        Returns:
+            New state of the host if it changed, otherwise `None`.
+        """
+        with self.lock:
+            stats = self.stats.setdefault(host, [0, 0, 0, 0])
+            stats[0] += 1
+            stats[3] += size
+            if pdf:
+                stats[1] += 1
+            return self._update(host, stats)
+
+    def record_accepted(self, host):
+        """Account an accepted document (it may reactivate a deprioritized host).
+
+        Args:
+            host: Host name (and port, if any).
+
+        Returns:
+            New state of the host if it changed, otherwise `None`.
+        """
+        with self.lock:
+            stats = self.stats.setdefault(host, [0, 0, 0, 0])
+            stats[2] += 1
+            return self._update(host, stats)
+
+    def _update(self, host, stats):
+        """Apply the budget rules to a host.
+
+        Args:
+            host: Host name.
+            stats: Counts of the host.
+
+        Returns:
+            New state of the host if it changed, otherwise `None`.
+        """
+        fetched, _, accepted, _ = stats
+        old = self.states.get(host, ACTIVE)
+        if old == STOPPED:
+            return None
+        if (self.max_pages and fetched >= self.max_pages) or \
+                (self.stop_after and not accepted and fetched >= self.stop_after):
+            new = STOPPED
+        elif self.deprioritize_after and not accepted and fetched >= self.deprioritize_after:
+            new = DEPRIORITIZED_STATE
+        else:
+            new = ACTIVE
+        if new == old:
+            return None
+        self.states[host] = new
+        return new
+
+    def summary(self):
+        """Obtain the stats of all the hosts.
+
+        Returns:
+            List of tuples of host, state, fetched, PDFs, accepted and bytes, sorted by host.
+        """
+        with self.lock:
+            return [(host, self.state(host)) + tuple(stats) for host, stats in sorted(self.stats.items())]
+
+
+def deprioritize(priority):
+    """Move a priority to the band of the deprioritized hosts.
+
+    Args:
+        priority: Priority of a pending item (`None` if it has no priority).
+
+    Returns:
+        The priority in the band (see `DEPRIORITIZED`).
+    """
+    return UNRANKED_DEPRIORITIZED if priority is None else priority + DEPRIORITIZED
+
+
+def restore_priority(priority):
+    """Inverse of `deprioritize`.
+
+    Args:
+        priority: Priority in the band of the deprioritized hosts.
+
+    Returns:
+        The original priority (`None` if it had no priority).
+    """
+    return None if priority == UNRANKED_DEPRIORITIZED else priority - DEPRIORITIZED
+
+
+def is_deprioritized(priority):
+    """Checks if a priority is in the band of the deprioritized hosts."""
+    return priority is not None and priority <= DEPRIORITIZED // 2
@@ -0,0 +1,259 @@
+from urllib import error, parse
+from http.client import HTTPMessage
+from threading import Condition, local
+from engine.fetcher import Fetcher
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Http2Fetcher(Fetcher):
+    """Fetcher that multiplexes the requests to each host over one HTTP/2 connection.
+
+    Requests go through a shared `httpx` client, so the dispatchers fetching
+    from the same host send their requests as concurrent streams of the same
+    connection instead of waiting for a free HTTP/1.1 connection. Hosts that
+    don't negotiate HTTP/2 are fetched with HTTP/1.1 keep-alive connections.
+
+    The number of concurrent streams per host is limited and adapts to the
+    responses of the host (see `HostStreams`), so multiplexing doesn't turn
+    into hammering a server.
+
+    Note:
+        Requires the `httpx` module with HTTP/2 support (`pip install httpx[http2]`).
+        Decoding, size limits, triage and accounting are the ones of `Fetcher`.
+
+    """
+    def __init__(self, max_size=None, spool_dir=None, max_memory=1024 * 1024, triage=False,
+                 triage_head=64 * 1024, triage_tail=64 * 1024, max_streams=8, timeout=60,
+                 prior_knowledge=False, archive=None):
+        """Initialize the fetcher.
+
+        Args:
+            max_size: Maximum size in bytes of the decoded content (`None` for no limit).
+            spool_dir: Folder to spool large contents (system temp folder by default).
+            max_memory: Maximum size in bytes of a content kept in memory.
+            triage: T/F fetch documents partially when the server supports ranges.
+            triage_head: Bytes read from the start of partially fetched documents.
+            triage_tail: Bytes read from the end of partially fetched documents.
+            max_streams: Maximum number of concurrent requests to a host.
+            timeout: Seconds to wait for a connection or data.
+            prior_knowledge: T/F use HTTP/2 without negotiation, also over plain HTTP (h2c).
+            archive: `Archive` instance to record or replay the responses (optional).
+
+        Raises:
+            ImportError: `httpx` isn't installed.
+        """
+        if httpx is None:
+            raise ImportError('The HTTP/2 fetcher requires the httpx module (pip install httpx[http2])')
+        Fetcher.__init__(self, max_size, spool_dir, max_memory, triage, triage_head, triage_tail, archive)
+        self.streams = HostStreams(max_streams)
+        # No limit of connections: there's one per host, and the streams are limited by host
+        self.client = httpx.Client(http1=not prior_knowledge, http2=True, follow_redirects=True,
+                                   timeout=timeout, limits=httpx.Limits(max_connections=None,
+                                                                        max_keepalive_connections=None))
+        # Responses by HTTP version
+        self.versions = {}
+
+    def open(self, url, headers, method='GET'):
+        """Send a request as a new stream of the connection to the host.
+
+        Args:
+            url: URL to request.
+            headers: Dictionary of request headers.
+            method: HTTP method (`GET` or `HEAD`).
+
+        Returns:
+            The response (`Http2Response`, with the interface of the responses of
+            `urlopen`), to be closed by the caller.
+
+        Raises:
+            HTTPError: Protocol error.
+            URLError: URL incorrect.
+        """
+        host = parse.urlparse(url).netloc
+        self.streams.acquire(host)
+        try:
+            response = self.client.send(self.client.build_request(method, url, headers=headers), stream=True)
+        except (httpx.HTTPError, httpx.InvalidURL) as ex:
+            self.streams.release(host)
+            raise error.URLError(ex)
+        self.streams.feedback(host, response.status_code)
+        with self.lock:
+            self.versions[response.http_version] = self.versions.get(response.http_version, 0) + 1
+        response = Http2Response(response, lambda: self.streams.release(host))
+        if response.getcode() >= 400:
+            response.close()
+            raise error.HTTPError(url, response.getcode(), response.reason, response.info(), None)
+        return response
+
+    def close(self):
+        """Close the connections."""
+        self.client.close()
+
+
+class Http2Response:
+    """Streaming `httpx` response with the interface of the responses of `urlopen`."""
+    def __init__(self, response, on_close=None):
+        """Wrap a response.
+
+        Args:
+            response: Streaming `httpx.Response`.
+            on_close: Function called once when the response is closed (optional).
+        """
+        self.response = response
+        self.on_close = on_close
+        self.reason = response.reason_phrase
+        self.headers = HTTPMessage()
+        for name, value in response.headers.multi_items():
+            self.headers[name] = value
+        # Raw body, not decoded (the fetcher decodes it)
+        self.chunks = response.iter_raw()
+        self.buffer = b''
+
+    def getcode(self):
+        """HTTP status code."""
+        return self.response.status_code
+
+    def info(self):
+        """Response headers (`HTTPMessage`)."""
+        return self.headers
+
+    def read(self, amt=None):
+        """Read the body.
+
+        Args:
+            amt: Maximum number of bytes (`None` to read to the end).
+
+        Returns:
+            The data (bytes, empty at the end).
+
+        Raises:
+            URLError: The connection failed.
+        """
+        try:
+            while amt is None or len(self.buffer) < amt:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                self.buffer += chunk
+        except httpx.HTTPError as ex:
+            raise error.URLError(ex)
+        if amt is None:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:amt], self.buffer[amt:]
+        return data
+
+    def close(self):
+        """Close the stream (the rest of the body is abandoned)."""
+        self.response.close()
+        if self.on_close:
+            on_close, self.on_close = self.on_close, None
+            on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class HostStreams:
+    """Limits of concurrent requests by host, adapted to their responses.
+
+    The limit of a host is halved when it answers that it's overloaded (429 or
+    503) and it grows by one after `window` other responses, up to `max_streams`.
+
+    Note:
+        Requests opened by a thread that already has one open to the same host
+        (range requests of a partially fetched document) don't wait for a slot,
+        so a thread never waits for itself.
+
+    """
+    # Overload responses
+    overloaded = (429, 503)
+
+    def __init__(self, max_streams=8, window=20):
+        """Initialize the limits.
+
+        Args:
+            max_streams: Maximum number of concurrent requests to a host.
+            window: Number of responses without overload to grow the limit of a host.
+        """
+        self.max_streams = max(1, max_streams)
+        self.window = window
+        self.cond = Condition()
+        # Open requests, limit and responses since the last change, by host
+        self.active = {}
+        self.limits = {}
+        self.responses = {}
+        self.local = local()
+
+    def limit(self, host):
+        """Current limit of concurrent requests to a host."""
+        return self.limits.get(host, self.max_streams)
+
+    def acquire(self, host):
+        """Wait for a free slot to send a request to a host.
+
+        Args:
+            host: Host name (and port, if any).
+        """
+        held = getattr(self.local, 'held', None)
+        if held is None:
+            held = self.local.held = {}
+        with self.cond:
+            if not held.get(host):
+                self.cond.wait_for(lambda: self.active.get(host, 0) < self.limit(host))
+            self.active[host] = self.active.get(host, 0) + 1
+        held[host] = held.get(host, 0) + 1
+
+    def release(self, host):
+        """Free the slot of a finished request.
+
+        Args:
+            host: Host name (and port, if any).
+        """
+        held = getattr(self.local, 'held', {})
+        if held.get(host):
+            held[host] -= 1
+        with self.cond:
+            self.active[host] -= 1
+            self.cond.notify_all()
+
+    def feedback(self, host, code):
+        """Adapt the limit of a host to a response.
+
+        Args:
+            host: Host name (and port, if any).
+            code: HTTP status code.
+        """
+        with self.cond:
+            if code in self.overloaded:
+                self.limits[host] = max(1, self.limit(host) // 2)
+                self.responses[host] = 0
+            else:
+                self.responses[host] = self.responses.get(host, 0) + 1
+                if self.responses[host] >= self.window and self.limit(host) < self.max_streams:
+                    self.limits[host] = self.limit(host) + 1
+                    self.responses[host] = 0
@@ -1,139 +1,336 @@
-from db.utils import setupdb
-from db.logs import Base, LogEntry, Message, ThreadStatus
-from threading import RLock, current_thread
-import time
-
-# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
-
-# This file is part of Montycrawler.
-
-# Montycrawler is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, either version 3 of the License, or
-# (at your option) any later version.
-
-# Montycrawler is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-# GNU General Public License for more details.
-
-# You should have received a copy of the GNU General Public License
-# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
-
-
-class Logger:
-    """Generate and store logs in a separate database"""
-    def __init__(self, verbose=False):
-        """Initialize logger.
-
-        Args:
-            verbose: T/F dump all messages to console (by default only errors).
-        """
-        self.verbose = verbose
-        self.session = setupdb('log', Base, True)
-        self.lock = RLock()
-
-        # Fill message labels
-        messages = (
-            Message(label='DEBUG'),
-            Message(label='ERROR'),
-            Message(label='PROCESS_URL'),
-            Message(label='MAX_DEPTH_REACHED'),
-            Message(label='PROCESSED_OK'),
-            Message(label='THREAD_STARTED'),
-            Message(label='THREAD_FINISHED'),
-            Message(label='THREAD_ABORTED'),
-            Message(label='DOWNLOADED'),
-            Message(label='DISALLOWED'),
-        )
-        self.session().bulk_save_objects(messages)
-
-        # Remove thread stats
-        self.session().query(ThreadStatus).delete()
-        self.session().commit()
-
-    def console(self, text):
-        """Prints text to console.
-
-        Args:
-            text: The text.
-        """
-        print(text)
-
-    def info(self, message, text=None, level='INFO'):
-        """Write message to logs (`INFO` level by default)
-
-        Args:
-            message: Message label.
-            text: Message text.
-            level: Message level (`INFO`, `ERROR` or `DEBUG`)
-
-        Returns:
-
-        """
-        # Write to console
-        if self.verbose or level == 'ERROR':
-            if text:
-                self.console('[%s] %s: %s' % (current_thread().name, message, text))
-            else:
-                self.console('[%s] %s' % (current_thread().name, message))
-
-        # Write to DB
-        with self.lock:
-            entry = LogEntry(type=level,
-                             message_label=message,
-                             text=text,
-                             thread=current_thread().name)
-            self.session().add(entry)
-            self.session().commit()
-
-    def error(self, text):
-        """Write error message to logs.
-
-        Args:
-            text: Error text.
-        """
-        self.info('ERROR', text, 'ERROR')
-
-    def debug(self, text):
-        """Write debug message to logs.
-
-        Args:
-            text: Debug text.
-        """
-        self.info('DEBUG', text, 'DEBUG')
-
-    def status(self, status, parsed, added, downloaded, start_time):
-        """Write thread status info.
-
-        Args:
-            status: Status code.
-            parsed: Number of links parsed.
-            added: Number of links added.
-            downloaded: Number of documents downloaded.
-            start_time: Start time.
-        """
-        with self.lock:
-            stat = self.session().query(ThreadStatus).filter_by(thread=current_thread().name).one_or_none()
-            if stat is None:
-                # TODO log actual running time
-                stat = ThreadStatus(thread=current_thread().name,
-                                    status=status,
-                                    parsed=parsed,
-                                    added=added,
-                                    downloaded=downloaded,
-                                    running_time=round(time.time() - start_time, 0))
-                self.session().add(stat)
-            else:
-                stat.status = status
-                stat.parsed = parsed
-                stat.added = added
-                stat.downloaded = downloaded
-                stat.running_time = round(time.time() - start_time, 0)
-
-            self.session().commit()
-
-    def some_running(self):
-        """Checks if there's any thread in `RUNNING` status."""
-        with self.lock:
-            return self.session().query(ThreadStatus).filter_by(status='RUNNING').count() > 0
+from db.utils import setupdb, SessionRecycler
+from db.logs import Base, LogEntry, LogCounter, Message, ThreadStatus
+from threading import RLock, current_thread, local
+import datetime
+import random
+import time
+import os
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Message labels
+LABELS = (
+    'DEBUG',
+    'ERROR',
+    'PROCESS_URL',
+    'MAX_DEPTH_REACHED',
+    'PROCESSED_OK',
+    'THREAD_STARTED',
+    'THREAD_FINISHED',
+    'THREAD_ABORTED',
+    'DOWNLOADED',
+    'DISALLOWED',
+    'TOO_LARGE',
+    'HOST_DEPRIORITIZED',
+    'HOST_STOPPED',
+    'LINK_FOUND',
+    'PREFILTERED',
+)
+
+
+class LogPolicy:
+    """Rule to store in the database the messages of a label or level.
+
+    Messages can be sampled (a fraction of them is stored), rate limited (a
+    maximum number per second and thread is stored) or only counted. All the
+    messages are counted anyway (see `LogCounter`).
+    """
+    def __init__(self, sample=1.0, rate=0, count_only=False):
+        """Initialize the policy.
+
+        Args:
+            sample: Fraction of the messages stored (between 0 and 1).
+            rate: Maximum number of messages stored per second and thread (0 for no limit).
+            count_only: T/F only count the messages.
+        """
+        self.sample = sample
+        self.rate = rate
+        self.count_only = count_only
+        self.local = local()
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse a policy specification.
+
+        The specification is `KEY=all`, `KEY=count` or `KEY=OPTION[,OPTION]`, where
+        KEY is a message label or level and the options are `sample:FRACTION` and
+        `rate:NUMBER` (for instance, `DEBUG=sample:0.1,rate:20`).
+
+        Args:
+            spec: The specification.
+
+        Returns:
+            Tuple of key and `LogPolicy`.
+
+        Raises:
+            ValueError: The specification isn't valid.
+        """
+        key, _, rules = spec.partition('=')
+        if not key or not rules:
+            raise ValueError('Log policy "%s" should be KEY=RULES' % spec)
+        if rules == 'all':
+            return key, cls()
+        if rules == 'count':
+            return key, cls(count_only=True)
+        options = {}
+        for rule in rules.split(','):
+            name, _, value = rule.partition(':')
+            if name not in ('sample', 'rate') or not value:
+                raise ValueError('Unknown rule "%s" in log policy "%s"' % (rule, spec))
+            options[name] = float(value) if name == 'sample' else int(value)
+        if not 0 <= options.get('sample', 1) <= 1:
+            raise ValueError('Sample of log policy "%s" should be between 0 and 1' % spec)
+        return key, cls(**options)
+
+    def allows(self):
+        """Decide whether a message is stored (called once for each message)."""
+        if self.count_only:
+            return False
+        if self.sample < 1 and random.random() >= self.sample:
+            return False
+        if self.rate:
+            second = int(time.time())
+            if getattr(self.local, 'second', None) != second:
+                self.local.second = second
+                self.local.written = 0
+            if self.local.written >= self.rate:
+                return False
+            self.local.written += 1
+        return True
+
+
+class Logger:
+    """Generate and store logs in a separate database
+
+    The messages stored can be limited by label or level with policies (see
+    `LogPolicy`), and counts of all the messages are stored periodically.
+    The database can be rotated by size or age into numbered segments
+    (`log.1.sqlite` is the newest one).
+    """
+    # Seconds between writes of message counts
+    counter_interval = 60
+    # Messages stored between checks of the size of the database
+    size_check = 1000
+
+    def __init__(self, verbose=False, db=True, policies=None, max_size=0, max_age=0, segments=5):
+        """Initialize logger.
+
+        Args:
+            verbose: T/F dump all messages to console (by default only errors).
+            db: T/F store logs in database (otherwise, they're only written to console).
+            policies: Dictionary of `LogPolicy` by message label or level (labels first).
+                Messages without a policy are all stored.
+            max_size: Size in bytes of the database to rotate it (0 for no limit).
+            max_age: Seconds to rotate the database (0 for no limit).
+            segments: Number of rotated segments kept.
+        """
+        self.verbose = verbose
+        self.lock = RLock()
+        self.session = None
+        self.recycler = None
+        self.policies = policies or {}
+        self.max_size = max_size
+        self.max_age = max_age
+        self.segments = segments
+        # Total and stored messages by label and level since `counter_start`
+        self.counters = {}
+        self.counter_start = datetime.datetime.utcnow()
+        self.segment_start = time.time()
+        self.written = 0
+        if not db:
+            return
+        # Tables are only created if they don't exist: log entries are kept between runs
+        self.file = 'log'
+        self.session = setupdb(self.file, Base)
+        self.recycler = SessionRecycler(self.session)
+        self.prepare()
+
+    def prepare(self, statuses=()):
+        """Complete the database: indexes, message labels and thread stats.
+
+        Args:
+            statuses: Thread stats (dictionaries of columns) to keep, the other ones are removed.
+        """
+        # Indexes added to existing databases
+        for index in LogEntry.__table__.indexes:
+            index.create(self.session.get_bind(), checkfirst=True)
+
+        # Fill missing message labels
+        existing = {label for label, in self.session().query(Message.label)}
+        self.session().bulk_save_objects([Message(label=label) for label in LABELS if label not in existing])
+
+        # Remove thread stats
+        self.session().query(ThreadStatus).delete()
+        self.session().bulk_insert_mappings(ThreadStatus, statuses)
+        self.session().commit()
+
+    def checkpoint(self):
+        """Unit of work boundary of the calling thread: its session is recycled periodically."""
+        if self.recycler:
+            self.recycler.checkpoint()
+
+    def console(self, text):
+        """Prints text to console.
+
+        Args:
+            text: The text.
+        """
+        print(text)
+
+    def info(self, message, text=None, level='INFO'):
+        """Write message to logs (`INFO` level by default)
+
+        Args:
+            message: Message label.
+            text: Message text.
+            level: Message level (`INFO`, `ERROR` or `DEBUG`)
+
+        Returns:
+
+        """
+        # Write to console
+        if self.verbose or level == 'ERROR':
+            if text:
+                self.console('[%s] %s: %s' % (current_thread().name, message, text))
+            else:
+                self.console('[%s] %s' % (current_thread().name, message))
+
+        # Write to DB
+        if self.session is None:
+            return
+        policy = self.policies.get(message) or self.policies.get(level)
+        write = policy is None or policy.allows()
+        with self.lock:
+            counter = self.counters.setdefault((message, level), [0, 0])
+            counter[0] += 1
+            if write:
+                counter[1] += 1
+                entry = LogEntry(type=level,
+                                 message_label=message,
+                                 text=text[:LogEntry.text.type.length] if text else text,
+                                 thread=current_thread().name)
+                self.session().add(entry)
+                self.session().commit()
+                self.written += 1
+            if (datetime.datetime.utcnow() - self.counter_start).total_seconds() >= self.counter_interval:
+                self.flush()
+            if self.due_rotation():
+                self.rotate()
+
+    def flush(self):
+        """Store the message counts since the previous call."""
+        if self.session is None:
+            return
+        with self.lock:
+            now = datetime.datetime.utcnow()
+            self.session().bulk_save_objects([LogCounter(type=level, message_label=message, total=total,
+                                                         written=written, start=self.counter_start, timestamp=now)
+                                              for (message, level), (total, written) in self.counters.items()])
+            self.session().commit()
+            self.counters = {}
+            self.counter_start = now
+
+    def due_rotation(self):
+        """Checks if the database must be rotated by age or size (checked every `size_check` messages)."""
+        if self.max_age and time.time() - self.segment_start >= self.max_age:
+            return True
+        if self.max_size and self.written >= self.size_check:
+            self.written = 0
+            return os.path.getsize(self.file + '.sqlite') >= self.max_size
+        return False
+
+    def rotate(self):
+        """Move the database to the first segment and start a new one.
+
+        Segments are shifted (`log.1.sqlite` to `log.2.sqlite`...) and the oldest
+        one is deleted. Thread stats are copied to the new database.
+        """
+        if self.session is None:
+            return
+        with self.lock:
+            self.flush()
+            statuses = [{column.name: getattr(stat, column.name) for column in ThreadStatus.__table__.columns}
+                        for stat in self.session().query(ThreadStatus)]
+            # Sessions release their connections on commit (other threads commit all their changes)
+            self.session.remove()
+            engine = self.session.get_bind()
+            engine.dispose()
+            segment = '%s.%%d.sqlite' % self.file
+            if os.path.exists(segment % self.segments):
+                os.remove(segment % self.segments)
+            for n in range(self.segments - 1, 0, -1):
+                if os.path.exists(segment % n):
+                    os.replace(segment % n, segment % (n + 1))
+            if self.segments > 0:
+                os.replace(self.file + '.sqlite', segment % 1)
+            else:
+                os.remove(self.file + '.sqlite')
+            Base.metadata.create_all(engine)
+            self.prepare(statuses)
+            self.segment_start = time.time()
+            self.written = 0
+            self.console('Log database rotated.')
+
+    def error(self, text):
+        """Write error message to logs.
+
+        Args:
+            text: Error text.
+        """
+        self.info('ERROR', text, 'ERROR')
+
+    def debug(self, text):
+        """Write debug message to logs.
+
+        Args:
+            text: Debug text.
+        """
+        self.info('DEBUG', text, 'DEBUG')
+
+    def status(self, status, parsed, added, downloaded, start_time):
+        """Write thread status info.
+
+        Args:
+            status: Status code.
+            parsed: Number of links parsed.
+            added: Number of links added.
+            downloaded: Number of documents downloaded.
+            start_time: Start time.
+        """
+        if self.session is None:
+            return
+        with self.lock:
+            stat = self.session().query(ThreadStatus).filter_by(thread=current_thread().name).one_or_none()
+            if stat is None:
+                # TODO log actual running time
+                stat = ThreadStatus(thread=current_thread().name,
+                                    status=status,
+                                    parsed=parsed,
+                                    added=added,
+                                    downloaded=downloaded,
+                                    running_time=round(time.time() - start_time, 0))
+                self.session().add(stat)
+            else:
+                stat.status = status
+                stat.parsed = parsed
+                stat.added = added
+                stat.downloaded = downloaded
+                stat.running_time = round(time.time() - start_time, 0)
+
+            self.session().commit()
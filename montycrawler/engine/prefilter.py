@@ -0,0 +1,226 @@
+from urllib import error, parse
+from threading import Lock
+import posixpath
+import re
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+# MIME types processed by the dispatchers
+PROCESSED_TYPES = ('text/html', 'application/pdf')
+
+# Extensions of URLs fetched without checks, with the MIME type they're expected to have
+ALLOWED_EXTENSIONS = {
+    'pdf': 'application/pdf',
+    'html': 'text/html', 'htm': 'text/html', 'xhtml': 'text/html', 'shtml': 'text/html',
+    'php': 'text/html', 'asp': 'text/html', 'aspx': 'text/html', 'jsp': 'text/html', 'cfm': 'text/html',
+}
+# Extensions of URLs never fetched: images, archives, media, office documents, code and fonts
+DENIED_EXTENSIONS = (
+    'jpg', 'jpeg', 'png', 'gif', 'bmp', 'tif', 'tiff', 'svg', 'webp', 'ico', 'psd', 'eps',
+    'zip', 'gz', 'tgz', 'bz2', 'xz', '7z', 'rar', 'tar', 'jar', 'iso', 'dmg', 'exe', 'msi', 'apk', 'deb', 'rpm',
+    'mp3', 'mp4', 'm4a', 'm4v', 'avi', 'mov', 'wmv', 'flv', 'mkv', 'webm', 'ogg', 'ogv', 'wav', 'flac', 'mpg',
+    'mpeg', 'swf',
+    'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'odt', 'ods', 'odp', 'rtf', 'epub',
+    'css', 'js', 'json', 'woff', 'woff2', 'ttf', 'otf', 'eot',
+)
+
+# Reasons of avoided fetches
+EXTENSION = 'extension'
+PATTERN = 'pattern'
+HEAD = 'head'
+
+_DIGITS = re.compile(r'\d+')
+
+
+class Prefilter:
+    """Decides whether resources are worth fetching before their body is transferred.
+
+    Checks go from cheap to expensive:
+
+    1. The extension of the URL: allowed extensions are fetched, denied ones
+       (images, archives, media...) are rejected.
+    2. The MIME types learned for the pattern of the URL in its host (see
+       `url_pattern`): when the last responses of a pattern agree, their type
+       is assumed.
+    3. A HEAD request, for the ambiguous URLs left (optional).
+
+    The types of the responses of HEAD and GET requests are learned. Fetches
+    avoided and an estimate of the bytes saved are kept in `avoided` and `saved`.
+
+    Note:
+        A single instance is shared by all the dispatchers.
+
+    """
+    def __init__(self, head=False, allow=None, deny=None, learn=True, min_samples=3, max_patterns=10000):
+        """Initialize the prefilter.
+
+        Args:
+            head: T/F check ambiguous URLs with a HEAD request.
+            allow: Extensions to fetch, besides `ALLOWED_EXTENSIONS` (list).
+            deny: Extensions to reject (list, `DENIED_EXTENSIONS` by default). Allowed ones win.
+            learn: T/F learn the MIME types of URL patterns.
+            min_samples: Number of responses of a pattern with the same MIME type to assume it.
+            max_patterns: Maximum number of patterns remembered (the oldest ones are forgotten).
+        """
+        self.head = head
+        self.allowed = dict(ALLOWED_EXTENSIONS)
+        self.allowed.update({ext.lower(): None for ext in allow or ()})
+        self.denied = {ext.lower() for ext in (DENIED_EXTENSIONS if deny is None else deny)} - set(self.allowed)
+        self.learn = learn
+        self.min_samples = min_samples
+        self.max_patterns = max_patterns
+        self.lock = Lock()
+        # Last MIME types and sizes (`None` if unknown) by pattern
+        self.patterns = {}
+        # Fetches avoided by reason, HEAD requests sent and bytes saved (known or estimated)
+        self.avoided = {EXTENSION: 0, PATTERN: 0, HEAD: 0}
+        self.heads = 0
+        self.saved = 0
+
+    def classify(self, url, types=PROCESSED_TYPES):
+        """Classify an URL without network requests.
+
+        Args:
+            url: The URL.
+            types: MIME types worth fetching.
+
+        Returns:
+            Tuple of verdict (T/F worth fetching, `None` if unknown) and reason (`EXTENSION`,
+            `PATTERN` or `None`).
+        """
+        ext = url_extension(url)
+        if ext in self.allowed:
+            return self.allowed[ext] is None or self.allowed[ext] in types, EXTENSION
+        if ext in self.denied:
+            return False, EXTENSION
+        mimetype = self.learned(url)
+        if mimetype:
+            return mimetype in types, PATTERN
+        return None, None
+
+    def check(self, url, fetcher, types=PROCESSED_TYPES, head=None, default=True):
+        """Decide whether an URL is worth fetching.
+
+        Args:
+            url: The URL.
+            fetcher: `Fetcher` instance for the HEAD requests.
+            types: MIME types worth fetching.
+            head: T/F check ambiguous URLs with a HEAD request (`head` attribute by default).
+            default: Decision for ambiguous URLs not checked with a HEAD request.
+
+        Returns:
+            T/F the URL is worth fetching.
+
+        Raises:
+            HTTPError: Protocol error of the HEAD request.
+            URLError: URL incorrect.
+        """
+        verdict, reason = self.classify(url, types)
+        if verdict is None and (self.head if head is None else head):
+            with self.lock:
+                self.heads += 1
+            try:
+                _, mimetype, size = fetcher.head(url)
+            except error.HTTPError as ex:
+                # Servers not supporting HEAD requests
+                if ex.code in (405, 501):
+                    return True
+                raise
+            self.record(url, mimetype, size)
+            verdict, reason = mimetype in types, HEAD
+        if verdict is None:
+            return default
+        if not verdict:
+            saved = (size or 0) if reason == HEAD else self.mean_size(url) if reason == PATTERN else 0
+            with self.lock:
+                self.avoided[reason] += 1
+                self.saved += saved
+        return verdict
+
+    def record(self, url, mimetype, size=None):
+        """Learn the MIME type of the response of an URL.
+
+        Args:
+            url: The URL.
+            mimetype: MIME type of the response.
+            size: Size in bytes of the content (`None` if unknown).
+        """
+        if not self.learn or not mimetype:
+            return
+        pattern = url_pattern(url)
+        with self.lock:
+            samples = self.patterns.pop(pattern, None)
+            if samples is None:
+                samples = []
+                if len(self.patterns) >= self.max_patterns:
+                    # The least recently recorded pattern
+                    del self.patterns[next(iter(self.patterns))]
+            samples.append((mimetype, size))
+            self.patterns[pattern] = samples[-self.min_samples:]
+
+    def learned(self, url):
+        """MIME type learned for the pattern of an URL.
+
+        Args:
+            url: The URL.
+
+        Returns:
+            The MIME type, or `None` if the last responses of the pattern aren't enough or don't agree.
+        """
+        with self.lock:
+            samples = self.patterns.get(url_pattern(url))
+        if not samples or len(samples) < self.min_samples:
+            return None
+        types = {mimetype for mimetype, _ in samples}
+        return types.pop() if len(types) == 1 else None
+
+    def mean_size(self, url):
+        """Mean size in bytes of the responses of the pattern of an URL (0 if unknown)."""
+        with self.lock:
+            sizes = [size for _, size in self.patterns.get(url_pattern(url), ()) if size is not None]
+        return sum(sizes) // len(sizes) if sizes else 0
+
+
+def url_extension(url):
+    """Extension of the last segment of the path of an URL.
+
+    Args:
+        url: The URL.
+
+    Returns:
+        The extension in lowercase, without dot (empty if there's none).
+    """
+    return posixpath.splitext(parse.urlsplit(url).path)[1][1:].lower()
+
+
+def url_pattern(url):
+    """Pattern of an URL: host, path with numbers replaced and names of the query parameters.
+
+    For instance, `http://host/files/123/get.php?id=4&lang=en` gives
+    `host/files/#/get.php?id&lang`.
+
+    Args:
+        url: The URL.
+
+    Returns:
+        The pattern (str).
+    """
+    parts = parse.urlsplit(url)
+    names = sorted({name for name, _ in parse.parse_qsl(parts.query, keep_blank_values=True)})
+    pattern = parts.netloc.lower() + _DIGITS.sub('#', parts.path)
+    return pattern + '?' + '&'.join(names) if names else pattern
@@ -1,329 +1,909 @@
-from urllib.parse import urljoin, urldefrag, urlparse
-from db.model import Pending, Base, Resource, Link, Document
-from db.utils import setupdb
-from threading import RLock
-import mimetypes
-import os
-import json
-
-# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
-
-# This file is part of Montycrawler.
-
-# Montycrawler is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, either version 3 of the License, or
-# (at your option) any later version.
-
-# Montycrawler is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-# GNU General Public License for more details.
-
-# You should have received a copy of the GNU General Public License
-# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
-
-# TODO: queue stats
-
-
-class Queue:
-    """Manages the pending queue as an iterator.
-
-    Retrieves the pending items from the database and manages the queue
-    inserting and discarding them as requested by the dispatchers.
-
-    Note:
-        This class manages all database operations, including the initial setup.
-        All operations have been isolated in one instance in order to avoid
-        concurrent access to database (as SQLite doesn't support concurrency).
-        It uses the `scoped session` paradigm of the SQLAlchemy engine, so each
-        thread has its own session. An extra lock mechanism has been added to
-        avoid collisions.
-
-    """
-    def __init__(self, reset=False, all_domains=False, retries=3):
-        """Class initialization.
-
-        Args:
-            reset: T/F wipe database before start.
-            all_domains: T = retrieve resources from any domain. F = only from origin domain.
-            retries: Number of times to retry before discarding a resource as unreachable.
-        """
-        self.all_domains = all_domains
-        self.retries = retries
-        self.lock = RLock()
-        self.session = setupdb('db', Base, reset)
-
-        # Get current queue from database.
-        # The session is scoped, for multithreading,
-        # so we have to instantiate it before each use
-        #
-        # Order by the "priority" or "id" columns.
-        # Using fake order clause because SQLite doesn't support NULLS LAST
-        q = self.session().query(Pending).order_by(Pending.priority == None, Pending.priority.desc(), Pending.id).all()
-        # Cache queue IDs and priorities to avoid repeating access to DB
-        self.queue = [(item.id, item.priority) for item in q]
-        # Cache URL resources
-        resources = self.session().query(Resource).all()
-        self.urlcache = [res.url for res in resources]
-
-    def __len__(self):
-        """Magic method for len()
-        Returns:
-            Length of the queue
-        """
-        return len(self.queue)
-
-    def __iter__(self):
-        """Magic method for iter()
-        Returns:
-            Iterable instance of the queue (self)
-        """
-        return self
-
-    def __next__(self):
-        """Magic method for next()
-        Returns:
-            Next item in the queue (`Pending` instance).
-        """
-        # Make queue operation atomic
-        with self.lock:
-            if self.queue:
-                # Pop element from top of the cached list
-                # (on database isn't removed until call to discard or discard_or_retry)
-                i, _ = self.queue.pop(0)
-                # Obtain object from DB by ID
-                return self.session().query(Pending).filter_by(id=i).one()
-            else:
-                raise StopIteration
-
-    def insert(self, item):
-        """Inserts an item in the queue.
-        Args:
-            item: `Pending` item.
-        """
-        """Ordered insert element on the cached queue"""
-        # Items are tuples of (id, priority)
-        i, p = item
-        # Protect queue reshape from concurrency
-        with self.lock:
-            if p is None:
-                # No priority, append to end
-                self.queue.append(item)
-            else:
-                newqueue = []
-                inserted = False
-                for item1 in self.queue:
-                    i1, p1 = item1
-                    # Insert item when lower priority found
-                    if not inserted and \
-                            (p1 is None or p1 < p):
-                        newqueue.append(item)
-                        inserted = True
-                    # Copy items except same id
-                    if i1 != i:
-                        newqueue.append(item1)
-                if not inserted:
-                    newqueue.append(item)
-                self.queue = newqueue
-
-    def add(self, resource, referrer=None, priority=None):
-        """
-        Add resource to queue and database (if not exists)
-
-        Args:
-            resource: The resource to be added
-            referrer: The referrer pending item in queue
-            priority: Integer to set order in the queue
-
-        Returns:
-            Tuple:
-                Pending item.
-                The item is new in queue (boolean).
-
-        Raises:
-            UrlNotValidError: URL not HTTP or HTTPS or host component empty.
-        """
-        # Normalize and complete URL
-        norm, _ = urldefrag(resource.url)
-        if referrer:
-            norm = urljoin(referrer.resource.url, norm)
-        ind = norm.find(';jsessionid')
-        if ind != -1:
-            norm = norm[0:ind]
-        # Only valid protocols
-        parsed = urlparse(norm)
-        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
-            raise MalformedUrlError(
-                'URL "%s" not valid. Use HTTP or HTTPS with at least the host component.' % norm)
-        # By default limit to the same base domain
-        if not self.all_domains and referrer and parsed.netloc != urlparse(referrer.resource.url).netloc:
-            raise NotInBaseDomainError('URL "%s" not in the base domain.' % norm)
-        resource.url = norm
-        # Look if resource on queue
-        with self.lock:
-            if resource.url in self.urlcache:
-                existing = self.session().query(Pending).join(Resource).filter(Resource.url == resource.url)
-                if existing.count() == 0:
-                    # Append operation must be protected from concurrency
-                    # Look if resource already exists
-                    actual = self.session().query(Resource).filter_by(url=resource.url).first()
-                    # Add pending item with priority and increase depth
-                    new = Pending(resource=actual, priority=priority,
-                                  depth=referrer.depth + 1 if referrer is not None else 0)
-                    # Add item to queue
-                    self.session().add(new)
-                    self.session().commit()
-                    self.insert((new.id, priority))
-                    return new, True
-                else:
-                    old = existing.first()
-                    # Override priority if bigger
-                    if priority is not None and \
-                            (old.priority is None or priority > old.priority):
-                        old.priority = priority
-                        self.session().commit()
-                        self.insert((old.id, priority))
-                    return old, False
-            else:
-                self.session().add(resource)
-                new = Pending(resource=resource, priority=priority,
-                              depth=referrer.depth + 1 if referrer is not None else 0)
-                self.session().add(new)
-                self.session().commit()
-                self.insert((new.id, priority))
-                self.urlcache.append(resource.url)
-                return new, True
-
-    def add_list(self, ref, title, links):
-        """Adds resources to the queue from a list of links.
-        Args:
-            ref: Referrer resource.
-            title: Referrer title.
-            links: List of links (tuples):
-                URL
-                Title
-                Priority
-        Returns:
-            Number of items added and rejected (tuple).
-        """
-        added = 0
-        rejected = 0
-        if title:
-            ref.resource.title = title
-            self.session().commit()
-        for u, t, p in links:
-            try:
-                with self.lock:
-                    # Add url to queue
-                    (p, new) = self.add(Resource(url=u, title=t), referrer=ref, priority=p)
-                    # Create link
-                    self.session().add(Link(text=t, referrer=ref.resource, target=p.resource))
-                    self.session().commit()
-                if new:
-                    added += 1
-            except UrlNotValidError:
-                rejected += 1
-        return added, rejected
-
-    def discard_or_retry(self, item):
-        """If a failed item has reached its maximum retries, discard it. It not, increase
-        retry count, decrease to half priority and re-insert it in the queue.
-
-        Args:
-            item: The item
-        Returns:
-            T/F the item was deleted.
-        """
-        with self.lock:
-            if item.retries + 1 >= self.retries:
-                self.session().delete(item)
-                self.session().commit()
-                return True
-            else:
-                # Increase retries and reduce half priority
-                if item.priority is not None:
-                    item.priority //= 2
-                item.retries += 1
-                self.session().commit()
-                # Insert in new place
-                self.insert((item.id, item.priority))
-                return False
-
-    def discard(self, item):
-        """Remove resource from pending items in database (if exists).
-        Args:
-            item: The item to be removed.
-        """
-        with self.lock:
-            self.session().delete(item)
-            self.session().commit()
-
-    def clear(self):
-        """Empty the queue and delete all records"""
-        with self.lock:
-            n = len(self.queue)
-            self.queue = []
-            # Empty Pending table
-            self.session().query(Pending).delete()
-            self.session().commit()
-        return n
-
-    def store(self, accepted, resource, mimetype, folder, rejected_folder, filename, metadata, content):
-        """Stores a document on filesystem and creates a new `Document` instance on database.
-        Args:
-            accepted: T/F write the document in the `accepted` folder, otherwise on `rejected`.
-            resource: The URL resource where the document was retrieved from.
-            mimetype: Standard MIME id for the type of content.
-            folder: Path to the `accepted` folder.
-            rejected_folder: Path to the `rejected` folder (content discarded if path is empty).
-            filename: Name for the file (it will be cleaned from not allowed chars).
-            metadata: Metadata dictionary for the document.
-            content: The binary content to be stored.
-        Returns:
-            The final name of the file (even it was written or not).
-        """
-        # Clean filename
-        cleaned = ''.join((c if c.isalnum() or c == '.' else '_' for c in filename))
-        # Append extension
-        ext = mimetypes.guess_extension(mimetype)
-        if not cleaned.endswith(ext):
-            cleaned += ext
-        # Append ID to avoid collision
-        cleaned = str(resource.id) + '_' + cleaned
-        # Write to filesystem
-        if accepted or rejected_folder:
-            # Check binary or text mode
-            mode = 'w' if mimetype.startswith('text/') else 'wb'
-            path = os.path.join(folder if accepted else rejected_folder, cleaned)
-            with open(path, mode) as f:
-                f.write(content)
-        # Register on db
-        with self.lock:
-            doc = Document(name=resource.title if metadata.get('/Title') is None else metadata.get('/Title'),
-                           author=metadata.get('/Author'),
-                           meta_data=json.dumps(metadata),
-                           filename=cleaned,
-                           type=mimetype,
-                           relevancy=metadata.get('_relevancy'),
-                           num_pages=metadata.get('_num_pages'),
-                           accepted=accepted)
-            self.session().add(doc)
-            resource.document = doc
-            self.session().commit()
-        return cleaned
-
-
-class UrlNotValidError(ValueError):
-    """Base exception raised when the URL provided is invalid for program's purpose"""
-    pass
-
-
-class MalformedUrlError(UrlNotValidError):
-    """The URL is malformed or protocol is not supported."""
-    pass
-
-
-class NotInBaseDomainError(UrlNotValidError):
-    """The URL provided isn't from the same base domain."""
-    pass
+from urllib.parse import urlparse
+from db.model import Pending, Base, Resource, Link, Document
+from db.utils import setupdb, SessionRecycler
+from engine.canonical import Canonicalizer
+from engine.history import YieldHistory
+from engine.hosts import HostTracker, DEPRIORITIZED, UNRANKED_DEPRIORITIZED, DEPRIORITIZED_STATE, ACTIVE, \
+    STOPPED, deprioritize, restore_priority, is_deprioritized
+from engine.writer import DatabaseWriter
+from sqlalchemy import or_, func, case, Float
+from threading import Lock, RLock, Condition, Event
+from itertools import count
+import heapq
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+# TODO: queue stats
+
+
+class Queue:
+    """Manages the pending queue as an iterator.
+
+    Retrieves the pending items from the database and manages the queue
+    inserting and discarding them as requested by the dispatchers.
+
+    Note:
+        This class manages all database operations, including the initial setup.
+        All writes go through a single `DatabaseWriter` thread, that commits them
+        in groups (SQLite doesn't support concurrent writers). Reads use the
+        `scoped session` paradigm of the SQLAlchemy engine, so each thread has
+        its own session, and the database is in WAL mode so they don't wait for
+        the writer.
+
+        The in-memory state has its own locks, so dispatchers don't serialize on
+        the database: `lock` for the frontier (a heap of queued items by depth,
+        the items in flight and the prefetched records), `seen_lock` for the known URLs and
+        hosts and `outcome_lock` for the outcomes waiting to be written. When more
+        than one is taken, it's in that order.
+
+    """
+    # Number of items loaded from database at once
+    prefetch = 100
+    # Number of item outcomes written back to database at once
+    outcome_batch = 100
+
+    def __init__(self, reset=False, all_domains=False, retries=3, resolver=None, canonicalizer=None,
+                 tracker=None, depth_weights=None):
+        """Class initialization.
+
+        Args:
+            reset: T/F wipe database before start.
+            all_domains: T = retrieve resources from any domain. F = only from origin domain.
+            retries: Number of times to retry before discarding a resource as unreachable.
+            resolver: `Resolver` instance to prefetch DNS of new hosts (optional).
+            canonicalizer: `Canonicalizer` instance to normalize URLs (default rules if not provided).
+            tracker: `HostTracker` instance with the crawl budgets of hosts (default without budgets).
+            depth_weights: List of weights of the depths in the order of the queue (the last
+                one for the deeper ones, see `_next_depth`). By default items go by priority only.
+        """
+        self.all_domains = all_domains
+        self.retries = retries
+        self.resolver = resolver
+        self.canonicalizer = canonicalizer or Canonicalizer()
+        # Hosts seen by the queue (to prefetch their DNS only once)
+        self.hosts = set()
+        self.lock = RLock()
+        self.seen_lock = Lock()
+        self.outcome_lock = Lock()
+        # Signaled when new items are inserted, to wake up idle dispatchers
+        self.available = Condition(self.lock)
+        self.session = setupdb('db', Base, reset, wal=True)
+        self.recycler = SessionRecycler(self.session)
+        self.writer = DatabaseWriter(self.session, self.recycler)
+
+        # Budgets apply to each run: items of hosts deprioritized by a previous run get their priorities back
+        self.session().query(Pending).filter(Pending.priority <= DEPRIORITIZED // 2) \
+            .update({Pending.priority: case([(Pending.priority == UNRANKED_DEPRIORITIZED, None)],
+                                            else_=Pending.priority - DEPRIORITIZED)}, synchronize_session=False)
+        self.session().commit()
+
+        # Get current queue from database.
+        # The session is scoped, for multithreading,
+        # so we have to instantiate it before each use
+        #
+        # Order by the "priority" or "id" columns.
+        # Using fake order clause because SQLite doesn't support NULLS LAST
+        q = self.session().query(Pending.id, Pending.priority, Pending.depth) \
+            .order_by(Pending.priority == None, Pending.priority.desc(), Pending.id)
+        # Frontier: heaps of entries (see `_entry`) by depth and current entry of each queued item, by ID.
+        # Replaced entries stay in the heaps until they're popped or the heaps are compacted
+        self.sequence = count()
+        self.entries = {i: self._entry(i, p, d) for i, p, d in q}
+        self.depth_weights = depth_weights
+        # Credits of the depths in the weighted round robin
+        self.credits = {}
+        self._rebuild()
+        # IDs of the items given to dispatchers and not yet discarded or retried
+        self.in_flight = set()
+        # Records of the items at the head of the queue, by ID
+        self.records = {}
+        # Outcomes of processed items to be written back to their resources, by resource ID
+        self.outcomes = {}
+        # When draining, no more items are given and the queue finishes with the in-flight ones
+        self.draining = False
+        # Set when there's no work left: queue empty and nothing in flight
+        self.quiescent = Event()
+        self._check_quiescent()
+        # Cache URL resources
+        self.urlcache = {url for url, in self.session().query(Resource.url)}
+        # Yield history of previous runs, to score links
+        self.history = YieldHistory()
+        q = self.session().query(Resource.url, Document.accepted) \
+            .outerjoin(Document, Resource.document_id == Document.id).filter(Resource.fetched != None)
+        for url, accepted in q:
+            self.history.record_fetch(url)
+            if accepted:
+                self.history.record_accepted(url)
+        # Per host accounting of this run (budgets apply to each run)
+        self.tracker = tracker or HostTracker()
+
+    def __len__(self):
+        """Magic method for len()
+        Returns:
+            Length of the queue
+        """
+        return len(self.entries)
+
+    def __iter__(self):
+        """Magic method for iter()
+        Returns:
+            Iterable instance of the queue (self)
+        """
+        return self
+
+    def __next__(self):
+        """Magic method for next()
+        Returns:
+            Next item in the queue (`FrontierItem` instance).
+        """
+        while True:
+            with self.lock:
+                if not self.entries or self.draining:
+                    self._check_quiescent()
+                    raise StopIteration
+                # Pop element from top of the heap
+                # (on database isn't removed until call to discard or discard_or_retry)
+                i, p, d = self._pop()
+                item = self.records.pop(i, None)
+                self.in_flight.add(i)
+                if item is None:
+                    # Load the records of the next items at once (the tops of the heaps are roughly the next ones)
+                    ids = [i] + self._upcoming(d)
+            try:
+                if item is None:
+                    item = self._load(i, ids)
+            except BaseException:
+                # Leave it for another try
+                with self.lock:
+                    self.in_flight.discard(i)
+                    self.insert((i, p, d))
+                raise
+            # Skip items deleted meanwhile and items of hosts out of budget (except the initial URLs),
+            # which remain pending for the next run
+            if item is None or item.depth > 0 and self.tracker.state(urlparse(item.url).netloc) == STOPPED:
+                with self.lock:
+                    self.in_flight.discard(i)
+                continue
+            item.priority = p
+            return item
+
+    def _entry(self, i, p, depth, sequence=None):
+        """Build a heap entry of the frontier.
+
+        Entries sort by priority, without priority at the end, and by order of
+        insertion within the same priority.
+
+        Args:
+            i: Pending item ID.
+            p: Priority.
+            depth: Depth of the item (its heap).
+            sequence: Order of insertion (a new one if not provided).
+
+        Returns:
+            Tuple of sort keys, sequence, item ID, priority and depth.
+        """
+        if sequence is None:
+            sequence = next(self.sequence)
+        return p is None, -p if p is not None else 0, sequence, i, p, depth
+
+    def _rebuild(self):
+        """Build the heaps of the frontier from the current entries (the lock must be held)."""
+        self.heaps = {}
+        for entry in self.entries.values():
+            self.heaps.setdefault(entry[5], []).append(entry)
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+
+    def _pop(self):
+        """Remove the top item of the frontier (the lock must be held and the frontier not empty).
+
+        Returns:
+            Tuple of pending item ID, priority and depth.
+        """
+        entry = heapq.heappop(self.heaps[self._next_depth()])
+        del self.entries[entry[3]]
+        return entry[3], entry[4], entry[5]
+
+    def _next_depth(self):
+        """Choose the depth of the next item (the lock must be held and the frontier not empty).
+
+        By default it's the depth of the item with the best priority. With depth
+        weights, the depths with items take turns (smooth weighted round robin):
+        a depth with weight 4 gives twice as many items as one with weight 2, and
+        a depth with weight 0 only gives items when the other depths have none.
+
+        Returns:
+            The depth, whose heap has a current entry at the top.
+        """
+        # Drop replaced entries from the tops, and the heaps left empty
+        for depth in list(self.heaps):
+            heap = self.heaps[depth]
+            while heap and self.entries.get(heap[0][3]) is not heap[0]:
+                heapq.heappop(heap)
+            if not heap:
+                del self.heaps[depth]
+        if not self.depth_weights:
+            return min(self.heaps, key=lambda d: self.heaps[d][0])
+        self.credits = {d: self.credits.get(d, 0) for d in self.heaps}
+        total = 0
+        for depth in self.heaps:
+            weight = self.depth_weights[min(depth, len(self.depth_weights) - 1)]
+            self.credits[depth] += weight
+            total += weight
+        depth = max(self.heaps, key=lambda d: (self.credits[d], -d))
+        self.credits[depth] -= total
+        return depth
+
+    def _upcoming(self, depth):
+        """IDs of the queued items likely to be given next, without records loaded (the lock must be held).
+
+        Args:
+            depth: Depth of the item just given (its heap goes first).
+
+        Returns:
+            List of up to `prefetch - 1` pending item IDs.
+        """
+        ids = []
+        heaps = sorted(self.heaps.items(), key=lambda h: h[0] != depth)
+        for _, heap in heaps:
+            for e in heap[:2 * self.prefetch]:
+                if len(ids) >= self.prefetch - 1:
+                    return ids
+                if self.entries.get(e[3]) is e and e[3] not in self.records:
+                    ids.append(e[3])
+        return ids
+
+    def depths(self):
+        """Number of queued items by depth.
+
+        Returns:
+            Dictionary of depth to number of items.
+        """
+        with self.lock:
+            sizes = {}
+            for entry in self.entries.values():
+                sizes[entry[5]] = sizes.get(entry[5], 0) + 1
+            return sizes
+
+    def _load(self, i, ids):
+        """Load the records of pending items.
+
+        Args:
+            i: ID of the item requested.
+            ids: List of pending item IDs (including `i`), the others are kept for later.
+
+        Returns:
+            The record of the item requested (`None` if it's no longer pending).
+        """
+        rows = self.session().query(Pending.id, Pending.resource_id, Resource.url, Resource.title,
+                                    Pending.depth, Pending.priority, Pending.retries) \
+            .join(Resource, Pending.resource_id == Resource.id).filter(Pending.id.in_(ids)).all()
+        item = None
+        with self.lock:
+            for row in rows:
+                if row[0] == i:
+                    item = FrontierItem(*row)
+                # Items given meanwhile to other dispatchers were loaded by them
+                elif row[0] in self.entries and row[0] not in self.records:
+                    self.records[row[0]] = FrontierItem(*row)
+        return item
+
+    def insert(self, item):
+        """Inserts an item in the queue.
+        Args:
+            item: Tuple of pending item ID, priority and depth.
+        """
+        self.insert_all([item])
+
+    def insert_all(self, items):
+        """Inserts items in the queue, or moves them if already queued.
+        Args:
+            items: List of tuples of pending item ID, priority and depth.
+        """
+        # Protect queue reshape from concurrency
+        with self.lock:
+            for i, p, d in items:
+                # Items being processed will be discarded or retried by their dispatcher
+                if i in self.in_flight:
+                    continue
+                entry = self._entry(i, p, d)
+                self.entries[i] = entry
+                heapq.heappush(self.heaps.setdefault(d, []), entry)
+                self.quiescent.clear()
+                self.available.notify()
+            # Compact when most of the heaps are replaced entries
+            if sum(len(heap) for heap in self.heaps.values()) > 2 * len(self.entries) + self.prefetch:
+                self._rebuild()
+
+    def wait(self, timeout=None):
+        """Blocks until there're items in the queue or there's no work left.
+
+        Args:
+            timeout: Maximum time to wait in seconds (`None` waits forever).
+
+        Returns:
+            T/F there're items available.
+        """
+        with self.available:
+            self.available.wait_for(lambda: self.quiescent.is_set() or (self.entries and not self.draining),
+                                    timeout)
+            return bool(self.entries) and not self.draining
+
+    def finished(self):
+        """Checks if the crawl is over (the queue is empty and there're no items in flight)."""
+        return self.quiescent.is_set()
+
+    def drain(self):
+        """Stop giving new items and finish when the ones in flight are done.
+
+        Note:
+            Items left in the queue remain pending on database for the next run.
+        """
+        with self.lock:
+            self.draining = True
+            self._check_quiescent()
+
+    def abandon(self, item):
+        """Forget an in-flight item without changes on database (it remains pending).
+
+        Args:
+            item: The item.
+        """
+        with self.lock:
+            self.in_flight.discard(item.id)
+            self._check_quiescent()
+
+    def _check_quiescent(self):
+        """Set the quiescent state and wake up waiting dispatchers if there's no work left."""
+        with self.lock:
+            if (not self.entries or self.draining) and not self.in_flight:
+                self.flush()
+                self.quiescent.set()
+                self.available.notify_all()
+
+    def _record_outcome(self, item):
+        """Queue the outcome of a processed item to be written back to its resource.
+
+        Args:
+            item: The item.
+        """
+        with self.outcome_lock:
+            if item.code is not None:
+                outcome = self.outcomes.setdefault(item.resource_id, {'id': item.resource_id})
+                outcome['last_code'] = item.code
+                outcome['fetched'] = item.fetched
+            full = len(self.outcomes) >= self.outcome_batch
+        if full:
+            self.flush()
+
+    def flush(self, wait=False):
+        """Write back the pending outcomes of processed items in one commit.
+
+        Args:
+            wait: T/F wait until all the writes submitted so far are committed.
+        """
+        with self.outcome_lock:
+            outcomes, self.outcomes = self.outcomes, {}
+            if outcomes:
+                self.writer.submit(_update_resources, list(outcomes.values()))
+        if wait:
+            self.writer.flush()
+
+    def close(self):
+        """Write everything pending and stop the database writer."""
+        self.flush()
+        self.writer.close()
+
+    def checkpoint(self):
+        """Unit of work boundary of the calling thread: its session is recycled periodically.
+
+        Returns:
+            T/F the session was recycled (see `SessionRecycler`).
+        """
+        return self.recycler.checkpoint()
+
+    def add(self, resource, referrer=None, priority=None, canonical=False):
+        """
+        Add resource to queue and database (if not exists)
+
+        Args:
+            resource: The resource to be added
+            referrer: The referrer item (`FrontierItem`)
+            priority: Integer to set order in the queue
+            canonical: T/F the URL of the resource is already canonical and absolute
+
+        Returns:
+            Tuple:
+                Pending item (`FrontierItem`).
+                The item is new in queue (boolean).
+
+        Raises:
+            UrlNotValidError: URL not HTTP or HTTPS, host component empty, not in the base domain
+                or its host is out of budget.
+        """
+        # Normalize and complete URL
+        if canonical:
+            norm = resource.url
+        else:
+            norm = self.canonicalizer.canonicalize(resource.url, referrer.url if referrer else None)
+        priority = self._check(norm, referrer, priority)
+        i, resource_id, depth, priority, status = self._add_links(referrer, [(norm, resource.title, priority)])[0]
+        return FrontierItem(i, resource_id, norm, resource.title, depth, priority), status == NEW
+
+    def _check(self, url, referrer, priority):
+        """Validate a canonical URL to be added.
+
+        Args:
+            url: The URL.
+            referrer: The referrer item (`FrontierItem`) or `None`.
+            priority: Priority requested.
+
+        Returns:
+            Priority to give to the item.
+
+        Raises:
+            UrlNotValidError: URL not HTTP or HTTPS, host component empty, not in the base domain
+                or its host is out of budget.
+        """
+        # Only valid protocols
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            raise MalformedUrlError(
+                'URL "%s" not valid. Use HTTP or HTTPS with at least the host component.' % url)
+        # By default limit to the same base domain
+        if not self.all_domains and referrer and parsed.netloc != urlparse(referrer.url).netloc:
+            raise NotInBaseDomainError('URL "%s" not in the base domain.' % url)
+        # Links to hosts out of budget are rejected and the ones of unproductive hosts go last
+        state = self.tracker.state(parsed.netloc)
+        if referrer and state == STOPPED:
+            raise HostStoppedError('URL "%s" from a host out of budget.' % url)
+        if state == DEPRIORITIZED_STATE:
+            priority = deprioritize(priority)
+        return priority
+
+    def _add_links(self, referrer, links, lastmods=None):
+        """Add valid canonical URLs to database and queue, and the links from their referrer.
+
+        Args:
+            referrer: The referrer item (`FrontierItem`) or `None`.
+            links: List of tuples of URL, title and priority.
+            lastmods: Dictionary of URL to last modification of the sitemap entries
+                (then no links are created, see `add_sitemap`).
+
+        Returns:
+            List of tuples of pending item ID, resource ID, depth, priority and status (`NEW`,
+            `RAISED` or `None` if the item was already in queue), by URL in order of appearance.
+        """
+        with self.seen_lock:
+            new_urls = {url for url, _, _ in links} - self.urlcache
+            self.urlcache |= new_urls
+            # Submitted while holding the lock: links to these URLs from other pages go after
+            # Entries of sitemaps aren't links of the referrer
+            referrer_id = referrer.resource_id if referrer and lastmods is None else None
+            future = self.writer.submit(_write_links, referrer_id, referrer.depth + 1 if referrer else 0,
+                                        links, new_urls, lastmods)
+            new_hosts = {urlparse(url) for url in new_urls}
+            new_hosts = {parsed.netloc: parsed for parsed in new_hosts if parsed.netloc not in self.hosts}
+            self.hosts.update(new_hosts)
+        # Resolve new hosts in background before a dispatcher gets the URL
+        if self.resolver:
+            for parsed in new_hosts.values():
+                self.resolver.prefetch(parsed.hostname, parsed.port or (443 if parsed.scheme == 'https' else 80))
+        rows = future.result()
+        self.insert_all([(i, priority, depth) for i, _, depth, priority, status in rows if status])
+        return rows
+
+    def add_list(self, ref, title, links):
+        """Adds resources to the queue from a list of links.
+        Args:
+            ref: Referrer item (`FrontierItem`).
+            title: Referrer title.
+            links: List of links (tuples):
+                URL
+                Title
+                Priority
+        Returns:
+            Number of items added and rejected (tuple).
+        """
+        rejected = 0
+        if title:
+            ref.title = title
+            with self.outcome_lock:
+                self.outcomes.setdefault(ref.resource_id, {'id': ref.resource_id})['title'] = title
+        # Normalize the whole page at once
+        urls = self.canonicalizer.canonicalize_all([u for u, _, _ in links], ref.url)
+        valid = []
+        for u, (_, t, p) in zip(urls, links):
+            try:
+                valid.append((u, t, self._check(u, ref, p)))
+            except UrlNotValidError:
+                rejected += 1
+        # All the links of the page in one write
+        rows = self._add_links(ref, valid) if valid else []
+        return sum(1 for row in rows if row[4] == NEW), rejected
+
+    def add_sitemap(self, ref, entries):
+        """Adds resources to the queue from the entries of a sitemap.
+
+        Resources fetched after their last modification aren't fetched again
+        (entries without last modification are only fetched once).
+
+        Args:
+            ref: Item (`FrontierItem`) of the host whose sitemap lists the entries.
+            entries: List of tuples of URL, priority and last modification (naive
+                `datetime` in UTC or `None`).
+
+        Returns:
+            Number of items added and rejected (tuple).
+        """
+        rejected = 0
+        urls = self.canonicalizer.canonicalize_all([u for u, _, _ in entries], ref.url)
+        valid = []
+        lastmods = {}
+        for u, (_, p, lastmod) in zip(urls, entries):
+            try:
+                valid.append((u, None, self._check(u, ref, p)))
+                lastmods[u] = lastmod
+            except UrlNotValidError:
+                rejected += 1
+        rows = self._add_links(ref, valid, lastmods) if valid else []
+        return sum(1 for row in rows if row[4] == NEW), rejected
+
+    def discard_or_retry(self, item):
+        """If a failed item has reached its maximum retries, discard it. It not, increase
+        retry count, decrease to half priority and re-insert it in the queue.
+
+        Args:
+            item: The item
+        Returns:
+            T/F the item was deleted.
+        """
+        self._record_outcome(item)
+        if item.retries + 1 >= self.retries:
+            self.writer.submit(_delete_pending, item.id)
+            with self.lock:
+                self.in_flight.discard(item.id)
+                self._check_quiescent()
+            return True
+        else:
+            # Increase retries and reduce half priority (within the band of deprioritized hosts)
+            band = is_deprioritized(item.priority)
+            priority = restore_priority(item.priority) if band else item.priority
+            if priority is not None:
+                if priority > 0:
+                    priority //= 2
+                else:
+                    # Ranked items (non positive priority) double their distance to zero, without
+                    # reaching the band of deprioritized hosts
+                    priority = max(priority * 2 - 1, DEPRIORITIZED // 2 + 1)
+            item.priority = deprioritize(priority) if band else priority
+            item.retries += 1
+            self.writer.submit(_update_pending, [{'id': item.id, 'priority': item.priority,
+                                                  'retries': item.retries}])
+            # Insert in new place (the record is kept for the retry)
+            item.code = item.fetched = None
+            with self.lock:
+                self.in_flight.discard(item.id)
+                self.records[item.id] = item
+                self.insert((item.id, item.priority, item.depth))
+            return False
+
+    def account(self, item, mimetype, size):
+        """Account a fetched item in the stats of its host.
+
+        Args:
+            item: The item.
+            mimetype: MIME type of the content.
+            size: Size of the content in bytes.
+
+        Returns:
+            New state of the host if it changed, otherwise `None`.
+        """
+        host = urlparse(item.url).netloc
+        state = self.tracker.record_fetch(host, size, mimetype == 'application/pdf')
+        if state:
+            self.host_state_changed(host, state)
+        return state
+
+    def host_state_changed(self, host, state):
+        """Update the pending items of a host after a change of its state.
+
+        Deprioritized hosts get the priorities of their items moved to a lower band
+        (see `deprioritize`), after the items of the other hosts but keeping their
+        order. Reactivated hosts get them back. Items of stopped hosts are skipped
+        when they reach the head of the queue (they remain pending for the next run).
+
+        Args:
+            host: Host name (and port, if any).
+            state: New state of the host.
+
+        Returns:
+            Number of items changed.
+        """
+        if state not in (DEPRIORITIZED_STATE, ACTIVE):
+            return 0
+        q = self.session().query(Pending.id, Pending.priority, Resource.url).join(Resource) \
+            .filter(Resource.url.like('%://' + host + '/%'))
+        if state == DEPRIORITIZED_STATE:
+            return self.reprioritize({i: deprioritize(priority) for i, priority, url in q
+                                      if urlparse(url).netloc == host and not is_deprioritized(priority)})
+        return self.reprioritize({i: restore_priority(priority) for i, priority, url in q
+                                  if urlparse(url).netloc == host and is_deprioritized(priority)})
+
+    def discard(self, item):
+        """Remove resource from pending items in database (if exists).
+        Args:
+            item: The item to be removed.
+        """
+        if item.fetched is not None:
+            self.history.record_fetch(item.url)
+        self._record_outcome(item)
+        self.writer.submit(_delete_pending, item.id)
+        with self.lock:
+            self.in_flight.discard(item.id)
+            self._check_quiescent()
+
+    def referrer_relevancy(self, resource_id):
+        """Maximum relevancy of the documents linked from a page or from its referrers.
+
+        Args:
+            resource_id: ID of the page resource.
+
+        Returns:
+            The relevancy (0 if no documents were found).
+        """
+        parents = self.session().query(Link.referrer_id).filter(Link.target_id == resource_id)
+        relevancy = self.session().query(func.max(Document.relevancy, type_=Float)) \
+            .join(Resource, Resource.document_id == Document.id) \
+            .join(Link, Link.target_id == Resource.id) \
+            .filter(or_(Link.referrer_id == resource_id, Link.referrer_id.in_(parents))) \
+            .scalar()
+        return float(relevancy or 0)
+
+    def link_graph(self):
+        """Stream the link graph from database.
+
+        Returns:
+            Iterable of tuples of referrer and target resource IDs.
+        """
+        return self.session().query(Link.referrer_id, Link.target_id).yield_per(10000)
+
+    def pending_priorities(self):
+        """Obtain the pending items from database.
+
+        Returns:
+            List of tuples of pending item ID, resource ID and priority.
+        """
+        return self.session().query(Pending.id, Pending.resource_id, Pending.priority).all()
+
+    def reprioritize(self, priorities):
+        """Change the priority of many pending items at once.
+
+        Args:
+            priorities: Dictionary of pending item ID to new priority.
+
+        Returns:
+            Number of items changed.
+        """
+        with self.lock:
+            # Items in flight will be discarded or retried by their dispatchers
+            changes = {i: p for i, p in priorities.items() if i in self.entries}
+            if changes:
+                self.writer.submit(_update_pending, [{'id': i, 'priority': p} for i, p in changes.items()])
+                # Same order as `insert` (items keep their order of insertion within the same priority)
+                self.entries = {i: self._entry(i, changes[i], e[5], e[2]) if i in changes else e
+                                for i, e in self.entries.items()}
+                self._rebuild()
+        return len(changes)
+
+    def clear(self):
+        """Empty the queue and delete all records"""
+        with self.lock:
+            n = len(self.entries)
+            self.entries = {}
+            self.heaps = {}
+            self.records = {}
+        # Empty Pending table
+        self.writer.call(_delete_pending, None)
+        self._check_quiescent()
+        return n
+
+    def add_documents(self, records):
+        """Creates `Document` instances on database and links them to their resources in one commit.
+        Args:
+            records: List of dictionaries of `Document` fields, plus the `resource_id` of
+                the URL resource where each document was retrieved from.
+        """
+        reactivated = set()
+        for url in self.writer.call(_write_documents, records):
+            self.history.record_accepted(url)
+            host = urlparse(url).netloc
+            if self.tracker.record_accepted(host) == ACTIVE:
+                reactivated.add(host)
+        for host in reactivated:
+            self.host_state_changed(host, ACTIVE)
+
+
+# Status of the items of `Queue._add_links`
+NEW = 'NEW'
+RAISED = 'RAISED'
+
+
+# Database writes of the queue (run by the `DatabaseWriter`)
+
+def _write_links(session, referrer_id, depth, links, new_urls, lastmods=None):
+    """Create the resources and pending items of the URLs linked from a page, and the links.
+
+    Args:
+        session: The session of the writer.
+        referrer_id: ID of the resource of the page (`None` for no links).
+        depth: Depth of the new pending items.
+        links: List of tuples of canonical URL, title and priority.
+        new_urls: URLs not seen before (they aren't looked up).
+        lastmods: Dictionary of URL to last modification (optional). Resources
+            fetched after it, or fetched at all if it's `None`, aren't added.
+
+    Returns:
+        See `Queue._add_links`.
+    """
+    resources = {}
+    pendings = {}
+    known = list({url for url, _, _ in links} - new_urls)
+    for chunk in range(0, len(known), 500):
+        q = session.query(Resource, Pending).outerjoin(Pending, Pending.resource_id == Resource.id) \
+            .filter(Resource.url.in_(known[chunk:chunk + 500]))
+        for resource, pending in q:
+            resources[resource.url] = resource
+            if pending is not None:
+                pendings[resource.url] = pending
+    status = {}
+    for url, title, priority in links:
+        if url not in resources:
+            resources[url] = Resource(url=url, title=title)
+            session.add(resources[url])
+        old = pendings.get(url)
+        if old is None and lastmods is not None and resources[url].fetched is not None and \
+                (lastmods.get(url) is None or lastmods[url] <= resources[url].fetched):
+            # Not modified since fetched
+            continue
+        if old is None:
+            # Add pending item with priority and increase depth
+            pendings[url] = Pending(resource=resources[url], priority=priority, depth=depth)
+            session.add(pendings[url])
+            status[url] = NEW
+        elif priority is not None and (old.priority is None or priority > old.priority):
+            # Override priority if bigger
+            old.priority = priority
+            status.setdefault(url, RAISED)
+    session.flush()
+    if referrer_id is not None:
+        for url, title, _ in links:
+            session.add(Link(text=title, referrer_id=referrer_id, target_id=resources[url].id))
+    rows = []
+    for url, _, _ in links:
+        if url in pendings:
+            p = pendings.pop(url)
+            rows.append((p.id, p.resource_id, p.depth, p.priority, status.get(url)))
+    return rows
+
+
+def _write_documents(session, records):
+    """Create documents and link them to their resources.
+
+    Args:
+        session: The session of the writer.
+        records: See `Queue.add_documents`.
+
+    Returns:
+        List of URLs of the accepted documents.
+    """
+    accepted = []
+    for fields in records:
+        fields = dict(fields)
+        resource = session.query(Resource).get(fields.pop('resource_id'))
+        doc = Document(**fields)
+        session.add(doc)
+        resource.document = doc
+        if doc.accepted:
+            accepted.append(resource.url)
+    return accepted
+
+
+def _update_resources(session, mappings):
+    """Bulk update of resources.
+
+    Args:
+        session: The session of the writer.
+        mappings: List of dictionaries of fields (including `id`).
+    """
+    session.bulk_update_mappings(Resource, mappings)
+
+
+def _update_pending(session, mappings):
+    """Bulk update of pending items.
+
+    Args:
+        session: The session of the writer.
+        mappings: List of dictionaries of fields (including `id`).
+    """
+    session.bulk_update_mappings(Pending, mappings)
+
+
+def _delete_pending(session, i):
+    """Delete a pending item.
+
+    Args:
+        session: The session of the writer.
+        i: ID of the pending item (`None` to delete all).
+    """
+    q = session.query(Pending)
+    if i is not None:
+        q = q.filter_by(id=i)
+    q.delete()
+
+
+class FrontierItem:
+    """Item of the queue given to the dispatchers, detached from the database session.
+
+    It carries what the pipeline needs from the `Pending` item and its `Resource`,
+    and the outcome of its processing, written back to database in batches.
+    """
+    __slots__ = ('id', 'resource_id', 'url', 'title', 'depth', 'priority', 'retries', 'code', 'fetched')
+
+    def __init__(self, id, resource_id, url, title=None, depth=0, priority=None, retries=0):
+        """Initialize the item.
+
+        Args:
+            id: ID of the pending item.
+            resource_id: ID of the resource.
+            url: URL of the resource.
+            title: Title of the resource (link text or page title).
+            depth: Number of links from the initial URL.
+            priority: Priority in the queue.
+            retries: Number of failed attempts.
+        """
+        self.id = id
+        self.resource_id = resource_id
+        self.url = url
+        self.title = title
+        self.depth = depth
+        self.priority = priority
+        self.retries = retries
+        # Outcome: HTTP status code and fetch time
+        self.code = None
+        self.fetched = None
+
+
+class UrlNotValidError(ValueError):
+    """Base exception raised when the URL provided is invalid for program's purpose"""
+    pass
+
+
+class MalformedUrlError(UrlNotValidError):
+    """The URL is malformed or protocol is not supported."""
+    pass
+
+
+class NotInBaseDomainError(UrlNotValidError):
+    """The URL provided isn't from the same base domain."""
+    pass
+
+
+class HostStoppedError(UrlNotValidError):
+    """The host of the URL provided has exhausted its crawl budget."""
+    pass
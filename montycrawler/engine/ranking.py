@@ -0,0 +1,210 @@
+from threading import Thread
+from engine.hosts import deprioritize, restore_priority, is_deprioritized
+from array import array
+import time
+
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# numpy (optional) is imported on the first ranking, as it's slow to import
+_numpy = None
+
+
+def load_numpy():
+    """Import numpy, if installed.
+
+    Returns:
+        The module, or `None` if it isn't installed.
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+class LinkRanker(Thread):
+    """Background job that prioritizes the pending queue by link graph importance.
+
+    Periodically loads the link graph from database into a compressed sparse row
+    (CSR) adjacency, computes the PageRank of every resource and re-prioritizes the
+    pending items in bulk.
+
+    Note:
+        Ranked items get priorities between `-scale` (least important) and 0 (most
+        important), so they go after the items with explicit (positive) priority
+        given by the parser, but before the items without priority. Items with
+        explicit priority are left untouched. Items of deprioritized hosts are
+        ranked the same way within their band (see `deprioritize`).
+
+    """
+    def __init__(self, queue, logger=None, interval=60, scale=100, damping=0.85, iterations=30):
+        """Initialize the ranker.
+
+        Args:
+            queue: The `Queue` object.
+            logger: Logger instance (optional).
+            interval: Seconds between rankings.
+            scale: Number of priority levels for ranked items.
+            damping: PageRank damping factor.
+            iterations: Maximum number of power iterations.
+        """
+        Thread.__init__(self, name='ranker', daemon=True)
+        self.queue = queue
+        self.logger = logger
+        self.interval = interval
+        self.scale = scale
+        self.damping = damping
+        self.iterations = iterations
+
+    def run(self):
+        """Rank every `interval` seconds until the crawl is finished."""
+        while not self.queue.quiescent.wait(self.interval):
+            try:
+                self.rank()
+            except Exception as ex:
+                if self.logger:
+                    self.logger.error('Error ranking links: %s' % ex)
+            finally:
+                self.queue.checkpoint()
+
+    def rank(self):
+        """Compute the ranking and re-prioritize the pending items.
+
+        Returns:
+            Number of items re-prioritized.
+        """
+        start = time.time()
+        ids, indptr, indices = load_graph(self.queue.link_graph())
+        if not ids:
+            return 0
+        scores = pagerank(indptr, indices, self.damping, self.iterations)
+        position = {resource_id: i for i, resource_id in enumerate(ids)}
+        # Only items without explicit priority are ranked (those of deprioritized hosts in their band)
+        ranked = []
+        for pending_id, resource_id, priority in self.queue.pending_priorities():
+            band = is_deprioritized(priority)
+            if band:
+                priority = restore_priority(priority)
+            if (priority is None or priority <= 0) and resource_id in position:
+                ranked.append((pending_id, scores[position[resource_id]], band))
+        if not ranked:
+            return 0
+        top = max(score for _, score, _ in ranked) or 1
+        priorities = {}
+        for pending_id, score, band in ranked:
+            priority = int(round(self.scale * score / top)) - self.scale
+            priorities[pending_id] = deprioritize(priority) if band else priority
+        n = self.queue.reprioritize(priorities)
+        if self.logger:
+            self.logger.debug('Ranked %d resources (%d links), %d pending items reprioritized in %.2f seconds' %
+                              (len(ids), len(indices), n, time.time() - start))
+        return n
+
+
+def load_graph(edges):
+    """Build a CSR adjacency of incoming links from a stream of links.
+
+    Args:
+        edges: Iterable of tuples of referrer and target resource IDs.
+
+    Returns:
+        Tuple:
+            List of resource IDs (sorted, the position is the node index).
+            Row pointers: links to node `i` are in `indices[indptr[i]:indptr[i + 1]]`.
+            Column indices: node index of the referrer of each link.
+    """
+    np = load_numpy()
+    sources = array('l')
+    targets = array('l')
+    for referrer_id, target_id in edges:
+        if referrer_id is not None and target_id is not None:
+            sources.append(referrer_id)
+            targets.append(target_id)
+    if np is not None:
+        dtype = 'i%d' % sources.itemsize
+        sources = np.frombuffer(sources, dtype=dtype)
+        targets = np.frombuffer(targets, dtype=dtype)
+        ids = np.unique(np.concatenate((sources, targets)))
+        src = np.searchsorted(ids, sources)
+        dst = np.searchsorted(ids, targets)
+        order = np.argsort(dst, kind='stable')
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dst, minlength=len(ids)), out=indptr[1:])
+        return ids.tolist(), indptr, src[order]
+    ids = sorted(set(sources) | set(targets))
+    position = {resource_id: i for i, resource_id in enumerate(ids)}
+    incoming = [[] for _ in ids]
+    for s, t in zip(sources, targets):
+        incoming[position[t]].append(position[s])
+    indptr = array('l', [0])
+    indices = array('l')
+    for row in incoming:
+        indices.extend(row)
+        indptr.append(len(indices))
+    return ids, indptr, indices
+
+
+def pagerank(indptr, indices, damping=0.85, iterations=30, tolerance=1e-6):
+    """Compute PageRank over a CSR adjacency of incoming links.
+
+    Args:
+        indptr: Row pointers (see `load_graph`).
+        indices: Column indices (see `load_graph`).
+        damping: Damping factor.
+        iterations: Maximum number of power iterations.
+        tolerance: Stop when the L1 change is lower than this.
+
+    Returns:
+        List of scores by node index (they sum 1).
+    """
+    n = len(indptr) - 1
+    np = load_numpy()
+    if np is not None:
+        indptr = np.asarray(indptr)
+        indices = np.asarray(indices)
+        out_degree = np.bincount(indices, minlength=n).astype(float)
+        dangling = out_degree == 0
+        rows = np.repeat(np.arange(n), np.diff(indptr))
+        rank = np.full(n, 1.0 / n)
+        for _ in range(iterations):
+            share = np.divide(rank, out_degree, out=np.zeros(n), where=~dangling)
+            new = np.bincount(rows, weights=share[indices], minlength=n)
+            new = damping * (new + rank[dangling].sum() / n) + (1 - damping) / n
+            delta = np.abs(new - rank).sum()
+            rank = new
+            if delta < tolerance:
+                break
+        return rank.tolist()
+    out_degree = [0] * n
+    for j in indices:
+        out_degree[j] += 1
+    rank = [1.0 / n] * n
+    for _ in range(iterations):
+        share = [r / d if d else 0 for r, d in zip(rank, out_degree)]
+        base = damping * sum(r for r, d in zip(rank, out_degree) if not d) / n + (1 - damping) / n
+        new = [base + damping * sum(share[j] for j in indices[indptr[i]:indptr[i + 1]]) for i in range(n)]
+        delta = sum(abs(a - b) for a, b in zip(new, rank))
+        rank = new
+        if delta < tolerance:
+            break
+    return rank
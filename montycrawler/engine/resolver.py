@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Lock
+import socket
+import time
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Resolver:
+    """Shared DNS cache with TTL, negative caching and asynchronous prefetching.
+
+    Once installed it replaces `socket.getaddrinfo`, so every connection opened
+    by `urllib` (downloads and robots.txt requests) is resolved through the cache.
+
+    Note:
+        The system resolver doesn't expose record TTLs, so a fixed TTL is used
+        for all the entries. Failed lookups are cached for `negative_ttl` seconds.
+
+    """
+    def __init__(self, ttl=300, negative_ttl=60, workers=4, resolve=None):
+        """Initialize the resolver.
+
+        Args:
+            ttl: Seconds to keep successful lookups.
+            negative_ttl: Seconds to keep failed lookups.
+            workers: Number of threads for prefetching.
+            resolve: Function with the signature of `socket.getaddrinfo` used to
+                do the actual lookups (defaults to the system resolver).
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.resolve = resolve or socket.getaddrinfo
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(workers)
+        # Cache entries are tuples of expiration time and result (or raised exception)
+        self.cache = {}
+        # Lookups in progress by key (futures)
+        self.lookups = {}
+        self.hits = 0
+        self.misses = 0
+        self.original = None
+
+    def install(self):
+        """Route all the `socket.getaddrinfo` calls of the process through the cache."""
+        if self.original is None:
+            self.original = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        """Restore the original `socket.getaddrinfo` and stop prefetching."""
+        if self.original is not None:
+            socket.getaddrinfo = self.original
+            self.original = None
+        self.executor.shutdown(wait=False)
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """Cached replacement for `socket.getaddrinfo`.
+
+        Args:
+            host: Host name.
+            port: Port number or service name.
+            family: Address family.
+            type: Socket type.
+            proto: Protocol.
+            flags: Lookup flags.
+
+        Returns:
+            List of address tuples as returned by `socket.getaddrinfo`.
+
+        Raises:
+            socket.gaierror: The host can't be resolved (it may be a cached failure).
+        """
+        key = (host, port, family, type, proto, flags)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                if isinstance(entry[1], Exception):
+                    # A new instance: the cached one would accumulate the tracebacks of all the raises
+                    raise socket.gaierror(*entry[1].args)
+                return entry[1]
+            self.misses += 1
+            # Join a lookup in progress (e.g. a prefetch) instead of repeating it
+            future = self.lookups.get(key)
+            if future is None:
+                future = Future()
+                self.lookups[key] = future
+                owner = True
+            else:
+                owner = False
+        if owner:
+            # Resolve in the calling thread
+            self._lookup(key, future)
+        try:
+            return future.result()
+        except socket.gaierror as ex:
+            # The same instance is raised to all the threads waiting for the lookup
+            raise socket.gaierror(*ex.args) from None
+
+    def prefetch(self, host, port):
+        """Resolve a host in background so it's cached before it's needed.
+
+        Args:
+            host: Host name.
+            port: Port number.
+        """
+        # Same key used by `socket.create_connection`
+        key = (host, port, 0, socket.SOCK_STREAM, 0, 0)
+        with self.lock:
+            entry = self.cache.get(key)
+            if key in self.lookups or (entry is not None and entry[0] > time.time()):
+                return
+            future = Future()
+            self.lookups[key] = future
+        self.executor.submit(self._lookup, key, future)
+
+    def _lookup(self, key, future):
+        """Resolve, store the result in the cache and notify it to the waiting threads.
+
+        Args:
+            key: Tuple of `getaddrinfo` arguments.
+            future: Future to complete with the result or the exception.
+
+        Note:
+            The future is completed on any exception (interruptions included), otherwise
+            the threads waiting for it would block forever.
+        """
+        try:
+            result = self.resolve(*key)
+        except BaseException as ex:
+            # Only name resolution failures are cached
+            if isinstance(ex, socket.gaierror):
+                with self.lock:
+                    # Without the traceback of the lookup
+                    self.cache[key] = (time.time() + self.negative_ttl, socket.gaierror(*ex.args))
+            future.set_exception(ex)
+        else:
+            with self.lock:
+                self.cache[key] = (time.time() + self.ttl, result)
+            future.set_result(result)
+        finally:
+            with self.lock:
+                self.lookups.pop(key, None)
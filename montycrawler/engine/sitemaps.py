@@ -0,0 +1,276 @@
+from urllib import error, parse
+from xml.etree.ElementTree import XMLPullParser, ParseError
+from threading import Lock
+from engine.fetcher import Decoder, ContentTooLargeError
+import http.client
+import datetime
+import zlib
+import re
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+# Kinds of sitemap entries
+URL = 'url'
+SITEMAP = 'sitemap'
+
+
+class SitemapReader:
+    """Discovers the sitemaps of the hosts and feeds their entries to the queue.
+
+    Sitemaps are taken from `robots.txt` or, if it doesn't declare any, from
+    `/sitemap.xml`. Sitemap indexes are followed and gzipped sitemaps are
+    decompressed on the fly. The XML is parsed incrementally while it's
+    downloaded and the entries go to the queue in groups, so big sitemaps
+    aren't held in memory.
+
+    Note:
+        A single instance is shared by all the dispatchers. The sitemaps of each
+        host are read once, by the first dispatcher that fetches from it.
+
+    """
+    # Number of entries added to the queue at once
+    batch_size = 1000
+
+    def __init__(self, queue, fetcher, logger=None, max_sitemaps=50, max_size=50 * 1024 * 1024):
+        """Initialize the reader.
+
+        Args:
+            queue: The `Queue` object.
+            fetcher: `Fetcher` instance to download the sitemaps.
+            logger: Logger instance (optional).
+            max_sitemaps: Maximum number of sitemaps read from a host (including indexes).
+            max_size: Maximum size in bytes of a sitemap, once decompressed (50 MB by the protocol).
+        """
+        self.queue = queue
+        self.fetcher = fetcher
+        self.logger = logger
+        self.max_sitemaps = max_sitemaps
+        self.max_size = max_size
+        self.lock = Lock()
+        # Hosts (scheme and netloc) whose sitemaps were read or are being read
+        self.hosts = set()
+
+    def discover(self, item, robots_parser=None):
+        """Read the sitemaps of the host of an item, if it's the first time.
+
+        Args:
+            item: The queue item (`FrontierItem`), referrer of the entries.
+            robots_parser: `RobotFileParser` of the host (optional).
+
+        Returns:
+            Number of items added to the queue.
+        """
+        parsed = parse.urlparse(item.url)
+        root = '%s://%s' % (parsed.scheme, parsed.netloc)
+        with self.lock:
+            if root in self.hosts:
+                return 0
+            self.hosts.add(root)
+        urls = robots_parser.site_maps() if robots_parser else None
+        if not urls:
+            url = root + '/sitemap.xml'
+            urls = [url] if robots_parser is None or robots_parser.can_fetch('*', url) else []
+        return self.read_all(item, urls)
+
+    def read_all(self, item, urls):
+        """Read sitemaps, following the indexes.
+
+        Args:
+            item: The queue item, referrer of the entries.
+            urls: URLs of the sitemaps.
+
+        Returns:
+            Number of items added to the queue.
+        """
+        host = parse.urlparse(item.url).netloc
+        pending = list(urls)
+        seen = set()
+        added = 0
+        while pending and len(seen) < self.max_sitemaps:
+            url = pending.pop(0)
+            # Sitemaps of other hosts are only followed when crawling all domains
+            if url in seen or (not self.queue.all_domains and parse.urlparse(url).netloc != host):
+                continue
+            seen.add(url)
+            try:
+                added += self.read(item, url, pending)
+            except error.HTTPError as ex:
+                if self.logger:
+                    self.logger.debug('Code %d retrieving sitemap %s' % (ex.code, url))
+            except (error.URLError, ParseError, ContentTooLargeError, zlib.error,
+                    OSError, http.client.HTTPException) as ex:
+                # Including connection errors while the body is streamed
+                if self.logger:
+                    self.logger.error('Error reading sitemap %s: %s' % (url, ex))
+        return added
+
+    def read(self, item, url, indexed):
+        """Read a sitemap and add its entries to the queue.
+
+        Args:
+            item: The queue item, referrer of the entries.
+            url: URL of the sitemap.
+            indexed: List where the sitemaps listed by an index are appended.
+
+        Returns:
+            Number of items added to the queue.
+        """
+        added = rejected = 0
+        entries = []
+        now = datetime.datetime.utcnow()
+        for kind, loc, lastmod, priority in parse_sitemap(self.fetcher.stream(url), self.max_size):
+            if kind == SITEMAP:
+                indexed.append(loc)
+                continue
+            entries.append((loc, entry_priority(loc, lastmod, priority, now), lastmod))
+            if len(entries) >= self.batch_size:
+                a, r = self.queue.add_sitemap(item, entries)
+                added += a
+                rejected += r
+                entries = []
+        if entries:
+            a, r = self.queue.add_sitemap(item, entries)
+            added += a
+            rejected += r
+        if self.logger:
+            self.logger.console('Sitemap %s: %d added, %d rejected.' % (url, added, rejected))
+        return added
+
+
+def parse_sitemap(chunks, max_size=None):
+    """Parse a sitemap or sitemap index incrementally.
+
+    Args:
+        chunks: Iterable of chunks of the content (bytes), gzipped or not.
+        max_size: Maximum size in bytes of the XML (`None` for no limit).
+
+    Yields:
+        Tuples of kind (`URL` or `SITEMAP`), location, last modification (`datetime`
+        in UTC or `None`) and priority (float between 0 and 1 or `None`).
+
+    Raises:
+        ParseError: The content isn't well formed XML.
+        ContentTooLargeError: The XML exceeds the maximum size.
+    """
+    parser = XMLPullParser(events=('start', 'end'))
+    # The root element, to drop the entries once parsed
+    root = []
+    decoder = None
+    size = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if decoder is None:
+            # Gzipped sitemaps are served as they are, without a content encoding
+            decoder = Decoder('gzip' if chunk[:2] == b'\x1f\x8b' else None, 64 * 1024)
+        for piece in decoder.decompress(chunk):
+            size += len(piece)
+            if max_size and size > max_size:
+                raise ContentTooLargeError('Sitemap exceeds the limit of %d bytes' % max_size)
+            parser.feed(piece)
+            yield from _entries(parser, root)
+    if decoder:
+        for piece in decoder.flush():
+            parser.feed(piece)
+    parser.close()
+    yield from _entries(parser, root)
+
+
+def _entries(parser, root):
+    """Collect the entries parsed so far.
+
+    Args:
+        parser: The `XMLPullParser`.
+        root: List with the root element (empty until it's parsed).
+
+    Yields:
+        See `parse_sitemap`.
+    """
+    for event, elem in parser.read_events():
+        if event == 'start':
+            if not root:
+                root.append(elem)
+            continue
+        kind = elem.tag.rpartition('}')[2]
+        if kind not in (URL, SITEMAP) or not root or elem is root[0]:
+            continue
+        fields = {child.tag.rpartition('}')[2]: (child.text or '').strip() for child in elem}
+        if fields.get('loc'):
+            try:
+                priority = float(fields['priority']) if fields.get('priority') else None
+            except ValueError:
+                priority = None
+            yield kind, fields['loc'], parse_lastmod(fields.get('lastmod')), priority
+        # Parsed entries aren't kept in the tree (they're found first, as the previous ones were removed)
+        elem.clear()
+        try:
+            root[0].remove(elem)
+        except ValueError:
+            pass
+
+
+_LASTMOD = re.compile(r'(\d{4})(?:-(\d\d)(?:-(\d\d)(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.\d+)?)?)?)?)?'
+                      r'\s*(Z|[+-]\d\d:?\d\d)?$')
+
+
+def parse_lastmod(text):
+    """Parse the last modification of a sitemap entry (W3C datetime).
+
+    Args:
+        text: The date, with the precision of a year up to fractions of a second.
+
+    Returns:
+        Naive `datetime` in UTC, or `None` if the date is missing or not valid.
+    """
+    match = _LASTMOD.match(text or '')
+    if not match:
+        return None
+    year, month, day, hour, minute, second, zone = match.groups()
+    try:
+        date = datetime.datetime(int(year), int(month or 1), int(day or 1),
+                                 int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        return None
+    if zone and zone != 'Z':
+        offset = datetime.timedelta(hours=int(zone[1:3]), minutes=int(zone[-2:]))
+        date = date - offset if zone[0] == '+' else date + offset
+    return date
+
+
+def entry_priority(url, lastmod, priority, now):
+    """Priority in the queue of a sitemap entry.
+
+    Documents go first, then entries by the priority given by the sitemap and
+    by how recently they were modified.
+
+    Args:
+        url: Location of the entry.
+        lastmod: Last modification (`datetime` in UTC or `None`).
+        priority: Priority given by the sitemap (between 0 and 1, or `None`).
+        now: Current time (`datetime` in UTC).
+
+    Returns:
+        The priority (int between 1 and 40).
+    """
+    score = 10 * min(1, max(0, 0.5 if priority is None else priority))
+    if lastmod is not None:
+        # Up to 10 points for the last 10 months
+        score += min(10, max(0, 10 - (now - lastmod).days // 30))
+    if parse.urlparse(url).path.lower().endswith('.pdf'):
+        score += 20
+    return max(1, int(round(score)))
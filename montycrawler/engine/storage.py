@@ -0,0 +1,222 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Thread, Condition, BoundedSemaphore
+import hashlib
+import mimetypes
+import os
+import json
+import tempfile
+
+# Permissions of stored files (temporary files are created only readable by the owner)
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Storage:
+    """Stores documents on filesystem and database in background.
+
+    Files are written by a bounded pool of writer threads (to a temporary file
+    that is renamed when complete) and the `Document` records are inserted by a
+    committer thread in groups, so dispatchers only wait when the pool is full.
+
+    Note:
+        Database inserts go through `Queue.add_documents`, that keeps all database
+        operations in the same place.
+
+    """
+    def __init__(self, queue, folder, rejected_folder=None, logger=None,
+                 workers=2, max_pending=50, batch_size=20, batch_interval=2, shard_depth=0):
+        """Initialize the storage and start its threads.
+
+        Args:
+            queue: The `Queue` object.
+            folder: Path to the `accepted` folder.
+            rejected_folder: Path to the `rejected` folder (content discarded if path is empty).
+            logger: Logger instance to report errors (optional).
+            workers: Number of writer threads.
+            max_pending: Maximum number of documents waiting to be stored before `submit` blocks.
+            batch_size: Maximum number of documents inserted in the same commit.
+            batch_interval: Maximum time in seconds a document waits to be committed.
+            shard_depth: Levels of hashed subdirectories to distribute files (0 for none).
+        """
+        self.queue = queue
+        self.folder = folder
+        self.rejected_folder = rejected_folder
+        self.logger = logger
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.shard_depth = shard_depth
+        self.executor = ThreadPoolExecutor(workers)
+        self.slots = BoundedSemaphore(max_pending)
+        # Records written and waiting to be committed (tuples of fields and future)
+        self.records = []
+        self.closing = False
+        self.cond = Condition()
+        self.committer = Thread(target=self._commit_loop, name='storage', daemon=True)
+        self.committer.start()
+
+    def filename(self, resource_id, mimetype, filename):
+        """Obtain the final name of a file.
+
+        Args:
+            resource_id: ID of the URL resource where the document was retrieved from.
+            mimetype: Standard MIME id for the type of content.
+            filename: Name for the file (it will be cleaned from not allowed chars).
+
+        Returns:
+            Relative path of the file (includes the shard subdirectories, if any).
+        """
+        # Clean filename
+        cleaned = ''.join((c if c.isalnum() or c == '.' else '_' for c in filename))
+        # Append extension
+        ext = mimetypes.guess_extension(mimetype)
+        if not cleaned.endswith(ext):
+            cleaned += ext
+        # Append ID to avoid collision
+        cleaned = str(resource_id) + '_' + cleaned
+        if self.shard_depth:
+            digest = hashlib.md5(cleaned.encode()).hexdigest()
+            cleaned = '/'.join([digest[2 * i:2 * i + 2] for i in range(self.shard_depth)] + [cleaned])
+        return cleaned
+
+    def submit(self, accepted, item, mimetype, filename, metadata, content):
+        """Schedule the storage of a document.
+
+        Args:
+            accepted: T/F write the document in the `accepted` folder, otherwise on `rejected`.
+            item: The queue item (`FrontierItem`) of the URL where the document was retrieved from.
+            mimetype: Standard MIME id for the type of content.
+            filename: Name for the file (it will be cleaned from not allowed chars).
+            metadata: Metadata dictionary for the document.
+            content: The binary content to be stored (bytes or `ContentBuffer`, that is
+                finalized or released by the storage).
+
+        Returns:
+            Tuple:
+                The final name of the file (even it will be written or not).
+                Future resolved when the file is written and the document committed.
+        """
+        name = self.filename(item.resource_id, mimetype, filename)
+        fields = dict(resource_id=item.resource_id,
+                      name=item.title if metadata.get('/Title') is None else metadata.get('/Title'),
+                      author=metadata.get('/Author'),
+                      meta_data=json.dumps(metadata),
+                      filename=name,
+                      type=mimetype,
+                      relevancy=metadata.get('_relevancy'),
+                      num_pages=metadata.get('_num_pages'),
+                      accepted=accepted)
+        future = Future()
+        # Block if too many documents are waiting
+        self.slots.acquire()
+        self.executor.submit(self._write, fields, content, future)
+        return name, future
+
+    def _write(self, fields, content, future):
+        """Write a file (if needed) and queue its record for the next commit.
+
+        Args:
+            fields: Dictionary of `Document` fields (and `resource_id`).
+            content: The binary content to be stored (bytes or `ContentBuffer`).
+            future: Future to complete when the document is committed.
+        """
+        buffered = hasattr(content, 'finalize')
+        try:
+            accepted = fields['accepted']
+            if accepted or self.rejected_folder:
+                path = os.path.join(self.folder if accepted else self.rejected_folder, fields['filename'])
+                if buffered:
+                    # Spooled content is moved in place, not rewritten
+                    content.finalize(path)
+                else:
+                    # Check binary or text mode
+                    mode = 'w' if fields['type'].startswith('text/') else 'wb'
+                    write_atomic(path, content, mode)
+            elif buffered:
+                content.release()
+        except Exception as ex:
+            if buffered:
+                content.release()
+            self.slots.release()
+            future.set_exception(ex)
+            if self.logger:
+                self.logger.error('Error storing "%s": %s' % (fields['filename'], ex))
+            return
+        with self.cond:
+            self.records.append((fields, future))
+            if len(self.records) >= self.batch_size:
+                self.cond.notify()
+
+    def _commit_loop(self):
+        """Committer thread: insert written documents in groups."""
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closing or len(self.records) >= self.batch_size,
+                                   self.batch_interval)
+                records, self.records = self.records, []
+                closing = self.closing
+            if records:
+                try:
+                    self.queue.add_documents([fields for fields, _ in records])
+                    for fields, future in records:
+                        future.set_result(fields['filename'])
+                except Exception as ex:
+                    for _, future in records:
+                        future.set_exception(ex)
+                    if self.logger:
+                        self.logger.error('Error registering %d documents: %s' % (len(records), ex))
+                finally:
+                    for _ in records:
+                        self.slots.release()
+                    self.queue.checkpoint()
+            if closing and not records:
+                break
+
+    def close(self):
+        """Wait until all the documents are stored and stop the threads."""
+        self.executor.shutdown(wait=True)
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        self.committer.join()
+
+
+def write_atomic(path, content, mode='wb'):
+    """Write a file through a temporary file in the same folder and rename it.
+
+    Readers never see partially written files.
+
+    Args:
+        path: Destination path (missing folders are created).
+        content: Content to write.
+        mode: File mode (`w` or `wb`).
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=folder or '.', prefix='.tmp_')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(content)
+        os.chmod(temp, FILE_MODE)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
@@ -0,0 +1,103 @@
+from db.cache import Base, CachedText
+from db.utils import setupdb
+from threading import RLock
+import hashlib
+import json
+import zlib
+from io import BytesIO
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class TextCache:
+    """Persistent cache of metadata and normalized page text of documents, by content hash.
+
+    Documents found again (in the same crawl or in later ones) are scored for
+    any keyword set without parsing them again.
+    """
+    def __init__(self, file='cache', max_pages=10, read_only=False):
+        """Open (or create) the cache database.
+
+        Args:
+            file: Name of the database file (without the `.sqlite` extension).
+            max_pages: Maximum number of pages of text stored by document.
+            read_only: T/F don't write to the database: documents stored are kept in
+                `pending`, to be stored by another instance (for worker processes).
+        """
+        self.session = setupdb(file, Base)
+        self.max_pages = max_pages
+        self.read_only = read_only
+        self.pending = []
+        self.lock = RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest):
+        """Look up a document.
+
+        Args:
+            digest: SHA-1 hex digest of the content.
+
+        Returns:
+            Tuple of metadata (dictionary) and list of page texts, or `None` if not cached.
+        """
+        with self.lock:
+            entry = self.session().query(CachedText).get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            texts = zlib.decompress(entry.text).decode('utf-8').split('\f') if entry.pages else []
+            return json.loads(entry.meta_data), texts
+
+    def put(self, digest, metadata, texts):
+        """Store (or replace) a document.
+
+        Args:
+            digest: SHA-1 hex digest of the content.
+            metadata: Metadata dictionary.
+            texts: List of normalized page texts (only the first `max_pages` are stored).
+        """
+        texts = texts[:self.max_pages]
+        if self.read_only:
+            self.pending.append((digest, metadata, texts))
+            return
+        with self.lock:
+            self.session().merge(CachedText(sha1=digest, meta_data=json.dumps(metadata), pages=len(texts),
+                                            text=zlib.compress('\f'.join(texts).encode('utf-8'))))
+            self.session().commit()
+
+
+def content_hash(content):
+    """SHA-1 digest of a content, if it can be computed without reading a stream.
+
+    Args:
+        content: Bytes, `BytesIO` or any object supporting the buffer protocol (like a
+            memory map). Other streams (like partially fetched contents) aren't hashed.
+
+    Returns:
+        Hex digest or `None`.
+    """
+    if isinstance(content, BytesIO):
+        with content.getbuffer() as data:
+            return hashlib.sha1(data).hexdigest()
+    try:
+        with memoryview(content) as data:
+            return hashlib.sha1(data).hexdigest()
+    except TypeError:
+        return None
@@ -0,0 +1,93 @@
+from threading import Thread
+from db.utils import identity_map_size
+import sys
+import gc
+import os
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class MemoryWatchdog(Thread):
+    """Background job that reports memory usage and forces recycling of sessions.
+
+    Every `interval` seconds it logs the resident set size and the number of
+    objects held by the database sessions. Above the thresholds, it asks the
+    session recyclers to recycle the sessions of all threads at their next
+    checkpoint (see `SessionRecycler`).
+    """
+    def __init__(self, queue, recyclers, logger=None, interval=60, max_objects=50000, max_rss=None):
+        """Initialize the watchdog.
+
+        Args:
+            queue: The `Queue` object (the watchdog stops when the crawl is finished).
+            recyclers: List of `SessionRecycler` instances.
+            logger: Logger instance (optional).
+            interval: Seconds between checks.
+            max_objects: Objects in the identity maps of all sessions to force recycling.
+            max_rss: Resident set size in MB to force recycling (`None` for no limit).
+        """
+        Thread.__init__(self, name='watchdog', daemon=True)
+        self.queue = queue
+        self.recyclers = recyclers
+        self.logger = logger
+        self.interval = interval
+        self.max_objects = max_objects
+        self.max_rss = max_rss
+        self.recyclings = 0
+
+    def run(self):
+        """Check every `interval` seconds until the crawl is finished."""
+        while not self.queue.quiescent.wait(self.interval):
+            self.check()
+
+    def check(self):
+        """Report memory usage and force recycling if needed.
+
+        Returns:
+            T/F recycling was requested.
+        """
+        rss = current_rss()
+        sessions, objects = identity_map_size()
+        if self.logger:
+            self.logger.debug('Memory: %.1f MB RSS, %d objects in %d sessions' % (rss, objects, sessions))
+        if objects > self.max_objects or (self.max_rss and rss > self.max_rss):
+            for recycler in self.recyclers:
+                recycler.request()
+            gc.collect()
+            self.recyclings += 1
+            if self.logger:
+                self.logger.console('Memory: %.1f MB RSS, %d objects in sessions. Recycling sessions.' %
+                                    (rss, objects))
+            return True
+        return False
+
+
+def current_rss():
+    """Resident set size of the process in MB (the peak size where it can't be read, 0 if unknown)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        try:
+            # Unix only
+            import resource
+        except ImportError:
+            return 0
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, KB elsewhere
+        return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
@@ -0,0 +1,137 @@
+from concurrent.futures import Future
+from threading import Thread, Condition
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class DatabaseWriter(Thread):
+    """Single thread that applies all the database writes, in groups.
+
+    Operations are functions that receive the session of the writer and return
+    a result. They're executed in the order they were submitted, and everything
+    queued while a group is being written goes in the next commit (group commit),
+    so writers never wait for each other on the database.
+
+    Note:
+        Operations must only change the session: when a group fails, it's rolled
+        back and its operations are run again one by one, each one in its own
+        commit, so only the failing ones get the error.
+
+    """
+    def __init__(self, session, recycler=None, batch_size=500):
+        """Initialize the writer and start its thread.
+
+        Args:
+            session: The scoped session.
+            recycler: `SessionRecycler` to checkpoint after each commit (optional).
+            batch_size: Maximum number of operations in the same commit.
+        """
+        Thread.__init__(self, name='writer', daemon=True)
+        self.session = session
+        self.recycler = recycler
+        self.batch_size = batch_size
+        # Operations waiting to be written (tuples of function, arguments and future)
+        self.operations = []
+        self.closing = False
+        self.cond = Condition()
+        # Stats: commits, operations written and failed
+        self.commits = 0
+        self.written = 0
+        self.failed = 0
+        self.start()
+
+    def submit(self, operation, *args):
+        """Schedule a write.
+
+        Args:
+            operation: Function called with the session and `args`.
+            *args: Arguments of the operation.
+
+        Returns:
+            Future resolved with the result of the operation when it's committed.
+        """
+        future = Future()
+        with self.cond:
+            if self.closing:
+                raise RuntimeError('Database writer closed')
+            self.operations.append((operation, args, future))
+            self.cond.notify()
+        return future
+
+    def call(self, operation, *args):
+        """Write and wait until it's committed.
+
+        Args:
+            operation: Function called with the session and `args`.
+            *args: Arguments of the operation.
+
+        Returns:
+            Result of the operation.
+        """
+        return self.submit(operation, *args).result()
+
+    def flush(self):
+        """Wait until all the writes submitted so far are committed."""
+        self.call(lambda session: None)
+
+    def run(self):
+        """Writer thread: commit the queued operations in groups."""
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closing or self.operations)
+                group = self.operations[:self.batch_size]
+                del self.operations[:self.batch_size]
+                if not group and self.closing:
+                    break
+            try:
+                self._write(group)
+            finally:
+                if self.recycler:
+                    self.recycler.checkpoint()
+
+    def _write(self, group):
+        """Run a group of operations in one commit.
+
+        Args:
+            group: List of tuples of operation, arguments and future.
+        """
+        session = self.session()
+        try:
+            results = [operation(session, *args) for operation, args, _ in group]
+            session.commit()
+        except Exception as ex:
+            session.rollback()
+            if len(group) > 1:
+                # Isolate the failing operations
+                for operation in group:
+                    self._write([operation])
+            else:
+                self.failed += 1
+                group[0][2].set_exception(ex)
+            return
+        self.commits += 1
+        self.written += len(group)
+        for (_, _, future), result in zip(group, results):
+            future.set_result(result)
+
+    def close(self):
+        """Write the pending operations and stop the thread."""
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        self.join()
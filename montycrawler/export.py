@@ -0,0 +1,402 @@
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Montycrawler export: columnar copy of the crawl graph and the document catalog.
+
+The `resources`, `links` and `documents` tables are streamed in chunks into
+Parquet files (if pyarrow is installed) or gzipped CSV files, so analytics
+don't compete with the crawler for the database. The metadata of documents
+is flattened into typed columns.
+
+Exports are incremental: each run writes a new part file per table with the
+rows added since the previous run (by ID) and the rows changed since then:
+resources fetched and documents modified (rescored, see rescore.py). Rows of
+a part supersede the rows with the same ID of previous parts. The watermarks are saved in the output folder when a part is complete.
+
+Usage:
+    python export.py [options]
+    Use option --help for details.
+
+"""
+
+from optparse import OptionParser
+from db.model import Base, Resource, Link, Document
+from db.utils import setupdb
+from sqlalchemy import or_
+import datetime
+import json
+import gzip
+import csv
+import re
+import time
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Columns of the exported tables (name and type: int, float, bool, str or timestamp)
+RESOURCE_COLUMNS = [('id', 'int'), ('url', 'str'), ('title', 'str'), ('timestamp', 'timestamp'),
+                    ('fetched', 'timestamp'), ('last_code', 'int'), ('document_id', 'int')]
+LINK_COLUMNS = [('id', 'int'), ('referrer_id', 'int'), ('target_id', 'int'), ('text', 'str')]
+DOCUMENT_COLUMNS = [('id', 'int'), ('uuid', 'str'), ('name', 'str'), ('author', 'str'), ('type', 'str'),
+                    ('filename', 'str'), ('relevancy', 'float'), ('num_pages', 'int'), ('accepted', 'bool'),
+                    ('timestamp', 'timestamp'), ('modified', 'timestamp')]
+# Metadata of documents flattened into columns (name, key and type); the other keys go to `meta_extra`
+META_COLUMNS = [('meta_title', '/Title', 'str'), ('meta_subject', '/Subject', 'str'),
+                ('meta_keywords', '/Keywords', 'str'), ('meta_creator', '/Creator', 'str'),
+                ('meta_producer', '/Producer', 'str'), ('meta_created', '/CreationDate', 'timestamp'),
+                ('meta_modified', '/ModDate', 'timestamp'), ('meta_sha1', '_sha1', 'str')]
+# Keys already in columns of the documents table
+META_DUPLICATES = ('/Author', '_relevancy', '_num_pages')
+
+
+def resource_rows(session, watermark, batch_size):
+    """Stream the resources added or fetched after a watermark.
+
+    Args:
+        session: Database session (scoped session factory).
+        watermark: Dictionary with the last `id` and `fetched` time (ISO format) exported.
+        batch_size: Number of rows read at once.
+
+    Yields:
+        Lists of rows (tuples in the order of `RESOURCE_COLUMNS`).
+    """
+    columns = [getattr(Resource, name) for name, _ in RESOURCE_COLUMNS]
+    yield from _chunks(session, columns, Resource.id, _changed(Resource, watermark, 'fetched'), batch_size)
+
+
+def link_rows(session, watermark, batch_size):
+    """Stream the links added after a watermark (see `resource_rows`)."""
+    columns = [getattr(Link, name) for name, _ in LINK_COLUMNS]
+    yield from _chunks(session, columns, Link.id, Link.id > watermark.get('id', 0), batch_size)
+
+
+def document_rows(session, watermark, batch_size):
+    """Stream the documents added or modified after a watermark, with their metadata flattened.
+
+    Args:
+        session: Database session (scoped session factory).
+        watermark: Dictionary with the last `id` and `modified` time (ISO format) exported.
+        batch_size: Number of rows read at once.
+
+    Yields:
+        Lists of rows (tuples in the order of `DOCUMENT_COLUMNS` and `META_COLUMNS`, plus `meta_extra`).
+    """
+    columns = [getattr(Document, name) for name, _ in DOCUMENT_COLUMNS] + [Document.meta_data]
+    for rows in _chunks(session, columns, Document.id, _changed(Document, watermark, 'modified'), batch_size):
+        yield [row[:-1] + flatten_metadata(row[-1]) for row in rows]
+
+
+def _changed(model, watermark, column):
+    """Filter of the rows added or changed after a watermark.
+
+    Args:
+        model: Model class of the table.
+        watermark: Dictionary with the last `id` and the last time of `column` (ISO format) exported.
+        column: Name of the column with the time of the last change.
+
+    Returns:
+        The condition.
+    """
+    condition = model.id > watermark.get('id', 0)
+    if watermark.get(column):
+        since = datetime.datetime.strptime(watermark[column], '%Y-%m-%dT%H:%M:%S.%f')
+        condition = or_(condition, getattr(model, column) > since)
+    return condition
+
+
+def _chunks(session, columns, key, condition, batch_size):
+    """Read rows in chunks by keyset pagination.
+
+    Each chunk is read in its own short transaction, so a running crawl isn't
+    blocked for the whole export.
+
+    Args:
+        session: Database session (scoped session factory).
+        columns: List of columns (the first one is the key).
+        key: Key column (integer, unique).
+        condition: Filter of the rows.
+        batch_size: Number of rows read at once.
+
+    Yields:
+        Lists of rows.
+    """
+    cursor = 0
+    while True:
+        rows = session().query(*columns).filter(condition, key > cursor).order_by(key).limit(batch_size).all()
+        session().rollback()
+        if not rows:
+            break
+        yield rows
+        cursor = rows[-1][0]
+
+
+def flatten_metadata(meta_data):
+    """Flatten the metadata of a document into typed columns.
+
+    Args:
+        meta_data: Metadata (JSON) or `None`.
+
+    Returns:
+        Tuple of values in the order of `META_COLUMNS`, plus the other keys (JSON, `None` if there're none).
+    """
+    try:
+        metadata = json.loads(meta_data) if meta_data else {}
+    except ValueError:
+        metadata = {}
+    if not isinstance(metadata, dict):
+        metadata = {}
+    values = []
+    for _, key, kind in META_COLUMNS:
+        value = metadata.pop(key, None)
+        if kind == 'timestamp':
+            value = parse_pdf_date(value)
+        elif value is not None:
+            value = str(value)
+        values.append(value)
+    extra = {k: v for k, v in metadata.items() if k not in META_DUPLICATES}
+    return tuple(values) + (json.dumps(extra, sort_keys=True) if extra else None,)
+
+
+_PDF_DATE = re.compile(r"(?:D:)?(\d{4})(\d\d)?(\d\d)?(\d\d)?(\d\d)?(\d\d)?\s*(Z|[+-]\d\d'?\d\d'?)?")
+
+
+def parse_pdf_date(text):
+    """Parse a date of the document information of a PDF (like D:20160131120000+01'00').
+
+    Args:
+        text: The date.
+
+    Returns:
+        Naive `datetime` in UTC, or `None` if the date is missing or not valid.
+    """
+    match = _PDF_DATE.match(text.strip()) if isinstance(text, str) else None
+    if not match:
+        return None
+    year, month, day, hour, minute, second, zone = match.groups()
+    try:
+        date = datetime.datetime(int(year), int(month or 1), int(day or 1),
+                                 int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        return None
+    if zone and zone != 'Z':
+        digits = zone[1:].replace("'", '')
+        offset = datetime.timedelta(hours=int(digits[:2]), minutes=int(digits[2:4] or 0))
+        date = date - offset if zone[0] == '+' else date + offset
+    return date
+
+
+class ParquetWriter:
+    """Writes chunks of rows to a Parquet file (one row group per chunk)."""
+    extension = '.parquet'
+    types = {'int': 'int64', 'float': 'float64', 'bool': 'bool_', 'str': 'string'} if pyarrow else {}
+
+    def __init__(self, path, columns):
+        """Create the file.
+
+        Args:
+            path: Path of the file.
+            columns: List of tuples of column name and type.
+        """
+        self.columns = columns
+        self.schema = pyarrow.schema([(name, pyarrow.timestamp('us') if kind == 'timestamp'
+                                       else getattr(pyarrow, self.types[kind])()) for name, kind in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        """Append rows.
+
+        Args:
+            rows: List of tuples, in the order of the columns.
+        """
+        data = {name: [(float(row[i]) if row[i] is not None else None) if kind == 'float' else row[i]
+                       for row in rows] for i, (name, kind) in enumerate(self.columns)}
+        self.writer.write_table(pyarrow.Table.from_pydict(data, self.schema))
+
+    def close(self):
+        """Finish the file."""
+        self.writer.close()
+
+
+class CsvWriter:
+    """Writes chunks of rows to a gzipped CSV file, with a header (fallback without pyarrow).
+
+    Missing values are empty, timestamps are in ISO format and booleans are 0 or 1.
+    """
+    extension = '.csv.gz'
+
+    def __init__(self, path, columns):
+        """Create the file.
+
+        Args:
+            path: Path of the file.
+            columns: List of tuples of column name and type.
+        """
+        self.file = gzip.open(path, 'wt', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+
+    def write(self, rows):
+        """Append rows.
+
+        Args:
+            rows: List of tuples, in the order of the columns.
+        """
+        self.writer.writerows([['' if v is None else v.isoformat() if isinstance(v, datetime.datetime)
+                                else int(v) if isinstance(v, bool) else v for v in row] for row in rows])
+
+    def close(self):
+        """Finish the file."""
+        self.file.close()
+
+
+# Exported tables: name, function streaming rows, columns and column with the time of the last change
+TABLES = [('resources', resource_rows, RESOURCE_COLUMNS, 'fetched'),
+          ('links', link_rows, LINK_COLUMNS, None),
+          ('documents', document_rows, DOCUMENT_COLUMNS + [(name, kind) for name, _, kind in META_COLUMNS] +
+           [('meta_extra', 'str')], 'modified')]
+
+
+def export(session, folder, writer_class, batch_size=10000, lag=600, progress=None):
+    """Export the rows added (or changed) since the previous export.
+
+    Args:
+        session: Database session (scoped session factory).
+        folder: Output folder (with a subfolder by table and the watermarks).
+        writer_class: `ParquetWriter` or `CsvWriter`.
+        batch_size: Number of rows read and written at once.
+        lag: Seconds before the start of the export from which changed rows are exported again
+            in the next run (outcomes of fetches and rescores are committed in batches).
+        progress: Function called after each table with its name, number of rows and path of the part.
+
+    Returns:
+        Dictionary of number of rows exported by table.
+    """
+    start = datetime.datetime.utcnow()
+    watermarks = load_watermarks(folder)
+    counts = {}
+    for table, rows, columns, changed in TABLES:
+        position = [name for name, _ in columns].index(changed) if changed else None
+        watermark = watermarks.setdefault(table, {})
+        part = watermark.get('parts', 0) + 1
+        os.makedirs(os.path.join(folder, table), exist_ok=True)
+        path = os.path.join(folder, table, 'part-%06d%s' % (part, writer_class.extension))
+        temp = os.path.join(folder, table, '.tmp_part-%06d%s' % (part, writer_class.extension))
+        writer = None
+        count = 0
+        last_id = watermark.get('id', 0)
+        latest = None
+        try:
+            for chunk in rows(session, watermark, batch_size):
+                if writer is None:
+                    writer = writer_class(temp, columns)
+                writer.write(chunk)
+                count += len(chunk)
+                last_id = max(last_id, chunk[-1][0])
+                if changed:
+                    latest = max([latest] + [row[position] for row in chunk if row[position]],
+                                 key=lambda t: t or start.min)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+                os.unlink(temp)
+            raise
+        if writer is not None:
+            writer.close()
+            os.replace(temp, path)
+            watermark.update(id=last_id, parts=part)
+        if changed:
+            # Changes committed late would be missed with the latest time. Without changes
+            # the watermark still moves, otherwise changes after this export would be missed
+            latest = min(latest or start, start - datetime.timedelta(seconds=lag))
+            if latest.strftime('%Y-%m-%dT%H:%M:%S.%f') > watermark.get(changed, ''):
+                watermark[changed] = latest.strftime('%Y-%m-%dT%H:%M:%S.%f')
+        if writer is not None or changed:
+            save_watermarks(folder, watermarks)
+        counts[table] = count
+        if progress:
+            progress(table, count, path if writer is not None else None)
+    return counts
+
+
+def load_watermarks(folder):
+    """Read the watermarks of the previous exports.
+
+    Args:
+        folder: Output folder.
+
+    Returns:
+        Dictionary of table name to dictionary of last `id`, time of the last change (`fetched`
+        or `modified`) and number of `parts`.
+    """
+    path = os.path.join(folder, 'watermarks.json')
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_watermarks(folder, watermarks):
+    """Save the watermarks.
+
+    Args:
+        folder: Output folder.
+        watermarks: See `load_watermarks`.
+    """
+    path = os.path.join(folder, 'watermarks.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+# Main program
+if __name__ == '__main__':
+    start_time = time.time()
+    opt_parser = OptionParser('usage: python %prog [options]')
+    opt_parser.add_option('-o', '--output', type='string', dest='output', default='export',
+                          help='output folder (default "export")')
+    opt_parser.add_option('--format', type='choice', dest='format', choices=['parquet', 'csv'],
+                          help='parquet or csv (gzipped) (default parquet if pyarrow is installed, otherwise csv)')
+    opt_parser.add_option('-b', '--batch-size', type='int', dest='batch_size', default=10000,
+                          help='rows read and written at once (default 10000)')
+    opt_parser.add_option('--lag', type='int', dest='lag', default=600,
+                          help='seconds of changes (fetches, rescores) exported again in the next run (default 600)')
+    opt_parser.add_option('--full', dest='full', action='store_true',
+                          help='export all the rows again (previous parts are kept)')
+    (options, args) = opt_parser.parse_args()
+
+    if options.format == 'parquet' and pyarrow is None:
+        opt_parser.error('the parquet format requires pyarrow (pip install pyarrow)')
+    writer_class = ParquetWriter if (options.format or ('parquet' if pyarrow else 'csv')) == 'parquet' \
+        else CsvWriter
+    if options.full:
+        watermarks = load_watermarks(options.output)
+        for watermark in watermarks.values():
+            watermark.pop('id', None)
+            watermark.pop('fetched', None)
+            watermark.pop('modified', None)
+        if watermarks:
+            save_watermarks(options.output, watermarks)
+
+    def report(table, count, path):
+        print('%s: %d rows%s' % (table, count, ' in %s' % path if path else ''))
+
+    counts = export(setupdb('db', Base), options.output, writer_class, options.batch_size, options.lag, report)
+    print('%d rows exported in %d seconds.' % (sum(counts.values()), round(time.time() - start_time)))
@@ -1,170 +1,416 @@
-# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
-
-# This file is part of Montycrawler.
-
-# Montycrawler is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, either version 3 of the License, or
-# (at your option) any later version.
-
-# Montycrawler is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-# GNU General Public License for more details.
-
-# You should have received a copy of the GNU General Public License
-# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
-
-"""Montycrawler: A multithreaded web crawler designed to obtain and analyze PDF documents.
-
-Author:
-    Jose A. Brihuega Parodi <jose.brihuega@uca.es>
-
-Usage:
-    python mc.py [options] [URL]
-    Use option --help for details.
-
-"""
-
-from importlib import import_module
-from optparse import OptionParser
-from db.model import Resource
-from engine.queue import Queue
-from engine.dispatcher import Dispatcher
-import time
-import os
-import errno
-from engine.logger import Logger
-
-
-def load_class(name):
-    """Utility function to load a class.
-
-    Args:
-        name: Full class/module name.
-
-    Returns:
-        The loaded class.
-
-    """
-    module_path, _, class_name = name.rpartition('.')
-    mod = import_module(module_path)
-    return getattr(mod, class_name)
-
-
-def create_folder(path):
-    """Utility function to create folder if it doesn't exist.
-
-    Args:
-        path: The path.
-
-    """
-    try:
-        os.makedirs(path)
-        logger.console('Folder "%s" created.' % os.path.abspath(path))
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
-
-# Main program
-if __name__ == '__main__':
-    start_time = time.time()
-    print('Montycrawler. Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>')
-    print('This is free software. See LICENSE.md for details.')
-    # Parse options
-    opt_parser = OptionParser('usage: python %prog [options] [URL]')
-    opt_parser.add_option('-r', '--reset', dest='reset',
-                          action='store_true',
-                          help='reset database (data will be LOST!)')
-    opt_parser.add_option('-p', '--preserve-queue', dest='preserve_queue',
-                          action='store_true',
-                          help="don't remove pending queue (if URL is provided)")
-    opt_parser.add_option('--parser', dest='parser',
-                          help="use CLASS to parse content (default SimpleParser)", metavar="CLASS",
-                          default='parsing.SimpleParser')
-    opt_parser.add_option('--processor', dest='processor',
-                          help="use CLASS to process documents (default PDFProcessor)", metavar="CLASS",
-                          default='processing.PDFProcessor')
-    opt_parser.add_option('-a', '--all-domains', dest='all_domains',
-                          action='store_true',
-                          help='add resources from any domain (default only from the same base domain)')
-    opt_parser.add_option('-t', '--threads', type='int', dest='threads', default=10,
-                          help='number of threads (default 10)')
-    opt_parser.add_option('-R', '--retries', type='int', dest='retries', default=3,
-                          help='number of threads (default 10)')
-    opt_parser.add_option('-k', '--keywords', type='string', dest='keywords',
-                          help='list of relevant keywords (comma separated without spaces)')
-    opt_parser.add_option('-f', '--download-folder', type='string', dest='download_folder', default='files',
-                          help='destination folder for downloaded files (default "files")')
-    opt_parser.add_option('-F', '--rejected-folder', type='string', dest='rejected_folder',
-                          help="destination folder for rejected files (default, don't store them)")
-    opt_parser.add_option('-d', '--depth', type='int', dest='depth', default=5,
-                          help='max depth in link search (default 5)')
-    opt_parser.add_option('-m', '--min-relevancy', type='float', dest='min_relevancy', default=1,
-                          help='Minimum relevancy score to accept documents (only if keywords supplied) (default 1)')
-    opt_parser.add_option('-v', '--verbose', dest='verbose',
-                          action='store_true',
-                          help='verbose output')
-    (options, args) = opt_parser.parse_args()
-
-    # Start logger
-    logger = Logger(options.verbose)
-    logger.console('Process started at %s' % time.strftime("%b %d %Y - %H:%M:%S", time.localtime(start_time)))
-
-    # Obtain queue
-    queue = Queue(options.reset, options.all_domains, options.retries)
-    if options.reset:
-        logger.console('Database wiped.')
-
-    # Check if download folders exist, otherwise create them
-    create_folder(options.download_folder)
-    if options.rejected_folder:
-        create_folder(options.rejected_folder)
-
-    # Split list of keywords
-    if options.keywords:
-        keywords = [x.strip() for x in options.keywords.split(',')]
-    else:
-        keywords = None
-
-    # Section A: Add URL to pending queue
-    if len(args) == 1:
-        # Remove queue
-        if not options.preserve_queue:
-            n = queue.clear()
-            logger.console('Empty queue. %d items deleted.' % n)
-        # Insert URL
-        res = Resource(url=args[0])
-        (item, exists) = queue.add(res)
-        if not exists:
-            logger.console('URL "%s" already on queue.' % item.resource.url)
-        else:
-            logger.console('URL "%s" added to the queue.' % item.resource.url)
-
-    # Section B: Get parser and processor
-    parser = load_class(options.parser)
-    logger.console('Parser %s loaded.' % parser.__name__)
-    processor = load_class(options.processor)
-    logger.console('Processor %s loaded.' % processor.__name__)
-
-    # Section C: Process queue
-    # We will start dispatcher's threads with a random interval
-    logger.console('%d resources in the pending queue.' % len(queue))
-    # Start all threads
-    threads = []
-    for i in range(0, options.threads):
-        # Each thread gets its own parser instance
-        d = Dispatcher(queue, parser(keywords=keywords), processor(keywords=keywords), logger,
-                       max_depth=options.depth,
-                       download_folder=options.download_folder,
-                       rejected_folder=options.rejected_folder,
-                       min_relevancy=options.min_relevancy if keywords else 0)
-        d.start()
-        threads.append(d)
-    logger.console('Started %d threads.' % len(threads))
-    # Wait all for termination
-    for t in threads:
-        t.join()
-
-    logger.console('Exiting.  Process completed at %s in %d seconds.' %
-                   (time.strftime('%b %d %Y - %H:%M:%S', time.localtime()), round(time.time() - start_time, 2)))
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Montycrawler: A multithreaded web crawler designed to obtain and analyze PDF documents.
+
+Author:
+    Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+Usage:
+    python mc.py [options] [URL]
+    Use option --help for details.
+
+"""
+
+from importlib import import_module
+from optparse import OptionParser
+from db.model import Resource
+from engine.queue import Queue
+from engine.dispatcher import Dispatcher
+from engine.controller import Controller
+from engine.resolver import Resolver
+from engine.canonical import Canonicalizer, TRACKING_PARAMS
+from engine.storage import Storage
+from engine.hosts import HostTracker
+import inspect
+import time
+import os
+import errno
+import signal
+from engine.logger import Logger, LogPolicy
+
+# Log policies by default: one row per URL in the logs is redundant with the crawl database
+LOG_POLICIES = ['PROCESS_URL=count', 'PROCESSED_OK=count', 'LINK_FOUND=count']
+
+
+def load_class(name):
+    """Utility function to load a class.
+
+    Args:
+        name: Full class/module name.
+
+    Returns:
+        The loaded class.
+
+    """
+    module_path, _, class_name = name.rpartition('.')
+    mod = import_module(module_path)
+    return getattr(mod, class_name)
+
+
+def create_instance(cls, keywords, **kwargs):
+    """Utility function to instantiate a parser, processor or scorer class.
+
+    Classes written for the first versions only take the keywords, so the other
+    arguments are only passed if the constructor declares them (or `**kwargs`).
+
+    Args:
+        cls: The class.
+        keywords: List of keywords (first argument).
+        **kwargs: Optional arguments.
+
+    Returns:
+        The instance.
+
+    """
+    params = inspect.signature(cls).parameters
+    if not any(param.kind == param.VAR_KEYWORD for param in params.values()):
+        kwargs = {name: value for name, value in kwargs.items() if name in params}
+    return cls(keywords, **kwargs)
+
+
+def create_folder(path):
+    """Utility function to create folder if it doesn't exist.
+
+    Args:
+        path: The path.
+
+    """
+    try:
+        os.makedirs(path)
+        logger.console('Folder "%s" created.' % os.path.abspath(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+# Main program
+if __name__ == '__main__':
+    start_time = time.time()
+    print('Montycrawler. Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>')
+    print('This is free software. See LICENSE.md for details.')
+    # Parse options
+    opt_parser = OptionParser('usage: python %prog [options] [URL]')
+    opt_parser.add_option('-r', '--reset', dest='reset',
+                          action='store_true',
+                          help='reset database (data will be LOST!)')
+    opt_parser.add_option('-p', '--preserve-queue', dest='preserve_queue',
+                          action='store_true',
+                          help="don't remove pending queue (if URL is provided)")
+    opt_parser.add_option('--parser', dest='parser',
+                          help="use CLASS to parse content (default SimpleParser)", metavar="CLASS",
+                          default='parsing.SimpleParser')
+    opt_parser.add_option('--processor', dest='processor',
+                          help="use CLASS to process documents (default PDFProcessor). Contents are passed as "
+                               "bytes, or as seekable streams if CLASS.streams is true", metavar="CLASS",
+                          default='processing.PDFProcessor')
+    opt_parser.add_option('--scorer', dest='scorer',
+                          help="use CLASS to prioritize links (default YieldScorer, empty to use parser priorities)",
+                          metavar="CLASS", default='scoring.YieldScorer')
+    opt_parser.add_option('--fetcher', dest='fetcher',
+                          help="use CLASS to download resources (default Fetcher, engine.http2.Http2Fetcher "
+                               "multiplexes requests over HTTP/2)", metavar="CLASS",
+                          default='engine.fetcher.Fetcher')
+    opt_parser.add_option('--record', type='string', dest='record', metavar='FILE',
+                          help='record the responses in a WARC archive (appended if it exists)')
+    opt_parser.add_option('--replay', type='string', dest='replay', metavar='FILE',
+                          help='serve the responses from a WARC archive recorded with --record, without network')
+    opt_parser.add_option('-a', '--all-domains', dest='all_domains',
+                          action='store_true',
+                          help='add resources from any domain (default only from the same base domain)')
+    opt_parser.add_option('-t', '--threads', type='int', dest='threads', default=10,
+                          help='maximum number of threads fetching at the same time (default 10)')
+    opt_parser.add_option('--min-threads', type='int', dest='min_threads', default=2,
+                          help='minimum number of threads fetching at the same time (default 2)')
+    opt_parser.add_option('-R', '--retries', type='int', dest='retries', default=3,
+                          help='number of threads (default 10)')
+    opt_parser.add_option('-k', '--keywords', type='string', dest='keywords',
+                          help='list of relevant keywords (comma separated without spaces)')
+    opt_parser.add_option('-f', '--download-folder', type='string', dest='download_folder', default='files',
+                          help='destination folder for downloaded files (default "files")')
+    opt_parser.add_option('-F', '--rejected-folder', type='string', dest='rejected_folder',
+                          help="destination folder for rejected files (default, don't store them)")
+    opt_parser.add_option('--shard-depth', type='int', dest='shard_depth', default=0,
+                          help='levels of hashed subdirectories to distribute stored files (default 0, none)')
+    opt_parser.add_option('--writers', type='int', dest='writers', default=2,
+                          help='number of threads writing documents (default 2)')
+    opt_parser.add_option('-d', '--depth', type='int', dest='depth', default=5,
+                          help='max depth in link search (default 5)')
+    opt_parser.add_option('--depth-weights', type='string', dest='depth_weights',
+                          help='comma separated weights of the depths 0, 1, 2... in the order of the queue, the '
+                               'last one for the deeper ones (e.g. 8,4,2,1; by default items go by priority)')
+    opt_parser.add_option('--depth-probe', type='choice', dest='depth_probe', default='head',
+                          choices=['head', 'skip', 'get'],
+                          help='resources at the maximum depth are fetched only if a HEAD request finds a PDF '
+                               '(head), only if their URL is a PDF file (skip) or always (get) (default head)')
+    opt_parser.add_option('--no-prefilter', dest='prefilter', action='store_false', default=True,
+                          help="don't skip URLs by extension or by the MIME types learned for their pattern")
+    opt_parser.add_option('--prefilter-head', dest='prefilter_head', action='store_true',
+                          help='check the MIME type of ambiguous URLs with a HEAD request before fetching them')
+    opt_parser.add_option('--prefilter-allow', type='string', dest='prefilter_allow',
+                          help='comma separated extensions always fetched (besides pdf, html, php...)')
+    opt_parser.add_option('--prefilter-deny', type='string', dest='prefilter_deny',
+                          help='comma separated extensions never fetched (replaces the default list of '
+                               'images, archives, media, office documents, code and fonts)')
+    opt_parser.add_option('-m', '--min-relevancy', type='float', dest='min_relevancy', default=1,
+                          help='Minimum relevancy score to accept documents (only if keywords supplied) (default 1)')
+    opt_parser.add_option('--pdf-mode', type='choice', dest='pdf_mode', default='tiered',
+                          choices=['full', 'tiered', 'metadata'],
+                          help='PDF processing: full (metadata and page text), tiered (page text only while '
+                               'not accepted by metadata) or metadata (default tiered)')
+    opt_parser.add_option('--triage', dest='triage', action='store_true',
+                          help='fetch PDFs partially with range requests to score them, '
+                               'and completely only to store them')
+    opt_parser.add_option('--pdf-pages', type='int', dest='pdf_pages', default=0,
+                          help='maximum number of pages to extract text from, 0 for no limit (default 0)')
+    opt_parser.add_option('--cache-pages', type='int', dest='cache_pages', default=10,
+                          help='pages of text of each PDF kept in the text cache to rescore them, '
+                               '0 to disable the cache (default 10)')
+    opt_parser.add_option('--strip-params', type='string', dest='strip_params',
+                          help='extra query parameters to remove from URLs (comma separated, * as suffix for prefixes)')
+    opt_parser.add_option('--session-pattern', type='string', dest='session_patterns', action='append',
+                          metavar='HOST=REGEX', default=[],
+                          help='remove REGEX from path and query of URLs of HOST (may be repeated)')
+    opt_parser.add_option('--trailing-slash', type='choice', dest='trailing_slash', default='keep',
+                          choices=['keep', 'add', 'strip'],
+                          help='trailing slash policy for URL paths: keep, add or strip (default keep)')
+    opt_parser.add_option('--host-budget', type='int', dest='host_budget', default=0,
+                          help='maximum number of pages fetched from each host in the run (default 0, no limit)')
+    opt_parser.add_option('--deprioritize-after', type='int', dest='deprioritize_after', default=0,
+                          help='pages fetched in the run without accepted documents to deprioritize a host, '
+                               '0 to disable (default 0)')
+    opt_parser.add_option('--stop-after', type='int', dest='stop_after', default=0,
+                          help='pages fetched in the run without accepted documents to stop crawling a host, '
+                               '0 to disable (default 0)')
+    opt_parser.add_option('--rank-interval', type='int', dest='rank_interval', default=60,
+                          help='seconds between link graph rankings of the queue, 0 to disable (default 60)')
+    opt_parser.add_option('--dns-ttl', type='int', dest='dns_ttl', default=300,
+                          help='seconds to cache DNS lookups, 0 to disable the cache (default 300)')
+    opt_parser.add_option('--max-size', type='float', dest='max_size', default=50,
+                          help='maximum size in MB of downloaded content, after decompression (default 50)')
+    opt_parser.add_option('--memory-interval', type='int', dest='memory_interval', default=60,
+                          help='seconds between memory checks, 0 to disable (default 60)')
+    opt_parser.add_option('--max-session-objects', type='int', dest='max_session_objects', default=50000,
+                          help='objects held by database sessions to force recycling them (default 50000)')
+    opt_parser.add_option('--max-rss', type='float', dest='max_rss', default=0,
+                          help='resident memory in MB to force recycling database sessions (default 0, no limit)')
+    opt_parser.add_option('--no-sitemaps', dest='sitemaps', action='store_false', default=True,
+                          help="don't read the sitemaps of the hosts (robots.txt or /sitemap.xml)")
+    opt_parser.add_option('--no-log-db', dest='no_log_db', action='store_true',
+                          help="don't store logs in database (only console output)")
+    opt_parser.add_option('--log-policy', type='string', dest='log_policies', action='append', default=[],
+                          help='store in the log database the messages of a label or level as LABEL=all, '
+                               'LABEL=count (only counters) or LABEL=sample:FRACTION,rate:NUMBER (per second '
+                               'and thread); can be repeated (default %s)' % ', '.join(LOG_POLICIES))
+    opt_parser.add_option('--log-max-size', type='float', dest='log_max_size', default=100,
+                          help='size in MB of the log database to rotate it, 0 for no limit (default 100)')
+    opt_parser.add_option('--log-max-age', type='float', dest='log_max_age', default=0,
+                          help='hours to rotate the log database, 0 for no limit (default 0)')
+    opt_parser.add_option('--log-segments', type='int', dest='log_segments', default=5,
+                          help='rotated log databases kept (default 5)')
+    opt_parser.add_option('-v', '--verbose', dest='verbose',
+                          action='store_true',
+                          help='verbose output')
+    (options, args) = opt_parser.parse_args()
+    if options.record and options.replay:
+        opt_parser.error('options --record and --replay are mutually exclusive')
+
+    # Start logger
+    try:
+        log_policies = dict(LogPolicy.parse(spec) for spec in LOG_POLICIES + options.log_policies)
+    except ValueError as ex:
+        opt_parser.error(str(ex))
+    logger = Logger(options.verbose, db=not options.no_log_db, policies=log_policies,
+                    max_size=options.log_max_size * 1024 * 1024, max_age=options.log_max_age * 3600,
+                    segments=options.log_segments)
+    logger.console('Process started at %s' % time.strftime("%b %d %Y - %H:%M:%S", time.localtime(start_time)))
+
+    # Shared DNS cache
+    resolver = None
+    if options.dns_ttl > 0 and not options.replay:
+        resolver = Resolver(ttl=options.dns_ttl, negative_ttl=min(60, options.dns_ttl))
+        resolver.install()
+
+    # URL canonicalization rules
+    tracking_params = TRACKING_PARAMS
+    if options.strip_params:
+        tracking_params += tuple(x.strip() for x in options.strip_params.split(','))
+    session_patterns = {}
+    for rule in options.session_patterns:
+        host, _, regex = rule.partition('=')
+        session_patterns.setdefault(host, []).append(regex)
+    canonicalizer = Canonicalizer(tracking_params, session_patterns, options.trailing_slash)
+
+    # Obtain queue
+    depth_weights = None
+    if options.depth_weights:
+        try:
+            depth_weights = [float(x) for x in options.depth_weights.split(',')]
+        except ValueError:
+            opt_parser.error('depth weights must be numbers')
+    tracker = HostTracker(options.host_budget, options.deprioritize_after, options.stop_after)
+    queue = Queue(options.reset, options.all_domains, options.retries, resolver, canonicalizer, tracker,
+                  depth_weights)
+    if options.reset:
+        logger.console('Database wiped.')
+
+    # Check if download folders exist, otherwise create them
+    create_folder(options.download_folder)
+    if options.rejected_folder:
+        create_folder(options.rejected_folder)
+
+    # Split list of keywords
+    if options.keywords:
+        keywords = [x.strip() for x in options.keywords.split(',')]
+    else:
+        keywords = None
+
+    # Section A: Add URL to pending queue
+    if len(args) == 1:
+        # Remove queue
+        if not options.preserve_queue:
+            n = queue.clear()
+            logger.console('Empty queue. %d items deleted.' % n)
+        # Insert URL
+        res = Resource(url=args[0])
+        (item, exists) = queue.add(res)
+        if not exists:
+            logger.console('URL "%s" already on queue.' % item.url)
+        else:
+            logger.console('URL "%s" added to the queue.' % item.url)
+
+    # Section B: Get parser and processor
+    parser = load_class(options.parser)
+    logger.console('Parser %s loaded.' % parser.__name__)
+    processor = load_class(options.processor)
+    logger.console('Processor %s loaded.' % processor.__name__)
+    fetcher_class = load_class(options.fetcher)
+    logger.console('Fetcher %s loaded.' % fetcher_class.__name__)
+    scorer = None
+    if options.scorer:
+        scorer = load_class(options.scorer)
+        logger.console('Scorer %s loaded.' % scorer.__name__)
+
+    # Section C: Process queue
+    logger.console('%d resources in the pending queue.' % len(queue))
+    # Number of active fetchers adapts to latency, errors and CPU usage within bounds
+    controller = Controller(min(options.min_threads, options.threads), options.threads, logger)
+    # Documents are written and registered in background
+    storage = Storage(queue, options.download_folder, options.rejected_folder, logger,
+                      workers=options.writers, shard_depth=options.shard_depth)
+    # Shared fetcher with compressed transfers
+    # Large contents are spooled next to the downloads, to be stored by renaming
+    # Responses recorded, or replayed without network
+    archive = None
+    if options.record or options.replay:
+        from engine.archive import Archive
+        archive = Archive(options.record or options.replay, replay=bool(options.replay))
+        logger.console('%s archive %s.' % ('Replaying' if options.replay else 'Recording to', archive.path))
+    fetcher = fetcher_class(int(options.max_size * 1024 * 1024) if options.max_size > 0 else None,
+                            spool_dir=os.path.join(options.download_folder, '.spool'), triage=options.triage,
+                            archive=archive)
+    # Graceful drain on SIGTERM: finish items in progress and leave the rest pending
+    def drain(signum, frame):
+        logger.console('SIGTERM received. Finishing items in progress...')
+        queue.drain()
+    signal.signal(signal.SIGTERM, drain)
+
+    # Start all threads
+    threads = []
+    min_relevancy = options.min_relevancy if keywords else 0
+    # Extracted text shared by processors and kept for later runs
+    cache = None
+    if options.cache_pages > 0:
+        from engine.textcache import TextCache
+        cache = TextCache(max_pages=options.cache_pages)
+    # Checks of the type of resources before fetching them
+    from engine.prefilter import Prefilter
+    if options.prefilter:
+        prefilter = Prefilter(options.prefilter_head,
+                              [x.strip() for x in options.prefilter_allow.split(',')]
+                              if options.prefilter_allow else None,
+                              [x.strip() for x in options.prefilter_deny.split(',')]
+                              if options.prefilter_deny else None)
+    else:
+        # Only for the resources at the maximum depth
+        prefilter = Prefilter(deny=(), learn=False)
+    # Sitemaps of the hosts, read by the first dispatcher fetching from each one
+    sitemaps = None
+    if options.sitemaps:
+        from engine.sitemaps import SitemapReader
+        sitemaps = SitemapReader(queue, fetcher, logger)
+    for i in range(0, options.threads):
+        # Each thread gets its own parser instance
+        d = Dispatcher(queue, parser(keywords=keywords),
+                       create_instance(processor, keywords, mode=options.pdf_mode, min_relevancy=min_relevancy,
+                                       max_pages=options.pdf_pages or None, cache=cache),
+                       logger,
+                       max_depth=options.depth,
+                       storage=storage,
+                       min_relevancy=min_relevancy,
+                       controller=controller,
+                       fetcher=fetcher,
+                       scorer=scorer(keywords=keywords) if scorer else None,
+                       sitemaps=sitemaps,
+                       depth_probe=options.depth_probe,
+                       prefilter=prefilter)
+        d.start()
+        threads.append(d)
+    logger.console('Started %d threads.' % len(threads))
+    # Periodic prioritization by link graph importance
+    if options.rank_interval > 0:
+        from engine.ranking import LinkRanker
+        LinkRanker(queue, logger, options.rank_interval).start()
+    # Memory usage reports and forced recycling of database sessions
+    if options.memory_interval > 0:
+        from engine.watchdog import MemoryWatchdog
+        MemoryWatchdog(queue, [r for r in (queue.recycler, logger.recycler) if r], logger,
+                       options.memory_interval, options.max_session_objects, options.max_rss or None).start()
+
+    # Wait all for termination
+    for t in threads:
+        t.join()
+    storage.close()
+    fetcher.close()
+    if archive:
+        archive.close()
+        logger.console('Archive: %d responses recorded, %d requests not found.' % (archive.records, archive.misses))
+    queue.close()
+    skipped = sum(t.skipped for t in threads)
+    if skipped:
+        logger.console('Maximum depth: %d resources not fetched.' % skipped)
+    logger.console('Prefilter: %d fetches avoided (%d by extension, %d by URL pattern, %d by HEAD), '
+                   '%d HEAD requests, %.1f KB saved.' %
+                   (sum(prefilter.avoided.values()), prefilter.avoided['extension'], prefilter.avoided['pattern'],
+                    prefilter.avoided['head'], prefilter.heads, prefilter.saved / 1024))
+    transferred = sum(s[1] for s in fetcher.stats.values())
+    logger.console('Transferred %.1f KB (compression ratio %.2f).' %
+                   (transferred / 1024, fetcher.compression_ratio()))
+    for host, (responses, host_transferred, decoded) in sorted(fetcher.stats.items()):
+        logger.debug('Host %s: %d responses, %d bytes transferred, %d decoded (ratio %.2f)' %
+                     (host, responses, host_transferred, decoded, fetcher.compression_ratio(host)))
+    for host, state, fetched, pdfs, accepted, size in tracker.summary():
+        logger.debug('Host %s (%s): %d fetched, %d PDFs, %d accepted, %d bytes' %
+                     (host, state, fetched, pdfs, accepted, size))
+    if cache:
+        logger.console('Text cache: %d hits, %d misses.' % (cache.hits, cache.misses))
+    if resolver:
+        resolver.uninstall()
+        logger.console('DNS cache: %d hits, %d misses.' % (resolver.hits, resolver.misses))
+
+    logger.flush()
+    logger.console('Exiting.  Process completed at %s in %d seconds.' %
+                   (time.strftime('%b %d %Y - %H:%M:%S', time.localtime()), round(time.time() - start_time, 2)))
@@ -1,82 +1,201 @@
-from io import BytesIO
-from PyPDF2 import PdfFileReader
-
-# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
-
-# This file is part of Montycrawler.
-
-# Montycrawler is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, either version 3 of the License, or
-# (at your option) any later version.
-
-# Montycrawler is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-# GNU General Public License for more details.
-
-# You should have received a copy of the GNU General Public License
-# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
-
-
-class PDFProcessor:
-    """Get metadata and guess relevancy of PDF documents"""
-    def __init__(self, keywords=None):
-        """Initialize the processor.
-        Args:
-            keywords: List of relevant keywords to search.
-        """
-        self.keywords = keywords
-
-    def process(self, content, mimetype='application/pdf'):
-        """Process a PDF document.
-        Args:
-            content: Binary content of the document.
-            mimetype: Id of MIME type (content ignored if it isn't `application/pdf`).
-        Returns:
-            Tuple:
-                Relevancy of the document (based on keywords)
-                Metadata extracted from the document (dictionary).
-        """
-        relevancy = 0
-        metadata = {}
-        if mimetype == 'application/pdf':
-            # Obtain metadata
-            doc = PdfFileReader(BytesIO(content))
-            info = doc.getDocumentInfo()
-            if info:
-                for k in info:
-                    metadata[k] = info.getText(k)
-            # Extra metadata
-            metadata['_num_pages'] = doc.getNumPages()
-            # Process title, subject and metadata keywords
-            # TODO guess title from page text when not provided
-            if self.keywords:
-                relevant = (metadata.get('/Title', '') + ' ' +
-                            metadata.get('/Subject', '') + ' ' +
-                            metadata.get('/Keywords', '')).lower()
-                for word in self.keywords:
-                    if word.lower() in relevant:
-                        # Each relevant keyword increases relevancy in 10 points
-                        relevancy += 10
-                # Process pages.
-                distance_factor = 1
-                for p in range(doc.getNumPages()):
-                    # Break if factor is too low
-                    if distance_factor < 0.01:
-                        break
-                    try:
-                        text = doc.getPage(p).extractText().lower()
-                        for word in self.keywords:
-                            relevancy += distance_factor * text.count(word.lower())
-                    except Exception as ex:
-                        # Some bad formed PDFs raise decoding errors. Skip page.
-                        pass
-                    # Each new page reduces relevancy factor in a half
-                    distance_factor /= 2
-            # Relevancy is significant by the nearest tenth
-            relevancy = round(relevancy, 1)
-        else:
-            relevancy = 0
-        metadata['_relevancy'] = relevancy
-        return relevancy, metadata
+from io import BytesIO
+from engine.textcache import content_hash
+
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Processing modes
+FULL = 'full'
+TIERED = 'tiered'
+METADATA = 'metadata'
+MODES = (FULL, TIERED, METADATA)
+
+
+class PDFProcessor:
+    """Get metadata and guess relevancy of PDF documents
+
+    Modes:
+        `full`: Score metadata and the text of the first pages.
+        `tiered`: Score metadata first (it only needs the trailer, the info dictionary
+            and the page tree root) and extract page text only while the document
+            isn't yet accepted. Accepted documents get a lower bound of the relevancy.
+        `metadata`: Score metadata only.
+    """
+    # Contents are passed as seekable streams, not copied to bytes (see `Dispatcher`)
+    streams = True
+
+    def __init__(self, keywords=None, mode=FULL, min_relevancy=None, max_pages=None, cache=None):
+        """Initialize the processor.
+        Args:
+            keywords: List of relevant keywords to search.
+            mode: Processing mode (`full`, `tiered` or `metadata`).
+            min_relevancy: Relevancy to accept documents (to stop processing in `tiered` mode).
+            max_pages: Maximum number of pages to extract text from (all by default).
+            cache: `TextCache` instance to reuse the text of documents already processed (optional).
+        """
+        if mode not in MODES:
+            raise ValueError('Unknown processing mode "%s"' % mode)
+        self.keywords = keywords
+        self.mode = mode
+        self.min_relevancy = min_relevancy
+        self.max_pages = max_pages
+        self.cache = cache
+
+    def decided(self, relevancy):
+        """Checks if the relevancy is enough to stop processing.
+        Args:
+            relevancy: Relevancy accumulated so far.
+        Returns:
+            T/F the document is accepted and no more processing is needed.
+        """
+        return self.mode == TIERED and self.min_relevancy is not None and relevancy >= self.min_relevancy
+
+    def process(self, content, mimetype='application/pdf'):
+        """Process a PDF document.
+        Args:
+            content: Binary content of the document (bytes or seekable binary stream).
+            mimetype: Id of MIME type (content ignored if it isn't `application/pdf`).
+        Returns:
+            Tuple:
+                Relevancy of the document (based on keywords)
+                Metadata extracted from the document (dictionary).
+        """
+        relevancy = 0
+        metadata = {}
+        if mimetype == 'application/pdf':
+            digest = content_hash(content) if self.cache else None
+            cached = self.cache.get(digest) if digest else None
+            if cached:
+                metadata, texts = cached
+                doc = None
+            else:
+                # Obtain metadata (the reader parses the cross-reference table and loads objects on demand)
+                doc = pdf_reader(content)
+                info = doc.getDocumentInfo()
+                if info:
+                    for k in info:
+                        metadata[k] = info.getText(k)
+                # Extra metadata
+                metadata['_num_pages'] = num_pages(doc)
+                texts = []
+            extracted = len(texts)
+
+            def page_text(p):
+                """Normalized text of a page, extracted on demand."""
+                nonlocal doc
+                while len(texts) <= p:
+                    if doc is None:
+                        doc = pdf_reader(content)
+                    try:
+                        texts.append(normalize(doc.getPage(len(texts)).extractText()))
+                    except Exception as ex:
+                        # Some bad formed PDFs raise decoding errors. Skip page.
+                        texts.append('')
+                return texts[p]
+
+            relevancy = self.score(metadata, page_text)
+            if digest and (not cached or len(texts) > extracted):
+                self.cache.put(digest, metadata, texts)
+            if digest:
+                metadata = dict(metadata, _sha1=digest)
+        else:
+            relevancy = 0
+        metadata['_relevancy'] = relevancy
+        return relevancy, metadata
+
+    def score(self, metadata, page_text):
+        """Compute the relevancy of a document.
+        Args:
+            metadata: Metadata of the document (dictionary with `_num_pages`).
+            page_text: Function returning the normalized text of a page by index.
+        Returns:
+            Relevancy of the document (based on keywords).
+        """
+        relevancy = 0
+        # Process title, subject and metadata keywords
+        # TODO guess title from page text when not provided
+        if self.keywords:
+            relevant = (metadata.get('/Title', '') + ' ' +
+                        metadata.get('/Subject', '') + ' ' +
+                        metadata.get('/Keywords', '')).lower()
+            for word in self.keywords:
+                if word.lower() in relevant:
+                    # Each relevant keyword increases relevancy in 10 points
+                    relevancy += 10
+            # Process pages.
+            distance_factor = 1
+            pages = metadata.get('_num_pages', 0) if self.mode != METADATA else 0
+            if self.max_pages is not None:
+                pages = min(pages, self.max_pages)
+            for p in range(pages):
+                # Break if factor is too low or the document is already accepted
+                if distance_factor < 0.01 or self.decided(relevancy):
+                    break
+                text = page_text(p)
+                for word in self.keywords:
+                    relevancy += distance_factor * text.count(normalize(word))
+                # Each new page reduces relevancy factor in a half
+                distance_factor /= 2
+        # Relevancy is significant by the nearest tenth
+        return round(relevancy, 1)
+
+
+def pdf_reader(content):
+    """Open a PDF document.
+
+    Note:
+        PyPDF2 is imported on first use, so crawls that don't find PDFs don't pay its import.
+
+    Args:
+        content: Binary content of the document (bytes or seekable binary stream).
+
+    Returns:
+        `PdfFileReader` instance.
+    """
+    from PyPDF2 import PdfFileReader
+    return PdfFileReader(BytesIO(content) if isinstance(content, bytes) else content)
+
+
+def normalize(text):
+    """Normalize text to search keywords: lowercase, with whitespace runs as single spaces.
+
+    Args:
+        text: The text.
+
+    Returns:
+        Normalized text.
+    """
+    return ' '.join(text.lower().split())
+
+
+def num_pages(doc):
+    """Number of pages of a PDF document.
+
+    Reads the count of the root of the page tree, instead of flattening the
+    whole tree like `PdfFileReader.getNumPages` does.
+
+    Args:
+        doc: `PdfFileReader` instance.
+
+    Returns:
+        Number of pages.
+    """
+    try:
+        return int(doc.trailer['/Root'].getObject()['/Pages'].getObject()['/Count'])
+    except (KeyError, TypeError, ValueError):
+        return doc.getNumPages()
@@ -0,0 +1,310 @@
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Montycrawler rescoring: recompute relevancy and acceptance of stored documents.
+
+Documents are scored from the text cache (see `--cache-pages` of mc.py) when
+possible, so any keyword set can be applied without parsing them again. Documents
+not in the cache are parsed from their files in the download or rejected folders.
+Documents are processed in parallel by a pool of processes and updated in batches.
+
+The progress is saved in a cursor file after each batch, so an interrupted run
+continues where it stopped when it's launched again with the same options.
+
+Usage:
+    python rescore.py [options]
+    Use option --help for details.
+
+"""
+
+from optparse import OptionParser
+from multiprocessing import Pool, cpu_count
+from db.model import Base, Document
+from db.utils import setupdb
+from engine.textcache import TextCache
+import datetime
+import mmap
+import json
+import time
+import shutil
+import errno
+import os
+from mc import load_class, create_instance
+
+# Processor of each worker process
+processor = None
+
+
+def init_worker(processor_class, keywords, kwargs):
+    """Initialize a worker process with its own processor and text cache connection.
+
+    The cache is read-only in the workers: the texts they extract are stored by
+    the main process (see `rescore`), so there's a single writer of the database.
+
+    Args:
+        processor_class: Full class name of the processor.
+        keywords: List of relevant keywords.
+        kwargs: Keyword arguments of the processor (except the cache), passed if it declares them.
+    """
+    global processor
+    processor = create_instance(load_class(processor_class), keywords, cache=TextCache(read_only=True), **kwargs)
+
+
+def score_document(task):
+    """Score a document (in a worker process).
+
+    Errors are returned instead of raised, so a bad document (a corrupt PDF, an
+    unreadable file...) doesn't stop the run.
+
+    Args:
+        task: Tuple of document ID, metadata (JSON) and candidate paths of the file.
+
+    Returns:
+        Tuple of document ID, relevancy, metadata (JSON), error message and texts to cache
+        (list of arguments of `TextCache.put`). Relevancy and metadata are `None` if
+        the document isn't scored: it failed (error message) or there's neither file
+        nor cached text of it (no error message).
+    """
+    doc_id, meta_data, paths = task
+    try:
+        relevancy, metadata = _score(meta_data, paths)
+    except Exception as ex:
+        relevancy, metadata = None, '%s: %s' % (type(ex).__name__, ex)
+    # Texts extracted are stored by the main process
+    entries, processor.cache.pending = processor.cache.pending, []
+    if relevancy is None:
+        return doc_id, None, None, metadata, entries
+    return doc_id, relevancy, json.dumps(metadata), None, entries
+
+
+def _score(meta_data, paths):
+    """Score a document from its file or its cached text (see `score_document`).
+
+    Returns:
+        Tuple of relevancy and metadata, or of `None` and `None` if there's neither
+        file nor cached text of the document.
+    """
+    metadata = json.loads(meta_data) if meta_data else {}
+    for path in paths:
+        if os.path.isfile(path) and os.path.getsize(path):
+            # Cached text is used if the content is there, and missing pages parsed
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                # Processors not reading streams get bytes (see `Dispatcher`)
+                return processor.process(content if getattr(processor, 'streams', False) else content[:])
+    cached = processor.cache.get(metadata['_sha1']) if '_sha1' in metadata else None
+    if cached is None:
+        return None, None
+    # Without the file only the cached pages can be scored
+    texts = cached[1]
+    relevancy = processor.score(cached[0], lambda p: texts[p] if p < len(texts) else '')
+    metadata['_relevancy'] = relevancy
+    return relevancy, metadata
+
+
+def move(source, destination):
+    """Move a file without copying it, if possible.
+
+    Args:
+        source: Current path.
+        destination: New path (`None` to delete the file).
+    """
+    if destination is None:
+        os.unlink(source)
+        return
+    folder = os.path.dirname(destination)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    try:
+        os.replace(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source, destination)
+
+
+def rescore(session, pool, folders, min_relevancy, move_files=False, cursor_file=None,
+            batch_size=1000, progress=None, cache=None, failure=None):
+    """Recompute relevancy and acceptance of all the PDF documents.
+
+    Args:
+        session: Database session (scoped session factory).
+        pool: Pool of worker processes initialized with `init_worker`.
+        folders: Tuple of folders of accepted and rejected documents (`None` if not stored).
+        min_relevancy: Minimum relevancy to accept documents.
+        move_files: T/F move the files of documents that change acceptance to their new folder
+            (files of documents rejected now are deleted if there's no rejected folder).
+        cursor_file: Path of the file to save the progress (optional).
+        batch_size: Number of documents updated at once.
+        progress: Function called after each batch with the numbers of documents done and total.
+        cache: `TextCache` to store the texts extracted by the workers (optional).
+        failure: Function called with the ID and the error message of each document failed.
+
+    Returns:
+        Tuple of numbers of documents rescored, changed (accepted or rejected now), moved,
+        skipped and failed.
+    """
+    last_id = load_cursor(cursor_file)
+    total = session().query(Document).filter(Document.type == 'application/pdf', Document.id > last_id).count()
+    rescored = changed = moved = skipped = failed = done = 0
+    while True:
+        # Keyset pagination: each batch starts after the last committed one
+        rows = session().query(Document.id, Document.meta_data, Document.filename, Document.accepted,
+                               Document.relevancy) \
+            .filter(Document.type == 'application/pdf', Document.id > last_id) \
+            .order_by(Document.id).limit(batch_size).all()
+        if not rows:
+            break
+        state = {}
+        tasks = []
+        for doc_id, meta_data, filename, accepted, relevancy in rows:
+            # Look first in the folder of its current state (a previous run may have moved it)
+            candidates = [f for f in (folders if accepted else folders[::-1]) if f]
+            paths = [os.path.join(f, filename) for f in candidates] if filename else []
+            state[doc_id] = (bool(accepted), filename, relevancy)
+            tasks.append((doc_id, meta_data, paths))
+        updates = []
+        for doc_id, relevancy, meta_data, error, entries in pool.imap_unordered(score_document, tasks, 16):
+            if cache:
+                for entry in entries:
+                    cache.put(*entry)
+            if error:
+                failed += 1
+                if failure:
+                    failure(doc_id, error)
+                continue
+            if relevancy is None:
+                skipped += 1
+                continue
+            rescored += 1
+            accepted = relevancy >= min_relevancy
+            was_accepted, filename, old_relevancy = state[doc_id]
+            if accepted != was_accepted:
+                changed += 1
+                if move_files and filename:
+                    source = folders[0] if was_accepted else folders[1]
+                    destination = folders[0] if accepted else folders[1]
+                    # Not stored, or already moved by an interrupted run
+                    if source and os.path.isfile(os.path.join(source, filename)):
+                        move(os.path.join(source, filename),
+                             os.path.join(destination, filename) if destination else None)
+                        moved += 1
+            update = {'id': doc_id, 'relevancy': relevancy, 'accepted': accepted, 'meta_data': meta_data}
+            if accepted != was_accepted or old_relevancy is None or round(relevancy, 1) != float(old_relevancy):
+                # Exported again by export.py
+                update['modified'] = datetime.datetime.utcnow()
+            updates.append(update)
+        session().bulk_update_mappings(Document, updates)
+        session().commit()
+        last_id = rows[-1][0]
+        save_cursor(cursor_file, last_id)
+        done += len(rows)
+        if progress:
+            progress(done, total)
+    return rescored, changed, moved, skipped, failed
+
+
+def load_cursor(path):
+    """Read the last document ID committed by an interrupted run.
+
+    Args:
+        path: Path of the cursor file (`None` for no cursor).
+
+    Returns:
+        The document ID (0 to start from the beginning).
+    """
+    if not path or not os.path.isfile(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)['last_id']
+
+
+def save_cursor(path, last_id):
+    """Save the last document ID committed.
+
+    Args:
+        path: Path of the cursor file (`None` for no cursor).
+        last_id: The document ID.
+    """
+    if path:
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'last_id': last_id}, f)
+        os.replace(path + '.tmp', path)
+
+
+# Main program
+if __name__ == '__main__':
+    start_time = time.time()
+    opt_parser = OptionParser('usage: python %prog [options]')
+    opt_parser.add_option('-k', '--keywords', type='string', dest='keywords',
+                          help='list of relevant keywords (comma separated without spaces)')
+    opt_parser.add_option('-m', '--min-relevancy', type='float', dest='min_relevancy', default=1,
+                          help='Minimum relevancy score to accept documents (only if keywords supplied) (default 1)')
+    opt_parser.add_option('-f', '--download-folder', type='string', dest='download_folder', default='files',
+                          help='folder of accepted files (default "files")')
+    opt_parser.add_option('-F', '--rejected-folder', type='string', dest='rejected_folder',
+                          help='folder of rejected files (default, not stored)')
+    opt_parser.add_option('--move', dest='move', action='store_true',
+                          help='move files of documents that change acceptance to their new folder '
+                               '(files of rejected documents are deleted without a rejected folder)')
+    opt_parser.add_option('--processor', dest='processor',
+                          help="use CLASS to process documents (default PDFProcessor)", metavar="CLASS",
+                          default='processing.PDFProcessor')
+    opt_parser.add_option('--pdf-mode', type='choice', dest='pdf_mode', default='tiered',
+                          choices=['full', 'tiered', 'metadata'],
+                          help='PDF processing: full, tiered or metadata, as in mc.py (default tiered)')
+    opt_parser.add_option('--pdf-pages', type='int', dest='pdf_pages', default=0,
+                          help='maximum number of pages to extract text from, 0 for no limit (default 0)')
+    opt_parser.add_option('-j', '--jobs', type='int', dest='jobs', default=cpu_count(),
+                          help='number of worker processes (default, number of CPUs)')
+    opt_parser.add_option('-b', '--batch-size', type='int', dest='batch_size', default=1000,
+                          help='documents updated at once (default 1000)')
+    opt_parser.add_option('--cursor', type='string', dest='cursor', default='rescore.cursor',
+                          help='file to save the progress to resume interrupted runs (default "rescore.cursor")')
+    opt_parser.add_option('--restart', dest='restart', action='store_true',
+                          help='ignore the progress of an interrupted run')
+    (options, args) = opt_parser.parse_args()
+
+    if options.restart and os.path.isfile(options.cursor):
+        os.unlink(options.cursor)
+    elif load_cursor(options.cursor):
+        print('Resuming after document %d.' % load_cursor(options.cursor))
+    keywords = [x.strip() for x in options.keywords.split(',')] if options.keywords else None
+    min_relevancy = options.min_relevancy if keywords else 0
+    kwargs = dict(mode=options.pdf_mode, min_relevancy=min_relevancy,
+                  max_pages=options.pdf_pages or None)
+
+    def report(done, total):
+        elapsed = time.time() - start_time
+        print('%d/%d documents (%.1f%%), %.0f documents/s' %
+              (done, total, 100.0 * done / total if total else 100, done / elapsed if elapsed else 0))
+
+    def fail(doc_id, error):
+        print('Document %d failed: %s' % (doc_id, error))
+
+    # Created before the workers, which open it read-only
+    cache = TextCache()
+    with Pool(options.jobs, init_worker, (options.processor, keywords, kwargs)) as pool:
+        rescored, changed, moved, skipped, failed = rescore(setupdb('db', Base), pool,
+                                                            (options.download_folder, options.rejected_folder),
+                                                            min_relevancy, options.move, options.cursor,
+                                                            options.batch_size, report, cache, fail)
+    # Finished: the next run starts from the beginning
+    if os.path.isfile(options.cursor):
+        os.unlink(options.cursor)
+    print('%d documents rescored, %d changed acceptance (%d files moved), '
+          '%d skipped (neither file nor cached text), %d failed in %d seconds.' %
+          (rescored, changed, moved, skipped, failed, round(time.time() - start_time)))
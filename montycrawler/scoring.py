@@ -0,0 +1,90 @@
+# Copyright 2016 Jose A. Brihuega Parodi <jose.brihuega@uca.es>
+
+# This file is part of Montycrawler.
+
+# Montycrawler is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Montycrawler is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Montycrawler.  If not, see <http://www.gnu.org/licenses/>.
+
+from urllib.parse import urljoin, urlsplit
+from engine.history import url_tokens
+import math
+
+
+class YieldScorer:
+    """Scores links by their expected yield of accepted documents.
+
+    The score is a linear combination of features of the link: URL tokens
+    (weighted with the yield learned during the crawl), anchor text, path depth,
+    yield of the host and relevancy of the documents found around the referrer.
+    """
+    # Feature weights
+    hint_weight = 10
+    extension_weight = 20
+    keyword_weight = 5
+    token_weight = 3
+    host_weight = 20
+    depth_penalty = 1
+    referrer_weight = 2
+    # Maximum priority
+    scale = 100
+
+    def __init__(self, keywords=None):
+        """Initialize the scorer.
+
+        Args:
+            keywords: List of relevant keywords.
+        """
+        self.keywords = [k.lower() for k in keywords] if keywords else []
+
+    def score(self, referrer_url, referrer_relevancy, links, history):
+        """Score the links found in a page.
+
+        Args:
+            referrer_url: URL of the page.
+            referrer_relevancy: Relevancy of the documents found around the page.
+            links: List of tuples of:
+                Link (str)
+                Text of link (str)
+                Priority given by the parser (int or None)
+            history: `YieldHistory` instance.
+
+        Returns:
+            List of priorities (int between 1 and `scale`, or None for links not
+            expected to yield documents), in the same order.
+        """
+        # Features shared by all the links of the page
+        base = self.referrer_weight * math.log1p(referrer_relevancy or 0)
+        host_yields = {}
+        priorities = []
+        for link, text, hint in links:
+            url = urljoin(referrer_url, link or '')
+            parts = urlsplit(url)
+            host = parts.netloc
+            if host not in host_yields:
+                # Hosts above the average yield get a bonus, hosts below it a penalty
+                host_yields[host] = self.host_weight * (history.host_yield(host) - history.rate)
+            score = base + host_yields[host]
+            if hint:
+                score += self.hint_weight
+            if parts.path.lower().endswith('.pdf'):
+                score += self.extension_weight
+            tokens = url_tokens(url)
+            score += self.token_weight * sum(history.token_weight(t) for t in tokens)
+            if self.keywords:
+                words = ((text or '') + ' ' + ' '.join(tokens)).lower()
+                score += self.keyword_weight * sum(1 for k in self.keywords if k in words)
+            score -= self.depth_penalty * max(0, parts.path.count('/') - 3)
+            priority = min(self.scale, int(round(score)))
+            # Links hinted by the parser keep a positive priority
+            priorities.append(priority if priority > 0 else (1 if hint else None))
+        return priorities